@@ -0,0 +1,75 @@
+'''
+Import-time budget of the STAGES landing page and pages.
+
+Runs the import statements of each page in a fresh interpreter, reports the time taken and fails if a page goes over its budget
+or loads one of the heavy libraries that should only be imported by the code path that uses them.
+
+Usage
+-----
+python benchmarks/import_budget.py [--budget 2.0] [--repeat 3]
+'''
+import argparse
+import ast
+import glob
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFERRED = ["gseapy", "decoupler", "anndata", "scanpy", "statsmodels", "phik", "seaborn", "dateparser"]
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+exec(compile(sys.argv[1], "<imports>", "exec"))
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "loaded": sorted(m for m in sys.argv[2].split(",") if m in sys.modules)}))
+'''
+
+def page_imports(path):
+    '''
+    Returns the top-level import statements of a page as source code
+    '''
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    return "\n".join(ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+def measure(code, repeat=3):
+    '''
+    Fastest of repeat cold imports of code, with the deferred libraries it loaded
+    '''
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", PROBE, code, ",".join(DEFERRED)], cwd=ROOT, capture_output=True, text=True,
+                             env={**os.environ, "PYTHONPATH": ROOT})
+        if out.returncode != 0:
+            raise RuntimeError(out.stderr.strip().splitlines()[-1])
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return min(r["seconds"] for r in runs), runs[0]["loaded"]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--budget", type=float, default=2.0, help="maximum import time of a page in seconds")
+    parser.add_argument("--repeat", type=int, default=3, help="cold imports per page, the fastest is reported")
+    args = parser.parse_args(argv)
+
+    pages = [os.path.join(ROOT, "stages.py")] + sorted(glob.glob(os.path.join(ROOT, "pages", "*.py")))
+    failed = []
+    for page in pages:
+        name = os.path.relpath(page, ROOT)
+        try:
+            seconds, loaded = measure(page_imports(page), repeat=args.repeat)
+        except RuntimeError as e:
+            print(f"{name:45s}   skipped ({e})")
+            continue
+        over = seconds > args.budget or len(loaded) != 0
+        print(f"{name:45s} {seconds:6.2f}s {'FAIL' if over else 'ok'}{' loads ' + ', '.join(loaded) if loaded else ''}")
+        if over:
+            failed.append(name)
+    if failed:
+        print(f"Over budget: {', '.join(failed)}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
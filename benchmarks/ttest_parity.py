@@ -0,0 +1,89 @@
+'''
+Parity of the vectorised t-tests of RNAseq.pval_scipy with per-gene scipy.stats.ttest_ind(nan_policy='omit').
+
+Builds a random samples x genes AnnData with NaNs, genes left with fewer than 2 values in a group, a group of one sample and
+zero-variance genes (equal and different means), runs every baseline/comparison pair through pval_scipy for Welch's and
+Student's t-tests, and fails if any p-value differs from scipy by more than the tolerance or disagrees on NaN.
+
+Usage
+-----
+python benchmarks/ttest_parity.py [--genes 2000] [--seed 0] [--rtol 1e-6]
+'''
+import argparse
+import os
+import sys
+import warnings
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def make_adata(genes=2000, seed=0):
+    '''
+    Random log2 expression of 4 groups (ctl, a, b with 5-7 samples and "single" with 1 sample) and the edge-case genes
+    '''
+    from anndata import AnnData
+
+    rng = np.random.default_rng(seed)
+    groups = ["ctl"] * 6 + ["a"] * 5 + ["b"] * 7 + ["single"]
+    X = rng.normal(8, 2, (len(groups), genes))
+    X[rng.random(X.shape) < 0.1] = np.nan # scattered NaNs
+    obs = pd.DataFrame({"group": groups}, index=[f"s{i}" for i in range(len(groups))])
+    is_ctl, is_a = obs["group"].to_numpy() == "ctl", obs["group"].to_numpy() == "a"
+
+    X[is_ctl, 0] = np.nan # no baseline values
+    X[np.flatnonzero(is_a)[1:], 1] = np.nan # one value left in a
+    X[:, 2] = 5.0 # zero variance, equal means
+    X[is_ctl, 3], X[~is_ctl, 3] = 5.0, 7.0 # zero variance, different means
+    X[is_ctl, 4] = 3.0 # zero variance in the baseline only
+    X[:, 5] = np.nan # no values at all
+    return AnnData(X=X.astype(np.float32), obs=obs, var=pd.DataFrame(index=[f"G{i}" for i in range(genes)]))
+
+def scipy_pvals(adata, baseline, against_baseline, equalvar):
+    '''
+    Per-gene scipy.stats.ttest_ind(base, comp, nan_policy='omit'), with the column names of pval_scipy
+    '''
+    from scipy import stats
+
+    X = np.asarray(adata.X, dtype=np.float64)
+    group = adata.obs["group"].to_numpy()
+    cols = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for base in baseline:
+            for comp in against_baseline:
+                res = stats.ttest_ind(X[group == base], X[group == comp], equal_var=equalvar, nan_policy='omit', axis=0)
+                cols[f"pval_{comp}_vs_{base}"] = np.asarray(res.pvalue, dtype=np.float64)
+    return pd.DataFrame(cols, index=adata.var_names)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--genes", type=int, default=2000, help="number of genes, at least 6 for the edge cases")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the expression data")
+    parser.add_argument("--rtol", type=float, default=1e-6, help="relative tolerance of the p-values")
+    args = parser.parse_args(argv)
+
+    from helper_functions.preprocessing import counts_pp
+
+    adata = make_adata(args.genes, args.seed)
+    baseline, against_baseline = ["ctl", "single"], ["a", "b"]
+    failed = []
+    for equalvar, name in [(False, "Welch"), (True, "Student")]:
+        ours = counts_pp.pval_scipy(adata, "group", baseline, against_baseline, equalvar=equalvar)
+        ref = scipy_pvals(adata, baseline, against_baseline, equalvar)
+        for col in ref.columns:
+            a, b = ours[col].to_numpy(dtype=np.float64), ref[col].to_numpy()
+            nan_diff = np.isnan(a) != np.isnan(b)
+            close = np.isclose(a, b, rtol=args.rtol, atol=0, equal_nan=True)
+            bad = np.flatnonzero(nan_diff | ~close)
+            print(f"{name:8s} {col:25s} {len(bad):5d} mismatches, {int(np.isnan(b).sum())} NaN in scipy")
+            if len(bad) != 0:
+                failed.append(f"{name} {col} ({', '.join(adata.var_names[bad[:5]])})")
+    if failed:
+        print(f"Not matching scipy: {'; '.join(failed)}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
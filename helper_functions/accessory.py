@@ -0,0 +1,22 @@
+import os
+
+ACCESSORY_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "accessory_files")
+
+def accessory_file(*parts):
+    '''
+    Absolute path of a file shipped in accessory_files, so that it is found whatever the working directory
+
+    Parameters
+    ----------
+    parts: str | path under accessory_files, eg. "BTM.gmt"
+    '''
+    return os.path.join(ACCESSORY_DIR, *parts)
+
+def bundled_path(path):
+    '''
+    Returns path, or the shipped file it names (eg. "accessory_files/BTM.gmt") if it is relative and not found from the working directory
+    '''
+    if os.path.isabs(path) or os.path.exists(path):
+        return path
+    candidate = os.path.join(os.path.dirname(ACCESSORY_DIR), path)
+    return candidate if os.path.exists(candidate) else path
@@ -0,0 +1,112 @@
+import functools
+import hashlib
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from helper_functions.disk_cache import cache_dir, file_token
+from helper_functions.accessory import accessory_file
+
+BACKGROUND_FILE = accessory_file("hsapiens_gene_ensembl.txt")
+REFRESH_INTERVAL = 90 * 24 * 3600 # seconds before the Biomart table is refreshed
+
+class BackgroundUniverse():
+    '''
+    Human gene universe used as the Enrichr background, indexed by gene symbol.
+
+    Holds one row per gene symbol that has an Entrez ID, with its Entrez and Ensembl IDs as aligned arrays so that lookups
+    are a single get_indexer call. Symbols are matched case-insensitively since uploaded genes are upper-cased.
+    '''
+    def __init__(self, symbols, entrez, ensembl):
+        '''
+        Parameters
+        ----------
+        symbols: np.ndarray | unique official gene symbols
+        entrez: np.ndarray | int64 Entrez IDs aligned to symbols
+        ensembl: np.ndarray | Ensembl gene IDs aligned to symbols (first ID if a symbol has several)
+        '''
+        self.symbols = symbols
+        self.entrez = entrez
+        self.ensembl = ensembl
+        self.genes = pd.Index(symbols)
+        self.lookup = pd.Index(np.char.upper(symbols.astype(str)))
+        self.token = hashlib.blake2b(symbols.tobytes() + entrez.tobytes(), digest_size=16).hexdigest()
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, gene):
+        return str(gene).upper() in self.lookup
+
+    @classmethod
+    def from_table(cls, filename):
+        '''
+        Builds the universe from the Biomart export (ensembl_gene_id, external_gene_name, entrezgene_id), keeping genes with an Entrez ID
+        '''
+        query = pd.read_csv(filename, sep="\t")
+        query = query.dropna(subset=["external_gene_name", "entrezgene_id"])
+        query = query.drop_duplicates(subset="external_gene_name", keep="first")
+        return cls(symbols=query["external_gene_name"].to_numpy(dtype=str),
+                   entrez=query["entrezgene_id"].to_numpy(dtype=np.int64),
+                   ensembl=query["ensembl_gene_id"].to_numpy(dtype=str))
+
+    @classmethod
+    def load(cls, filename=BACKGROUND_FILE):
+        '''
+        Loads the universe from its compiled .npz next to the cache, compiling it from the table on first use or when the table changed
+        '''
+        compiled = os.path.join(cache_dir("background"), f"{file_token(filename)}.npz")
+        if os.path.exists(compiled):
+            with np.load(compiled) as arrays:
+                return cls(arrays["symbols"], arrays["entrez"], arrays["ensembl"])
+        universe = cls.from_table(filename)
+        tmp = f"{compiled}.{os.getpid()}.tmp.npz"
+        np.savez(tmp, symbols=universe.symbols, entrez=universe.entrez, ensembl=universe.ensembl)
+        os.replace(tmp, compiled)
+        return universe
+
+    def locate(self, genes):
+        return self.lookup.get_indexer(pd.Index(genes).astype(str).str.upper())
+
+    def to_entrez(self, genes):
+        '''
+        Returns a Series of Entrez IDs indexed by the given symbols, <NA> for symbols outside the universe
+        '''
+        idx = self.locate(genes)
+        ids = pd.array(np.where(idx >= 0, self.entrez[idx], 0), dtype="Int64")
+        ids[idx < 0] = pd.NA
+        return pd.Series(ids, index=genes, name="entrezgene_id")
+
+    def to_ensembl(self, genes):
+        '''
+        Returns a Series of Ensembl gene IDs indexed by the given symbols, NaN for symbols outside the universe
+        '''
+        idx = self.locate(genes)
+        ids = np.where(idx >= 0, self.ensembl[idx], None)
+        return pd.Series(ids, index=genes, name="ensembl_gene_id", dtype=object).where(idx >= 0)
+
+def refresh_table(filename=BACKGROUND_FILE):
+    '''
+    Re-downloads the Biomart table if it is older than REFRESH_INTERVAL. The local copy is kept if Biomart cannot be reached.
+    '''
+    if time.time() - os.path.getmtime(filename) < REFRESH_INTERVAL:
+        return
+    try:
+        from gseapy.biomart import Biomart
+        bm = Biomart()
+        query = bm.query(dataset='hsapiens_gene_ensembl',
+                         attributes=['ensembl_gene_id', 'external_gene_name', 'entrezgene_id'])
+        if query is not None and len(query) != 0:
+            query.to_csv(filename, sep="\t", index=False)
+    except Exception:
+        pass
+
+@functools.lru_cache(maxsize=None)
+def get_background(filename=BACKGROUND_FILE):
+    '''
+    Process-wide background universe, read once per process
+    '''
+    refresh_table(filename)
+    return BackgroundUniverse.load(filename)
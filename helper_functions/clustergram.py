@@ -2,29 +2,25 @@ import pandas as pd
 import numpy as np
 import math
 import re
-
-import streamlit as st
-
-import seaborn as sns
-import matplotlib.pyplot as plt
+import importlib.util
 
 import textwrap
 
-from helper_functions.session_state import ss
+from helper_functions.memo import memo
 
 class GeneHandler():
+    delimiters = str.maketrans({";": ",", " ": ",", "\n": ",", "\r": ",", "\t": ","})
+
     def genes_used(self, degs, useDEG= None, textgene=None):
         if useDEG is not None:
-            get_dict_values = [degs[s].index.to_list() for s in useDEG] # Get the deg list from the selected keys
-            get_dict = {k:degs[k].index.to_list() for k in useDEG}
-            get_dict = {k:v for k,v in get_dict.items() if len(v) !=0}
-            flatten_dict_values = list(set([item for sublist in get_dict_values for item in sublist]))
-            gene_final = flatten_dict_values
-        
+            get_indexes = {k:degs[k].index for k in useDEG} # Get the deg list from the selected keys
+            get_dict = {k:v.to_list() for k,v in get_indexes.items() if len(v) !=0}
+            gene_final = pd.unique(np.concatenate([v.to_numpy(dtype=object) for v in get_indexes.values()] + [np.array([], dtype=object)])).tolist()
+
         if textgene is not None:
-            genes = textgene.replace(";", ",").replace(" ", ",").replace("\n", ",").split(',')
-            # where the user may use multiple delimiters, convert the other delimiters to commas, and then split by comma
-            gene_final = [x.upper() for x in set(genes) if x != ""] # remove spaces in between and make sure to capitalise genes
+            # where the user may use multiple delimiters, convert the other delimiters to commas in one pass, and then split by comma
+            genes = textgene.upper().translate(self.delimiters).split(',') # make sure to capitalise genes
+            gene_final = [x for x in dict.fromkeys(genes) if x != ""] # unique genes in the order entered
             get_dict = {'user_genes':gene_final}
             get_dict = {k:v for k,v in get_dict.items() if len(v) !=0}
         
@@ -33,19 +29,194 @@ class GeneHandler():
             get_dict = {}
         return gene_final, get_dict
     
-    def get_gene_vals(self, log_dict_ready, genes_used=None):
-        compiled_logFC = pd.DataFrame()
-        for k,v in log_dict_ready.items():
-            selected_gene_vals = v.loc[~v.index.duplicated(keep='first')]
-            selected_gene_vals = selected_gene_vals[selected_gene_vals.index.isin(genes_used)]
-            logFC_selected_gene_vals = selected_gene_vals.filter(regex="log2FC", axis=1)
-            logFC_selected_gene_vals = logFC_selected_gene_vals.add_prefix(f"{k}_")
-            compiled_logFC = pd.concat([compiled_logFC, logFC_selected_gene_vals], axis=1)
+    def get_gene_vals(self, comparison_store, genes_used=None):
+        '''
+        genes x comparisons log2FC of genes_used, gathered from the store with one indexed take (in store gene order, unknown genes left out)
+        '''
+        pos = comparison_store.genes.get_indexer(pd.Index(genes_used, dtype=object).unique())
+        rows = np.sort(pos[pos >= 0])
+        compiled_logFC = pd.DataFrame(comparison_store.matrix('log2FC')[rows],
+                                      index=comparison_store.genes[rows],
+                                      columns=comparison_store.labels('log2FC'))
         return compiled_logFC
 
 class Clustergram():
+    large_rows = 2000 # above this many genes, the clustergram is drawn by large_cluster_plot
+    olo_limit = 1000 # most rows (or row clusters) ordered by optimal leaf ordering
+
+    def backend(self):
+        '''
+        fastcluster (C++, with a distance-matrix-free path for euclidean single/ward/centroid/median) if installed, otherwise scipy
+        '''
+        return "fastcluster" if importlib.util.find_spec("fastcluster") is not None else "scipy"
+
+    @memo.memoize
+    def linkage(_self, values, method='average', metric='euclidean'):
+        '''
+        Hierarchical clustering of the rows of values, cached by their content, method and metric so that
+        cosmetic changes to the clustergram only redraw it
+
+        Parameters
+        ----------
+        values: np.ndarray | observations in rows, without missing values
+        method, metric: str | as in scipy.cluster.hierarchy.linkage
+
+        Returns
+        -------
+        np.ndarray | linkage matrix
+        '''
+        values = np.ascontiguousarray(values, dtype=np.float64)
+        if _self.backend() == "fastcluster":
+            import fastcluster
+            if metric == 'euclidean' and method in ('single', 'ward', 'centroid', 'median'):
+                return fastcluster.linkage_vector(values, method=method, metric=metric)
+            from scipy.spatial.distance import pdist
+            return fastcluster.linkage(pdist(values, metric=metric), method=method, preserve_input=False)
+        from scipy.cluster import hierarchy
+        return hierarchy.linkage(values, method=method, metric=metric)
+
+    def complete_rows(self, compiled_logFC):
+        '''
+        compiled_logFC without the genes that have missing values, and the list of those genes
+        '''
+        # drop those FCs with null values
+        missing = compiled_logFC.isna().to_numpy().any(axis=1)
+        return compiled_logFC[~missing].copy(), compiled_logFC.index[missing].to_list()
+
+    @memo.memoize
+    def leaf_order(_self, values, method='average', olo_limit=None):
+        '''
+        Row order of values from hierarchical clustering with optimal leaf ordering, computed once per matrix
+
+        Optimal leaf ordering grows with the cube of the rows, so above olo_limit rows the genes are first aggregated into
+        olo_limit clusters (cut from the full tree): the cluster means are ordered optimally, and genes keep the dendrogram
+        order within their cluster.
+
+        Returns
+        -------
+        np.ndarray | row positions in display order
+        '''
+        from scipy.cluster import hierarchy
+        olo_limit = _self.olo_limit if olo_limit is None else olo_limit
+        values = np.ascontiguousarray(values, dtype=np.float64)
+        Z = _self.linkage(values, method=method)
+        if len(values) <= olo_limit:
+            return hierarchy.leaves_list(hierarchy.optimal_leaf_ordering(Z, values))
 
-    @st.cache_data
+        labels = hierarchy.fcluster(Z, olo_limit, criterion='maxclust') - 1
+        sizes = np.bincount(labels)
+        centroids = np.stack([np.bincount(labels, weights=values[:, j]) for j in range(values.shape[1])], axis=1) / sizes[:, None]
+        cluster_rank = np.empty(len(centroids), dtype=np.int64)
+        cluster_rank[hierarchy.leaves_list(hierarchy.optimal_leaf_ordering(_self.linkage(centroids, method=method), centroids))] = np.arange(len(centroids))
+        leaves = hierarchy.leaves_list(Z)
+        return leaves[np.argsort(cluster_rank[labels[leaves]], kind='stable')]
+
+    @memo.memoize
+    def large_cluster_plot(_self,
+                           compiled_logFC,
+                           gene_dict,
+                           vminmax = (-2.0, 2.0),
+                           cbar_left = 0.96,
+                           cbar_bottom = 0.02,
+                           cbar_width = 0.15,
+                           cbar_height = 0.02,
+                           width = 10,
+                           height = 10,
+                           dendrogram_c = 0.12,
+                           cluster_cols = True,
+                           clust_gene_fontsize = 6,
+                           method = 'average'):
+        '''
+        Clustergram for thousands of genes: rows in optimal leaf order (see leaf_order) and the heatmap drawn as one raster image
+        instead of one patch per cell, so drawing and PDF/PNG export do not grow with the number of genes.
+        Gene names are only drawn when they fit the figure height.
+
+        Returns
+        -------
+        matplotlib.figure.Figure | None if there are fewer than 4 complete genes
+        list | genes with missing values, left out
+        pd.DataFrame | complete genes x comparisons in display order (for plotly_clustergram)
+        '''
+        from scipy.cluster import hierarchy
+        import matplotlib.pyplot as plt
+        import seaborn as sns # registers the vlag colour map
+
+        reformatted_logFC, null_fc = _self.complete_rows(compiled_logFC)
+        if reformatted_logFC.shape[0] <= 3:
+            return None, null_fc, reformatted_logFC
+
+        values = reformatted_logFC.to_numpy(dtype=np.float64)
+        rows = _self.leaf_order(values, method=method)
+        dendrogram_c = 0.0 if not cluster_cols or values.shape[1] < 2 else dendrogram_c
+        if dendrogram_c > 0:
+            col_linkage = hierarchy.optimal_leaf_ordering(_self.linkage(values.T, method=method), values.T)
+            cols = hierarchy.leaves_list(col_linkage)
+        else:
+            cols = np.arange(values.shape[1])
+        ordered = reformatted_logFC.iloc[rows, cols]
+
+        fig = plt.figure(figsize=(width, height))
+        ax_heatmap = fig.add_axes([0.05, 0.05, 0.75, 0.9 * (1 - dendrogram_c)])
+        image = ax_heatmap.imshow(ordered.to_numpy(), cmap="vlag", vmin=vminmax[0], vmax=vminmax[1],
+                                  aspect='auto', interpolation='nearest', rasterized=True)
+        if dendrogram_c > 0:
+            ax_col = fig.add_axes([0.05, 0.05 + 0.9 * (1 - dendrogram_c), 0.75, 0.9 * dendrogram_c])
+            hierarchy.dendrogram(col_linkage, ax=ax_col, no_labels=True, color_threshold=-np.inf, above_threshold_color='black')
+            ax_col.set_axis_off()
+
+        colnames = ["\n".join(textwrap.wrap(c.replace("_", " "), width=20, break_long_words=False)) for c in ordered.columns]
+        ax_heatmap.set_xticks(np.arange(len(colnames)), colnames, fontsize=max(clust_gene_fontsize, 4) * 1.25, rotation=90)
+        fits = clust_gene_fontsize > 0 and len(ordered) * clust_gene_fontsize <= 0.9 * height * 72 # font size in points, 72 points per inch
+        ax_heatmap.set_yticks(np.arange(len(ordered)) if fits else [], ordered.index if fits else [], fontsize=clust_gene_fontsize)
+        ax_heatmap.yaxis.tick_right()
+        ax_heatmap.grid(False)
+        ax_heatmap.set_ylabel(f"{len(ordered)} genes")
+        for _, spine in ax_heatmap.spines.items():
+            spine.set_visible(True)
+            spine.set_edgecolor("black")
+
+        cax = fig.add_axes([cbar_left, cbar_bottom, cbar_width, cbar_height])
+        fig.colorbar(image, cax=cax, orientation='horizontal', label="log2FC", ticks=[vminmax[0], 0, vminmax[1]])
+        titles = '\n'.join([i for i in gene_dict.keys()])
+        fig.suptitle(f"Clustergram from \n {titles}", x=0.5, y=1.0, va='bottom', fontsize=12, fontweight='bold')
+        return fig, null_fc, ordered
+
+    def plotly_clustergram(self, ordered_logFC, start=0, stop=None, max_rows=2000, vminmax=(-2.0, 2.0), width=800, height=900):
+        '''
+        Zoomable heatmap of the rows start:stop of a clustergram in display order (see large_cluster_plot).
+        Windows longer than max_rows are decimated by averaging runs of neighbouring rows, which clustering made similar,
+        so the figure stays at most max_rows high whatever the number of genes; narrower windows show every gene.
+
+        Returns
+        -------
+        plotly.graph_objects.Figure
+        '''
+        import plotly.graph_objects as go
+
+        window = ordered_logFC.iloc[start:stop]
+        n = len(window)
+        step = max(1, math.ceil(n / max_rows))
+        starts = np.arange(0, n, step)
+        ends = np.minimum(starts + step, n)
+        values = np.add.reduceat(window.to_numpy(dtype=np.float64), starts, axis=0) / (ends - starts)[:, None]
+        genes = window.index.to_numpy()
+        if step == 1:
+            hover = genes
+        else:
+            hover = [f"{genes[a]} ... {genes[b - 1]} (mean of {b - a} genes)" for a, b in zip(starts, ends)]
+        colnames = [c.replace("_", " ") for c in window.columns]
+
+        fig = go.Figure(go.Heatmap(z=values, x=colnames, y=start + starts, customdata=np.broadcast_to(np.asarray(hover, dtype=object)[:, None], values.shape),
+                                   colorscale="RdBu_r", zmid=0, zmin=vminmax[0], zmax=vminmax[1], colorbar=dict(title="log2FC"),
+                                   hovertemplate="%{customdata}<br>%{x}<br>log2FC: %{z:.2f}<extra></extra>"))
+        labelled = step == 1 and n <= 100
+        fig.update_yaxes(autorange="reversed", title=None if labelled else "Gene (clustered order)",
+                         tickvals=start + starts if labelled else None, ticktext=genes if labelled else None)
+        fig.update_layout(title=f"Genes {start + 1} to {start + n}" + (f", every {step} genes averaged" if step > 1 else ""),
+                          width=width, height=height, template="simple_white")
+        return fig
+
+    @memo.memoize
     def cluster_plot(_self,
                      compiled_logFC,
                      gene_dict,
@@ -59,22 +230,26 @@ class Clustergram():
                      dendrogram_r = 0.2,
                      dendrogram_c = 0.12,
                      cluster_cols = True,
-                     clust_gene_fontsize = 6):
+                     clust_gene_fontsize = 6,
+                     method = 'average'):
         colnames_whitespaced = [i.replace("_"," ") for i in compiled_logFC.columns]
         wrap_colnames = ["\n".join(textwrap.wrap(a, width=20, break_long_words=False)) for a in colnames_whitespaced]
 
-        # drop those FCs with null values
-        null_fc = compiled_logFC[compiled_logFC.apply(lambda x: pd.isna(x).any(), axis = 1)].index.to_list()
-        reformatted_logFC = compiled_logFC[~compiled_logFC.index.isin(null_fc)]
+        reformatted_logFC, null_fc = _self.complete_rows(compiled_logFC)
         reformatted_logFC.columns = wrap_colnames
 
         dendrogram_c = 0.0 if not cluster_cols else dendrogram_c
         yticklabels = False if clust_gene_fontsize == 0 else True
 
         if reformatted_logFC.shape[0] > 3:
+            import seaborn as sns
+            values = reformatted_logFC.to_numpy()
+            row_linkage = _self.linkage(values, method=method)
+            col_linkage = _self.linkage(values.T, method=method) if cluster_cols else None
             g = sns.clustermap(reformatted_logFC,
                                 cmap="vlag",
-                                method='average',
+                                row_linkage=row_linkage,
+                                col_linkage=col_linkage,
                                 cbar_pos=(cbar_left, cbar_bottom, cbar_width, cbar_height),
                                 center=0, 
                                 vmin = vminmax[0],
@@ -0,0 +1,75 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+class ComparisonStore():
+    '''
+    Contiguous float32 store of every comparison in the pre-processed data, with one gene index and one comparison index.
+
+    values has the shape (fields, comparisons, genes), so that one field of one comparison is a contiguous view over all genes
+    and one field across comparisons is a genes x comparisons view.
+    '''
+    fields = ['log2FC', 'pval', 'adj_pval', 'neg_log_p']
+
+    def __init__(self, genes, comparisons, values, present, use_corrected_pval=False):
+        '''
+        Parameters
+        ----------
+        genes: pd.Index | union of unique gene names across all uploads
+        comparisons: pd.MultiIndex | (upload key, comparison) of each comparison
+        values: np.ndarray | float32 array of shape (fields, comparisons, genes), NaN where an upload does not have the gene
+        present: dict | keys containing upload keys, values containing boolean masks of the genes found in that upload
+        use_corrected_pval: bool | whether neg_log_p was derived from adjusted p-values
+        '''
+        self.genes = genes
+        self.comparisons = comparisons
+        self.values = values
+        self.present = present
+        self.use_corrected_pval = use_corrected_pval
+        self.field_idx = {f:i for i,f in enumerate(self.fields)}
+        self.comp_idx = {c:i for i,c in enumerate(comparisons)}
+        # Cheap stand-in for hashing the whole store every time a cached function receives it
+        token = hashlib.blake2b(values.tobytes(), digest_size=16)
+        token.update(repr((list(genes), list(comparisons), use_corrected_pval)).encode())
+        self.token = token.hexdigest()
+
+    def keys(self):
+        return list(self.present.keys())
+
+    def comparisons_of(self, k):
+        return [c for key, c in self.comparisons if key == k]
+
+    def colname(self, field, comp):
+        '''
+        Column names used across the app, eg. log2FC_{comp} or neg_log_adj_pval_{comp}
+        '''
+        if field == 'neg_log_p':
+            field = 'neg_log_adj_pval' if self.use_corrected_pval else 'neg_log_pval'
+        return f"{field}_{comp}"
+
+    def column(self, k, comp, field):
+        '''
+        Returns a view of one field of one comparison over all genes in the store
+        '''
+        return self.values[self.field_idx[field], self.comp_idx[(k, comp)]]
+
+    def matrix(self, field):
+        '''
+        Returns a genes x comparisons view of one field
+        '''
+        return self.values[self.field_idx[field]].T
+
+    def labels(self, field):
+        '''
+        Column labels of matrix(field), eg. {upload}_log2FC_{comp}
+        '''
+        return [f"{k}_{self.colname(field, c)}" for k, c in self.comparisons]
+
+    def frame(self, k, comp, fields):
+        '''
+        Returns a DataFrame of the selected fields of one comparison, restricted to the genes of upload k
+        '''
+        mask = self.present[k]
+        data = {self.colname(f, comp): self.column(k, comp, f)[mask] for f in fields}
+        return pd.DataFrame(data, index=self.genes[mask])
@@ -2,25 +2,17 @@ import pandas as pd
 import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
-import phik
-from scipy import stats
 import textwrap
 
 class Correlation():
-    def corr_matrix(self, log_dict, method):
+    def corr_matrix(self, comparison_store, method):
         corr_symbols = {'spearman': 'ρ', 'pearson': 'r', 'kendall':'τ', 'phik':'𝜙k'}
-        updated_df_list = []
-        for k, v in log_dict.items():
-            filtered = v.filter(regex="log2FC", axis=1)
-            df_new = filtered.add_prefix(f"{k}_")
-            df_new = df_new.loc[~df_new.index.duplicated(keep='first')]
-            updated_df_list.append(df_new)
-
-        concat_fc = pd.concat(updated_df_list, axis=1)
+        concat_fc = pd.DataFrame(comparison_store.matrix('log2FC'), index=comparison_store.genes, columns=comparison_store.labels('log2FC'))
         concat_fc = concat_fc.dropna()
         if method != 'phik':
             concat_corr = concat_fc.corr(method=method)
         else:
+            import phik # registers DataFrame.phik_matrix
             concat_corr = concat_fc.phik_matrix()
         
         # plot
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+
+from helper_functions.gene_symbols import symbol_qc
+
+class CountsIngest():
+    '''
+    Streaming reader of large count or expression matrices (genes in rows, samples in columns) from csv/tab-separated text.
+
+    The file is read twice in row chunks: first only the gene column, to size the output and find the duplicated genes, then the values as
+    float32 straight into a preallocated (or memory-mapped) matrix, with duplicated genes averaged as their rows arrive.
+    Symbols that Excel turned into dates (eg. two Mar-01 rows, MARCHF1 and MTARC1) are different genes, so their rows are kept apart
+    for the gene symbol QC to resolve.
+    Peak memory stays near one float32 copy of the matrix, instead of the float64 copies made by read_csv, groupby().mean() and transpose.
+    '''
+    chunksize = 20000
+
+    def rewind(self, src):
+        if hasattr(src, "seek"):
+            src.seek(0)
+        return src
+
+    def gene_rows(self, src, sep=",", upper=True):
+        '''
+        Gene symbol of every row, read without parsing the values
+        '''
+        genes = pd.read_csv(self.rewind(src), sep=sep, usecols=[0], dtype=str).iloc[:, 0]
+        genes = pd.Index(genes.fillna(""))
+        return genes.str.upper() if upper else genes
+
+    def allocate(self, shape, out=None):
+        '''
+        Empty float32 matrix in memory, or memory-mapped from the .npy file out
+        '''
+        if out is None:
+            return np.empty(shape, dtype=np.float32)
+        return np.lib.format.open_memmap(out, mode="w+", dtype=np.float32, shape=shape)
+
+    def read(self, src, sep=",", out=None, upper=True, chunksize=None):
+        '''
+        Parameters
+        ----------
+        src: str or file-like | path or buffer of the csv/tab-separated file
+        sep: str | column separator
+        out: str | .npy file to hold the matrix on disk (memory-mapped), kept in memory if None
+        upper: bool | upper-case gene symbols before finding duplicates, as FileUploads.prepare_genes does
+        chunksize: int | rows parsed at a time, the class default if None
+
+        Returns
+        -------
+        pd.DataFrame | float32 genes x samples with one row per gene (duplicated genes averaged, ignoring NaN), sorted by gene.
+                       Date-like symbols keep one row per file row, in file order after the other genes.
+        '''
+        chunksize = self.chunksize if chunksize is None else chunksize
+        header = pd.read_csv(self.rewind(src), sep=sep, index_col=0, nrows=0)
+        rows = self.gene_rows(src, sep=sep, upper=upper)
+        masks = symbol_qc.scan(rows)
+        is_date = masks['dates'] | masks['numeric_dates']
+
+        # the first row of every other gene gets an output row sorted by gene, then every date row in file order,
+        # which GeneSymbolQC.resolve_dates relies on to tell the genes apart
+        named = np.flatnonzero(~rows.duplicated() & ~is_date)
+        placed = np.concatenate([named[np.argsort(rows[named].to_numpy(dtype=object), kind="stable")], np.flatnonzero(is_date)])
+        genes = rows[placed]
+        target = np.empty(len(rows), dtype=np.int64) # output row of every file row
+        target[placed] = np.arange(len(genes))
+        target[~is_date] = target[named[rows[named].get_indexer(rows[~is_date])]]
+
+        # only duplicated genes need running sums, every other row is written once in place
+        is_dup = rows.duplicated(keep=False) & ~is_date
+        dup_genes, dup_slot = np.unique(target[is_dup], return_inverse=True)
+        slot = np.full(len(rows), -1)
+        slot[is_dup] = dup_slot
+        sums = np.zeros((len(dup_genes), len(header.columns)))
+        counts = np.zeros((len(dup_genes), len(header.columns)), dtype=np.int32)
+
+        X = self.allocate((len(genes), len(header.columns)), out=out)
+        reader = pd.read_csv(self.rewind(src), sep=sep, index_col=0, chunksize=chunksize,
+                             dtype=dict.fromkeys(header.columns, np.float32))
+        start = 0
+        while True:
+            try:
+                chunk = next(reader)
+            except StopIteration:
+                break
+            except ValueError as e:
+                raise ValueError(f"Non-numeric values between rows {start + 1} and {start + chunksize} of the expression matrix ({e})") from e
+            values = chunk.to_numpy(dtype=np.float32)
+            t, s = target[start:start + len(values)], slot[start:start + len(values)]
+            single = s < 0
+            X[t[single]] = values[single]
+            if not single.all():
+                dup_values = values[~single].astype(np.float64)
+                present = ~np.isnan(dup_values)
+                np.add.at(sums, s[~single], np.where(present, dup_values, 0))
+                np.add.at(counts, s[~single], present)
+            start += len(values)
+        if start != len(rows):
+            raise ValueError(f"Expected {len(rows)} rows but read {start}, the file changed while it was read")
+
+        if len(dup_genes) != 0:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                X[dup_genes] = np.where(counts > 0, sums / counts, np.nan)
+        if isinstance(X, np.memmap):
+            X.flush()
+        return pd.DataFrame(X, index=genes.rename(header.index.name), columns=header.columns, copy=False)
+
+counts_ingest = CountsIngest()
@@ -1,17 +1,17 @@
 # Housekeeping
 import re
+from collections.abc import Mapping
 
 # Stats and data wrangling
 import pandas as pd
 import numpy as np
 
 # Plotting modules
-import matplotlib.pyplot as plt
 import plotly.colors as pc
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
-import streamlit as st
+from helper_functions.memo import memo
 
 class PreDEGs():
     '''
@@ -27,18 +27,73 @@ class PreDEGs():
             colors = plotly_clrs[0:n_comps]
         return colors
 
-    @st.cache_data
+    def volcano_layers(self, user_filter, fc_name, pval_name, annotated, density=False, pval_cutoff=0.05, fc_cutoff=2.0):
+        '''
+        Splits the genes of one comparison into the ones drawn as points and the background that is only drawn as a density
+
+        Parameters
+        ----------
+        annotated: pd.Index | genes that are labelled on the plot, always drawn as points
+        density: bool | if False, every gene is a point and the background is empty
+        pval_cutoff, fc_cutoff: float | genes with p < pval_cutoff and |FC| > fc_cutoff (as in DEGs.degs) are drawn as points
+
+        Returns
+        -------
+        tuple | (pd.DataFrame of the point genes, (log2FC, -log10 p) numpy arrays of the background genes)
+        '''
+        if not density:
+            return user_filter, (np.empty(0), np.empty(0))
+        with np.errstate(divide='ignore'):
+            is_point = (user_filter[pval_name] > -np.log10(pval_cutoff)) & (user_filter[fc_name].abs() > np.log2(fc_cutoff))
+        is_point |= user_filter.index.isin(annotated)
+        background = user_filter[~is_point]
+        return user_filter[is_point], (background[fc_name].to_numpy(), background[pval_name].to_numpy())
+
+    def density_layer(self, ax, figure, backgrounds, bins=100, row=None, col=None):
+        '''
+        Draws the background genes of one panel as a rasterised hexbin on ax and, if figure is given, as one binned heatmap trace,
+        so that both grow with the number of bins instead of the number of genes
+        '''
+        x = np.concatenate([b[0] for b in backgrounds])
+        y = np.concatenate([b[1] for b in backgrounds])
+        keep = np.isfinite(x) & np.isfinite(y)
+        x, y = x[keep], y[keep]
+        if len(x) == 0:
+            return
+        ax.hexbin(x, y, gridsize=bins, bins='log', cmap='Greys', mincnt=1, linewidths=0, alpha=0.6, zorder=0, rasterized=True)
+        if figure is not None:
+            counts, xedges, yedges = np.histogram2d(x, y, bins=bins)
+            counts = np.where(counts > 0, counts, np.nan).T # heatmap rows are y bins, empty bins stay transparent
+            figure.add_trace(go.Heatmap(x=(xedges[:-1] + xedges[1:]) / 2, y=(yedges[:-1] + yedges[1:]) / 2,
+                                        z=np.round(np.log10(counts), 2), customdata=counts,
+                                        colorscale=[[0, "#d9d9d9"], [1, "#525252"]], showscale=False,
+                                        name="Not significant", hovertemplate="%{customdata:.0f} genes<extra>Not significant</extra>"),
+                             row=row, col=col)
+
+    @memo.memoize
     def volcano(_self,
-                user_log,
+                comparison_store,
                 comparison_dict,
                 xaxes = (0.0, 0.0),
                 yaxes = 0.0,
                 interactive_volcano = False,
-                use_corrected_pval = False):
-        
+                use_corrected_pval = False,
+                density = False,
+                pval_cutoff = 0.05,
+                fc_cutoff = 2.0,
+                bins = 100):
+        '''
+        Parameters
+        ----------
+        density: bool | draw only significant (pval_cutoff, fc_cutoff) and annotated genes as points, and the other genes as a density of bins x bins,
+                 so that the plots stay light for large datasets
+        '''
+        import matplotlib.pyplot as plt
+
         plt.style.use("ggplot")
         p_format = "adjusted p-value" if use_corrected_pval else "p-value"
         top10annotation, bottom10annotation = [], []
+        uploads = comparison_store.keys()
         
         unlist_comparisons = sorted(list(set([item for sublist in comparison_dict.values() for item in sublist])), reverse=True)
         colorlist = _self.nclrs(comparison_dict = comparison_dict)
@@ -46,12 +101,13 @@ class PreDEGs():
         for a, c in zip(unlist_comparisons, colorlist):
             legend_dict[a.replace("_"," ").replace("-", " ")] = c
 
-        if len(user_log) == 1:
+        if len(uploads) == 1:
             volcano1 = go.Figure()
             fig, ax = plt.subplots()
             highest_y = 0.0
-            for k, df in user_log.items():
+            for k in uploads:
                 comps = comparison_dict[k] # a list of comparisons made for each dataframe that the user uploads
+                backgrounds = []
                 for i, tp in enumerate(comps):
                     complabels = tp.replace("_", " ").replace("-", " ")
                     hex_clr = legend_dict[complabels]
@@ -59,7 +115,8 @@ class PreDEGs():
                     #### selecting the required FC and pval for plotting
                     pval_name = f'neg_log_adj_pval_{tp}' if use_corrected_pval else f'neg_log_pval_{tp}'
                     fc_name = f'log2FC_{tp}'
-                    mini_df = df[[fc_name, pval_name]]
+                    mini_df = comparison_store.frame(k, tp, ['log2FC', 'neg_log_p'])
+                    mini_df.columns = [fc_name, pval_name]
                     mini_df = mini_df.replace({np.inf:100})
                     max_y_in_df = mini_df.loc[:, pval_name].max()
                     highest_y = max_y_in_df if max_y_in_df > highest_y else highest_y # loop until we can get the highest possible y value of all comparisons
@@ -76,6 +133,9 @@ class PreDEGs():
                     
                     top_10 = user_filter.sort_values(by=fc_name, ascending=False).head(10)
                     bottom_10 = user_filter.sort_values(by=fc_name, ascending=False).tail(10)
+                    points, background = _self.volcano_layers(user_filter, fc_name, pval_name, top_10.index.union(bottom_10.index),
+                                                              density=density, pval_cutoff=pval_cutoff, fc_cutoff=fc_cutoff)
+                    backgrounds.append(background)
                     
                     bottom10annotation.append(
                         bottom_10.rename(columns={fc_name: "log2FC", pval_name: "neg_log_pval"}))
@@ -83,7 +143,7 @@ class PreDEGs():
                         top_10.rename(columns={fc_name: "log2FC", pval_name: "neg_log_pval"}))
 
                     ax.grid(visible=True, which="major", axis="both", alpha=0.5)
-                    plt.scatter(user_filter[fc_name], user_filter[pval_name], alpha=0.8, label=complabels, c = [hex_clr])
+                    plt.scatter(points[fc_name], points[pval_name], alpha=0.8, label=complabels, c = [hex_clr])
                     plt.title("Volcano plot across comparisons", loc='center')
                     plt.xlabel('log2(Fold-change)')
                     plt.ylabel(f'-log10({p_format})')
@@ -103,8 +163,8 @@ class PreDEGs():
                         plt.ylim(-0.50, highest_y)
 
                     if interactive_volcano:
-                        volcano1.add_trace(go.Scatter(x=user_filter[fc_name], y=user_filter[pval_name],
-                                                      customdata=list(user_filter.index),
+                        volcano1.add_trace(go.Scattergl(x=points[fc_name], y=points[pval_name],
+                                                      customdata=list(points.index),
                                                       mode='markers',
                                                       name = complabels,
                                                       hovertemplate=f"<b>%{{customdata}}</b><br>-log10({p_format}): %{{y:.2f}}<br>log2(Fold-change): %{{x:.2f}}",
@@ -112,6 +172,9 @@ class PreDEGs():
                                                       legendgroup=tp
                                                       )
                                                       )
+                if density:
+                    _self.density_layer(ax, volcano1 if interactive_volcano else None, backgrounds, bins=bins)
+
                 annotationconcat_top = pd.concat(top10annotation, axis=0)
                 annotationconcat_top = annotationconcat_top.sort_values(by=["log2FC"], ascending=False).head(10)
 
@@ -149,34 +212,36 @@ class PreDEGs():
             
         else:
             i = 1
-            if len(user_log) % 2 == 0:
-                nrows = int(np.ceil(len(user_log) / 2))
-                extras = nrows*2 - len(user_log)
-                volcano1 = make_subplots(rows=nrows, cols=2, subplot_titles=(list(user_log.keys())),
+            if len(uploads) % 2 == 0:
+                nrows = int(np.ceil(len(uploads) / 2))
+                extras = nrows*2 - len(uploads)
+                volcano1 = make_subplots(rows=nrows, cols=2, subplot_titles=uploads,
                                         x_title="log2(Fold-Change)", y_title="-log10(p-value)", shared_xaxes=True, shared_yaxes=True)
                 v_row, v_col = 1, 1
                 j = 1
                 fig, axs = plt.subplots(nrows=nrows, ncols=2, sharex=True, sharey = True, figsize=(8, 7))
 
             else:
-                nrows = int(np.ceil(len(user_log) / 3))
-                extras = nrows*3 - len(user_log)
-                volcano1 = make_subplots(rows=nrows, cols=3, subplot_titles=(list(user_log.keys())),
+                nrows = int(np.ceil(len(uploads) / 3))
+                extras = nrows*3 - len(uploads)
+                volcano1 = make_subplots(rows=nrows, cols=3, subplot_titles=uploads,
                                         x_title="log2(Fold-Change)", y_title="-log10(p-value)", shared_xaxes=True, shared_yaxes=True)
                 v_row, v_col = 1, 1
                 j = 1
                 fig, axs = plt.subplots(nrows=nrows, ncols=3, sharex=True, sharey=True, figsize=(8,7))
 
             min_x, max_x, max_y = 0,0,0
-            for k, df in user_log.items():
+            for k in uploads:
                 comps = comparison_dict[k] # a list of comparisons made for each dataframe that the user uploads
+                backgrounds = []
                 for i, tp in enumerate(comps):
                     complabels = tp.replace("_", " ").replace("-", " ")
                     hex_clr = legend_dict[complabels]
                     #### selecting the required FC and pval for plotting
                     pval_name  = f'neg_log_adj_pval_{tp}' if use_corrected_pval else f'neg_log_pval_{tp}'
                     fc_name = f'log2FC_{tp}'
-                    mini_df = df[[fc_name, pval_name]]
+                    mini_df = comparison_store.frame(k, tp, ['log2FC', 'neg_log_p'])
+                    mini_df.columns = [fc_name, pval_name]
                     mini_df = mini_df.replace({np.inf:100})
                     max_y_in_df = mini_df.loc[:, pval_name].max()
 
@@ -196,15 +261,18 @@ class PreDEGs():
 
                     top_10 = user_filter.sort_values(by=fc_name, ascending=False).head(10)
                     bottom_10 = user_filter.sort_values(by=fc_name, ascending=True).head(10)
+                    points, background = _self.volcano_layers(user_filter, fc_name, pval_name, top_10.index.union(bottom_10.index),
+                                                              density=density, pval_cutoff=pval_cutoff, fc_cutoff=fc_cutoff)
+                    backgrounds.append(background)
 
                     bottom10annotation.append(
                         bottom_10.rename(columns={fc_name: "log2FC", pval_name: "negative_log_pval"}))
                     top10annotation.append(
                         top_10.rename(columns={fc_name: "log2FC", pval_name: "negative_log_pval"}))
 
-                    ax = plt.subplot(nrows, 2, j) if len(user_log) % 2 == 0 else plt.subplot(nrows, 3, j)
+                    ax = plt.subplot(nrows, 2, j) if len(uploads) % 2 == 0 else plt.subplot(nrows, 3, j)
                     ax.grid(visible=True, which="major", axis="both", alpha=0.5)
-                    ax.scatter(user_filter[fc_name], user_filter[pval_name], alpha=0.9, label = complabels, c = [hex_clr])
+                    ax.scatter(points[fc_name], points[pval_name], alpha=0.9, label = complabels, c = [hex_clr])
                     ax.axhline(y=0, color='r', linestyle='dashed')
                     ax.axvline(x=0, linestyle='dashed')
                     ax.set_title(f"{k}", fontdict={'fontsize':10})
@@ -220,14 +288,16 @@ class PreDEGs():
                         ax.set_ylim([-1.0, max_y])
 
                     if interactive_volcano:
-                        volcano1.add_trace(go.Scatter(x=user_filter[fc_name], y=user_filter[pval_name],
+                        volcano1.add_trace(go.Scattergl(x=points[fc_name], y=points[pval_name],
                                                       mode='markers',
-                                                      customdata=list(user_filter.index),
+                                                      customdata=list(points.index),
                                                       name = complabels,
                                                       hovertemplate=f"<b>%{{customdata}}</b><br>-log10({p_format}): %{{y:.2f}}<br>log2(Fold-change): %{{x:.2f}}",
                                                       marker=dict(color=hex_clr, size=8, opacity=0.9), legendgroup=str(i)),
                                         row=v_row, col=v_col)
                         i += 1
+                if density:
+                    _self.density_layer(ax, volcano1 if interactive_volcano else None, backgrounds, bins=bins, row=v_row, col=v_col)
 
                 annotationconcat_top = pd.concat(top10annotation, axis=0)
                 annotationconcat_top = annotationconcat_top.sort_values(by=["log2FC"], ascending=False).head(10)
@@ -252,10 +322,10 @@ class PreDEGs():
                 j += 1
                 v_col += 1
 
-                if (len(user_log) % 2 == 0) and v_col > 2:
+                if (len(uploads) % 2 == 0) and v_col > 2:
                     v_col = 1
                     v_row += 1
-                if (len(user_log) % 2 != 0) and v_col > 3:
+                if (len(uploads) % 2 != 0) and v_col > 3:
                     v_col = 1
                     v_row += 1
             
@@ -298,9 +368,9 @@ class PreDEGs():
                                 )
         return fig, volcano1
     
-    @st.cache_data
-    def deg_cdf(_self, ready_dict, comparison_dict, pval=0.05, markermode='lines', use_corrected_pval=False):
-        FC_step = [i/10 for i in range(0, 201, 1)]
+    @memo.memoize
+    def deg_cdf(_self, ready_dict, comparison_dict, pval=0.05, markermode='lines', use_corrected_pval=False, fc_step=0.1, max_fc=20.0):
+        FC_step = np.linspace(0, max_fc, int(round(max_fc / fc_step)) + 1)
         p_format = "adjusted p-value" if use_corrected_pval else "p-value"
         fig = go.Figure()
         for k,v in ready_dict.items():
@@ -309,17 +379,18 @@ class PreDEGs():
                 df = v.filter(regex=comp, axis=1)
                 # Get pvals
                 p = [i for i in df.columns if re.search("^pval", i)][0] if not use_corrected_pval else [i for i in df.columns if re.search("^adj_pval", i)][0]
-                p = df.loc[:,p]
-                ratio = df.filter(regex="^ratio", axis=1)
-                fc = pd.DataFrame(index = ratio.index, columns=[f'FC_{comp}'])
-                for r in range(len(ratio.index)):
-                    value = ratio.iloc[r,0]
-                    fc.iloc[r, 0] = value if value >=1 else (-1)/value
-
-                p_fc = pd.concat([p, fc], axis=1)
-                n_p = [len(p_fc[(p_fc.iloc[:,0] < pval) & (p_fc.iloc[:,1] > a)]) for a in FC_step]
-                n_n = [len(p_fc[(p_fc.iloc[:,0] < pval) & (p_fc.iloc[:,1] < -a)]) for a in FC_step]
-                n_total = [x + y for x, y in zip(n_p, n_n)]
+                p = df.loc[:,p].to_numpy(dtype=float)
+                ratio = df.filter(regex="^ratio", axis=1).iloc[:,0].to_numpy(dtype=float)
+                with np.errstate(divide='ignore'):
+                    fc = np.where(ratio >= 1, ratio, (-1)/ratio)
+
+                # Sort the significant FCs once, then every cutoff is a binary search
+                sig = p < pval
+                up = np.sort(fc[sig & (fc > 0)])
+                down = np.sort(-fc[sig & (fc < 0)])
+                n_p = len(up) - np.searchsorted(up, FC_step, side='right')
+                n_n = len(down) - np.searchsorted(down, FC_step, side='right')
+                n_total = n_p + n_n
                 fig.add_trace(go.Scatter(
                     x=FC_step, y=n_total, name=f'{k}_{comp.replace("_"," ")}',
                     hovertemplate=f"{p_format}: {pval}<br>FC: %{{x}}<br>number of DEGs: %{{y}}",
@@ -335,76 +406,219 @@ class PreDEGs():
         return fig
     
 
+    def deg_grid(self, comparison_store, comparison_dict, pvals, fcs, use_corrected_pval=False):
+        '''
+        Number of DEGs of every comparison at every (p-value, fold-change) cutoff pair, from one 2-D cumulative histogram
+
+        Parameters
+        ----------
+        pvals: np.ndarray | increasing p-value cutoffs, DEGs have p < cutoff
+        fcs: np.ndarray | increasing fold-change cutoffs, DEGs have |log2FC| > log2(cutoff) as in DEGs.degs
+
+        Returns
+        -------
+        np.ndarray | DEG counts of shape (comparisons, len(pvals), len(fcs)), comparisons in the order of comparison_dict
+        '''
+        comps = [(k, c) for k in comparison_store.keys() for c in comparison_dict[k]]
+        rows = [comparison_store.comp_idx[c] for c in comps]
+        pvalues = comparison_store.values[comparison_store.field_idx['adj_pval' if use_corrected_pval else 'pval'], rows]
+        logfc = np.abs(comparison_store.values[comparison_store.field_idx['log2FC'], rows]).astype(np.float64)
+        present = np.stack([comparison_store.present[k] for k, _ in comps])
+        comp, gene = np.nonzero(present & ~np.isnan(pvalues) & ~np.isnan(logfc))
+
+        with np.errstate(divide='ignore'):
+            log2fcs = np.log2(np.asarray(fcs, dtype=np.float64))
+        n_p, n_fc = len(pvals), len(fcs)
+        p_bin = np.searchsorted(np.asarray(pvals, dtype=pvalues.dtype), pvalues[comp, gene], side='right') # DEG for cutoffs p_bin onwards
+        fc_bin = np.searchsorted(log2fcs, logfc[comp, gene], side='left') # DEG for the first fc_bin cutoffs
+        hist = np.bincount((comp * (n_p + 1) + p_bin) * (n_fc + 1) + fc_bin, minlength=len(comps) * (n_p + 1) * (n_fc + 1))
+        hist = hist.reshape(len(comps), n_p + 1, n_fc + 1)
+        counts = hist.cumsum(axis=1)[:, :n_p, ::-1].cumsum(axis=2)[:, :, ::-1] # p bins up to the cutoff, FC bins above it
+        return counts[:, :, 1:]
+
+    @memo.memoize
+    def deg_threshold_map(_self, comparison_store, comparison_dict, pval_cutoff=0.05, fc_cutoff=2.0, use_corrected_pval=False,
+                          max_fc=5.0, fc_step=0.1, min_pval=1e-6):
+        '''
+        Heatmap of the number of DEGs over a grid of p-value (log-spaced from min_pval to 1) and fold-change (1 to max_fc) cutoffs,
+        one comparison at a time with a dropdown, and the current cutoff marked
+
+        Parameters
+        ----------
+        pval_cutoff, fc_cutoff: float | cutoff of the bar plot, marked on the map
+        '''
+        p_format = "adjusted p-value" if use_corrected_pval else "p-value"
+        pvals = np.unique(np.concatenate([np.logspace(np.log10(min_pval), 0, 10 * int(round(-np.log10(min_pval))) + 1), [0.05, 0.1]]))
+        fcs = np.round(np.linspace(1.0, max_fc, int(round((max_fc - 1.0) / fc_step)) + 1), 4)
+        counts = _self.deg_grid(comparison_store, comparison_dict, pvals, fcs, use_corrected_pval=use_corrected_pval)
+        comps = [(k, c) for k in comparison_store.keys() for c in comparison_dict[k]]
+
+        fig = go.Figure()
+        for i, (k, c) in enumerate(comps):
+            fig.add_trace(go.Heatmap(x=fcs, y=pvals, z=counts[i], visible=(i == 0), colorscale="Viridis", colorbar=dict(title="DEGs"),
+                                     hovertemplate=f"{p_format} < %{{y:.2g}}<br>FC > %{{x:.2f}}<br>%{{z}} DEGs<extra>{k}: {c.replace('_', ' ')}</extra>"))
+        fig.add_trace(go.Scatter(x=[fc_cutoff], y=[pval_cutoff], mode='markers', name="Current cutoff",
+                                 marker=dict(symbol='x', size=12, color='red'),
+                                 hovertemplate=f"Current cutoff<br>{p_format} < %{{y}}<br>FC > %{{x}}<extra></extra>"))
+        buttons = [dict(label=f"{k}: {c.replace('_', ' ')}", method="update",
+                        args=[{'visible': [j == i for j in range(len(comps))] + [True]}]) for i, (k, c) in enumerate(comps)]
+        fig.update_layout(title="Number of DEGs across cutoffs", title_x=0.5,
+                          updatemenus=[dict(buttons=buttons, direction="down", x=0.0, xanchor="left", y=1.12, yanchor="top")],
+                          xaxis=dict(title="Fold change cutoff"),
+                          yaxis=dict(title=f"{p_format} cutoff", type="log"),
+                          showlegend=False, template="ggplot2", width=700, height=550)
+        return fig
+
+
+class DEGIndex():
+    '''
+    Sort orders of every comparison in a ComparisonStore, so that DEG cutoffs are answered without filtering the data again.
+
+    For each comparison, the genes of its upload are kept sorted by p-value (with their log2FC alongside), and the up and down
+    log2FCs are kept sorted on their own. The p-value cutoff is a binary search giving a prefix of the p-sorted genes; the FC cutoff is
+    then a binary search on the sorted log2FCs when every gene passes the p-value cutoff, or one vectorised count over that prefix otherwise.
+    '''
+    def __init__(self, comparison_store, use_corrected_pval=False):
+        self.store = comparison_store
+        self.use_corrected_pval = use_corrected_pval
+        self.pfield = 'adj_pval' if use_corrected_pval else 'pval'
+        self.orders = {}
+        for k, cmp in comparison_store.comparisons:
+            pvals = comparison_store.column(k, cmp, self.pfield)
+            logfc = comparison_store.column(k, cmp, 'log2FC')
+            valid = np.flatnonzero(comparison_store.present[k] & ~np.isnan(pvals) & ~np.isnan(logfc))
+            by_p = valid[np.argsort(pvals[valid], kind='stable')]
+            fc = logfc[valid].astype(np.float64)
+            self.orders[(k, cmp)] = {'rows': by_p, 'pval': pvals[by_p], 'log2FC': logfc[by_p].astype(np.float64),
+                                     'up': np.sort(fc[fc > 0]), 'down': np.sort(-fc[fc < 0])}
+
+    def cutoffs(self, k, cmp, pval_cutoff, fc_cutoff):
+        '''
+        Number of genes passing the p-value cutoff (a prefix of the p-sorted genes) and the log2FC magnitude that up/down genes must exceed
+        '''
+        order = self.orders[(k, cmp)]
+        n = int(np.searchsorted(order['pval'], order['pval'].dtype.type(pval_cutoff), side='left')) # p < pval_cutoff
+        with np.errstate(divide='ignore'):
+            log2fc_cutoff = max(np.log2(fc_cutoff), 0.0) # FC below 1 keeps every up and down gene, as |log2FC| > log2(FC) in DEGs.degs
+        return order, n, log2fc_cutoff
+
+    def counts(self, k, cmp, pval_cutoff, fc_cutoff):
+        '''
+        Returns
+        -------
+        tuple | (number of upregulated DEGs, number of downregulated DEGs) of one comparison
+        '''
+        order, n, log2fc_cutoff = self.cutoffs(k, cmp, pval_cutoff, fc_cutoff)
+        if n == len(order['pval']): # every gene passes the p-value cutoff, so the sorted log2FCs answer on their own
+            return (len(order['up']) - int(np.searchsorted(order['up'], log2fc_cutoff, side='right')),
+                    len(order['down']) - int(np.searchsorted(order['down'], log2fc_cutoff, side='right')))
+        logfc = order['log2FC'][:n]
+        return int(np.count_nonzero(logfc > log2fc_cutoff)), int(np.count_nonzero(logfc < -log2fc_cutoff))
+
+    def frame(self, k, cmp, pval_cutoff, fc_cutoff, direction="UP"):
+        '''
+        DEGs of one comparison in one direction ("UP" or "DOWN") with their p-values and log2FC, in the gene order of the store
+        '''
+        order, n, log2fc_cutoff = self.cutoffs(k, cmp, pval_cutoff, fc_cutoff)
+        logfc = order['log2FC'][:n]
+        rows = np.sort(order['rows'][:n][logfc > log2fc_cutoff if direction == "UP" else logfc < -log2fc_cutoff])
+        pval_name = f"adj_pval_{cmp}" if self.use_corrected_pval else f"pval_{cmp}"
+        return pd.DataFrame({pval_name: self.store.column(k, cmp, self.pfield)[rows],
+                             f"log2FC_{cmp}": self.store.column(k, cmp, 'log2FC')[rows]},
+                            index=self.store.genes[rows])
+
+class DEGSets(Mapping):
+    '''
+    {UP_/DOWN_{upload}_{comparison}: dataframe of DEGs} at one (p, FC) cutoff, as returned by DEGs.degs.
+    Counts are read from the DEGIndex, and each dataframe is only built the first time a page looks it up.
+    '''
+    def __init__(self, deg_index, comparisons, pval_cutoff, fc_cutoff):
+        self.deg_index = deg_index
+        self.pval_cutoff = pval_cutoff
+        self.fc_cutoff = fc_cutoff
+        self.entries = {f"{direction}_{k}_{cmp}": (direction, k, cmp) for k, cmp in comparisons for direction in ["UP", "DOWN"]}
+        self.built = {}
+
+    def __getitem__(self, key):
+        if key not in self.built:
+            direction, k, cmp = self.entries[key]
+            self.built[key] = self.deg_index.frame(k, cmp, self.pval_cutoff, self.fc_cutoff, direction=direction)
+        return self.built[key]
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def count(self, key):
+        direction, k, cmp = self.entries[key]
+        up, down = self.deg_index.counts(k, cmp, self.pval_cutoff, self.fc_cutoff)
+        return up if direction == "UP" else down
+
 class DEGs():
     '''
     This class will provide the output for bar plots and data containing DEGs.
     '''
 
-    @st.cache_data
-    def degs(_self, log_ready_dict, comparison_dict, pval_cutoff=0.0, fc_cutoff=0.0, u_width = 800, u_height=600, use_corrected_pval=False):
-        log2fc_cutoff = np.log2(fc_cutoff)
+    @memo.memoize(resource=True)
+    def deg_index(_self, comparison_store, use_corrected_pval=False):
+        '''
+        DEGIndex of a comparison store, sorted once and reused for every cutoff
+        '''
+        return DEGIndex(comparison_store, use_corrected_pval=use_corrected_pval)
+
+    def degs(self, comparison_store, comparison_dict, pval_cutoff=0.0, fc_cutoff=0.0, u_width = 800, u_height=600, use_corrected_pval=False):
         p_format = "adjusted p-value" if use_corrected_pval else "p-value"
-        ####################################### Filter DF by Pvals and FC #################################################
-        proportions, deg_dict = {}, {}
-        for k,v in log_ready_dict.items(): # for each file upload
-            comps = comparison_dict[k] # get the comparisons
-            for cmp in comps:
-                pval_name = f"adj_pval_{cmp}" if use_corrected_pval else f"pval_{cmp}"
-                logfc_name = f"log2FC_{cmp}"
-                filtered = v[[pval_name, logfc_name]]
-                degs = filtered[(filtered[pval_name] < pval_cutoff) & ((filtered[logfc_name] > log2fc_cutoff)|(filtered[logfc_name] < -log2fc_cutoff))]
-                deg_dict[f"{k}_{cmp}"] = degs
-                # calculating proportion of DEGs for pie chart
-                upreg_deg = degs[degs.loc[:, logfc_name] > 0]
-                proportions[f"{k}_{cmp}_upcount"] = [len(upreg_deg)]
-                proportions[f"UP_{k}_{cmp}"] = upreg_deg
-
-                downreg_deg = degs[degs.loc[:, logfc_name] < 0]
-                proportions[f"{k}_{cmp}_downcount"] = [len(downreg_deg)]
-                proportions[f"DOWN_{k}_{cmp}"] = downreg_deg
-                
-        if len(log_ready_dict) == 1:
+        uploads = comparison_store.keys()
+        ####################################### Count DEGs by Pvals and FC #################################################
+        deg_index = self.deg_index(comparison_store, use_corrected_pval=use_corrected_pval)
+        proportions = DEGSets(deg_index, [(k, cmp) for k in uploads for cmp in comparison_dict[k]], pval_cutoff, fc_cutoff)
+
+        if len(uploads) == 1:
             stacked1 = go.Figure()
         else:
-            if len(log_ready_dict) % 2 == 0:
-                nrows = int(np.ceil(len(log_ready_dict) / 2))
-                stacked1 = make_subplots(rows=nrows, cols=2, subplot_titles=(list(log_ready_dict.keys())),
+            if len(uploads) % 2 == 0:
+                nrows = int(np.ceil(len(uploads) / 2))
+                stacked1 = make_subplots(rows=nrows, cols=2, subplot_titles=uploads,
                                         y_title='Number of DEGs',
                                         vertical_spacing = 0.5, shared_yaxes=True)
             else:
-                nrows = int(np.ceil(len(log_ready_dict) / 3))
-                stacked1 = make_subplots(rows=nrows, cols=3, subplot_titles=(list(log_ready_dict.keys())),
+                nrows = int(np.ceil(len(uploads) / 3))
+                stacked1 = make_subplots(rows=nrows, cols=3, subplot_titles=uploads,
                                         y_title='Number of DEGs', 
                                         vertical_spacing=0.5, horizontal_spacing=0.02,
                                         shared_yaxes=True)
         
         stacked_row = 1
         stacked_col = 1
-        for k,v in log_ready_dict.items():
+        for k in uploads:
             comps = comparison_dict[k]
-            for cmp in comps:
-                if len(log_ready_dict) == 1:
-                    # Stacked Bar
-                    stacked1.add_trace(
-                        go.Bar(x=[cmp], y=proportions[f'{k}_{cmp}_downcount'], name="Downregulated", marker_color="#636EFA"))
-                    stacked1.add_trace(
-                        go.Bar(x=[cmp], y=proportions[f'{k}_{cmp}_upcount'], name="Upregulated", marker_color="#EF553B"))
-                else:
-                    # Stacked Bar
-                    stacked1.add_trace(
-                        go.Bar(x=[cmp], y=proportions[f'{k}_{cmp}_downcount'], name="Downregulated", marker_color="#636EFA",
-                                legendgroup="A"),
-                                row=stacked_row, col=stacked_col)
-                    stacked1.add_trace(
-                        go.Bar(x=[cmp], y=proportions[f'{k}_{cmp}_upcount'], name="Upregulated", marker_color="#EF553B",
-                                legendgroup="B"),
-                                row=stacked_row, col=stacked_col)
+            downcounts = [proportions.count(f'DOWN_{k}_{cmp}') for cmp in comps]
+            upcounts = [proportions.count(f'UP_{k}_{cmp}') for cmp in comps]
+            # one stacked trace per direction and upload, every comparison is a bar of it
+            if len(uploads) == 1:
+                # Stacked Bar
+                stacked1.add_trace(
+                    go.Bar(x=comps, y=downcounts, name="Downregulated", marker_color="#636EFA"))
+                stacked1.add_trace(
+                    go.Bar(x=comps, y=upcounts, name="Upregulated", marker_color="#EF553B"))
+            else:
+                # Stacked Bar
+                stacked1.add_trace(
+                    go.Bar(x=comps, y=downcounts, name="Downregulated", marker_color="#636EFA",
+                            legendgroup="A"),
+                            row=stacked_row, col=stacked_col)
+                stacked1.add_trace(
+                    go.Bar(x=comps, y=upcounts, name="Upregulated", marker_color="#EF553B",
+                            legendgroup="B"),
+                            row=stacked_row, col=stacked_col)
 
             stacked_col += 1
-            if len(log_ready_dict) % 2 == 0 and stacked_col > 2:
+            if len(uploads) % 2 == 0 and stacked_col > 2:
                 stacked_col = 1
                 stacked_row += 1
-            elif len(log_ready_dict) % 2 != 0 and stacked_col > 3:
+            elif len(uploads) % 2 != 0 and stacked_col > 3:
                 stacked_col = 1
                 stacked_row += 1
 
@@ -418,8 +632,6 @@ class DEGs():
                             legend_title_text='DEGs:',
                             font=dict(family='Arial', size=14), width=u_width, height=u_height)
         stacked1.update_xaxes(automargin=True)
-
-        proportions = {k:v for k,v in proportions.items() if type(v) != list}
         return stacked1, proportions
 
 
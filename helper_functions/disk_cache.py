@@ -0,0 +1,30 @@
+import hashlib
+import os
+
+def cache_dir(*parts):
+    '''
+    Returns (and creates) a folder under the STAGES cache directory for compiled or parsed artifacts.
+    The location can be changed with the STAGES_CACHE_DIR environment variable and defaults to ~/.cache/stages
+
+    Parameters
+    ----------
+    parts: str | sub-folders under the cache directory, eg. "background"
+    '''
+    root = os.environ.get("STAGES_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "stages"))
+    path = os.path.join(root, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def file_token(filename):
+    '''
+    Cheap fingerprint of a source file from its path, size and modification time, used to key artifacts compiled from it
+    '''
+    stat = os.stat(filename)
+    key = f"{os.path.abspath(filename)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+def content_hash(data):
+    '''
+    Content address of a bytes object, used where the same content may arrive under different file names
+    '''
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
@@ -11,6 +11,8 @@ import zipfile
 import streamlit as st
 from streamlit_tags import st_tags, st_tags_sidebar
 
+from helper_functions.table_io import table_io
+
 
 class DLs():
     def convert_df(self, df):
@@ -29,6 +31,27 @@ class DLs():
         processed_data = output.getvalue()
         return processed_data
 
+    def download_tables(self, dfs, label, file_name, sheetnames=None, key=None):
+        '''
+        Download button for a set of tables with a choice of Excel or an Arrow format (a zip of one file per table if there are several)
+
+        Parameters
+        ----------
+        dfs: iterable | dataframes to download
+        label: str | button label
+        file_name: str | file name without extension
+        sheetnames: iterable | names of the tables, used as excel sheet or file names
+        key: str | widget key, needed if the same label is used twice on a page
+        '''
+        fmt_opts = {"Excel": "xlsx"} | {v:k for k,v in table_io.formats.items()}
+        fmt = st.radio(f"Format of {label.lower()}", options=list(fmt_opts.keys()), horizontal=True, key=f"{key or label}_fmt",
+                       help="Parquet, Feather and Arrow IPC files are smaller and much faster to read back for large tables")
+        if fmt_opts[fmt] == "xlsx":
+            data, ext = self.to_excel(dfs, sheetnames=sheetnames), "xlsx"
+        else:
+            data, ext = table_io.write_tables(dfs, fmt_opts[fmt], sheetnames=sheetnames)
+        st.download_button(label=label, data=data, file_name=f"{file_name}.{ext}", key=key)
+
 
     def get_table_download_link(self, df, purpose, sheetnames = None):  # downloads without needing to reset the whole scripts
         """Generates a link allowing the data in a given panda dataframe to be downloaded
@@ -87,14 +110,4 @@ class DLs():
             mime='application/pdf'
         )
 
-    def plot_to_bytes(self, fig, graph_module="pyplot", format="png"):
-        buf = BytesIO()
-        if graph_module == "pyplot":
-            fig.savefig(buf, format = format, bbox_inches="tight", dpi=300)
-        elif graph_module == 'plotly':
-            fig.write_image(file = buf, format = format, scale=3)
-        
-        data = base64.b64encode(buf.getbuffer()).decode("ascii")
-        return data
-
 file_downloads = DLs()
\ No newline at end of file
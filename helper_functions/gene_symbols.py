@@ -0,0 +1,218 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from helper_functions.hgnc import symbol_resolver
+
+class GeneSymbolQC():
+    '''
+    Detects and renames gene symbols that were converted to dates by Excel (eg. MARCHF1 -> Mar-01) and previous HGNC symbols.
+    The choices that need a user (MAR-01/MAR-02 identity, numeric date format) are passed in as arguments.
+    '''
+    corrected = {"DEC-01_1st": "DELEC1", "01-DEC_1st":"DELEC1", "MAR-03_1st": "MARCHF3", "03-MAR_1st":"MARCHF3",
+                "MAR-04_1st": "MARCHF4", "04-MAR_1st":"MARCHF4", "MAR-05_1st": "MARCHF5", "05-MAR_1st":"MARCHF5",
+                "MAR-06_1st": "MARCHF6", "06-MAR_1st":"MARCHF6", "MAR-07_1st": "MARCHF7", "07-MAR_1st":"MARCHF7",
+                "MAR-08_1st": "MARCHF8", "08-MAR_1st":"MARCHF8", "MAR-09_1st": "MARCHF9", "09-MAR_1st":"MARCHF9",
+                "MAR-10_1st": "MARCHF10", "10-MAR_1st":"MARCHF10", "MAR-11_1st": "MARCHF11", "11-MAR_1st":"MARCHF11",
+                "SEP-15_1st": "SELENOF", "15_SEP_1st":"SELENOF", "SEP-01_1st": "SEPTIN1", "01-SEP_1st":"SEPTIN1",
+                "SEP-02_1st": "SEPTIN2", "02-SEP_1st":"SEPTIN2", "SEP-03_1st": "SEPTIN3", "03-SEP_1st":"SEPTIN3",
+                "SEP-04_1st": "SEPTIN4", "04-SEP_1st":"SEPTIN4", "SEP-05_1st": "SEPTIN5", "05-SEP_1st":"SEPTIN5",
+                "SEP-06_1st": "SEPTIN6", "06-SEP_1st":"SEPTIN6", "SEP-07_1st": "SEPTIN7", "07-SEP_1st":"SEPTIN7",
+                "SEP-08_1st": "SEPTIN8", "08-SEP_1st":"SEPTIN8", "SEP-09_1st": "SEPTIN9", "09-SEP_1st":"SEPTIN9",
+                "SEP-10_1st": "SEPTIN10", "10-SEP_1st":"SEPTIN10", "SEP-11_1st": "SEPTIN11", "11-SEP_1st":"SEPTIN11",
+                "SEP-12_1st": "SEPTIN12", "12-SEP_1st":"SEPTIN12", "SEP-13_1st":"SEPTIN7P2", "13-SEP_1st":"SEPTIN7P2",
+                "SEP-14_1st": "SEPTIN14", "14-SEP_1st":"SEPTIN14",
+
+                "Dec-01_1st": "DELEC1", "01-Dec_1st":"DELEC1", "Mar-03_1st": "MARCHF3", "03-Mar_1st":"MARCHF3",
+                "Mar-04_1st": "MARCHF4", "04-Mar_1st":"MARCHF4", "Mar-05_1st": "MARCHF5", "05-Mar_1st":"MARCHF5",
+                "Mar-06_1st": "MARCHF6", "06-Mar_1st":"MARCHF6", "Mar-07_1st": "MARCHF7", "07-Mar_1st":"MARCHF7",
+                "Mar-08_1st": "MARCHF8", "08-Mar_1st":"MARCHF8", "Mar-09_1st": "MARCHF9", "09-Mar_1st":"MARCHF9",
+                "Mar-10_1st": "MARCHF10", "10-Mar_1st":"MARCHF10", "Mar-11_1st": "MARCHF11", "11-Mar_1st":"MARCHF11",
+                "Sep-15_1st": "SELENOF", "15_Sep_1st":"SELENOF", "Sep-01_1st": "SEPTIN1", "01-Sep_1st":"SEPTIN1",
+                "Sep-02_1st": "SEPTIN2", "02-Sep_1st":"SEPTIN2", "Sep-03_1st": "SEPTIN3", "03-Sep_1st":"SEPTIN3",
+                "Sep-04_1st": "SEPTIN4", "04-Sep_1st":"SEPTIN4", "Sep-05_1st": "SEPTIN5", "05-Sep_1st":"SEPTIN5",
+                "Sep-06_1st": "SEPTIN6", "06-Sep_1st":"SEPTIN6", "Sep-07_1st": "SEPTIN7", "07-Sep_1st":"SEPTIN7",
+                "Sep-08_1st": "SEPTIN8", "08-Sep_1st":"SEPTIN8", "Sep-09_1st": "SEPTIN9", "09-Sep_1st":"SEPTIN9",
+                "Sep-10_1st": "SEPTIN10", "10-Sep_1st":"SEPTIN10", "Sep-11_1st": "SEPTIN11", "11-Sep_1st":"SEPTIN11",
+                "Sep-12_1st": "SEPTIN12", "12-Sep_1st":"SEPTIN12", "Sep-13_1st":"SEPTIN7P2", "13-Sep_1st":"SEPTIN7P2",
+                "Sep-14_1st": "SEPTIN14", "14-Sep_1st":"SEPTIN14"
+                    }
+    mar01_options = {"MTARC1: mitochondrial amidoxime reducing component 1": ("MTARC1", "MARCHF1"),
+                     "MARCHF1: membrane associated ring-CH-type finger 1": ("MARCHF1", "MTARC1")}
+    mar02_options = {"MTARC2: mitochondrial amidoxime reducing component 2": ("MTARC2", "MARCHF2"),
+                     "MARCHF2: membrane associated ring-CH-type finger 2": ("MARCHF2", "MTARC2")}
+    date_formats = {"yyyy-dd-mm": "%Y-%d-%m", "yyyy-mm-dd": "%Y-%m-%d", "dd-mm-yyyy": "%d-%m-%Y", "mm-dd-yyyy": "%m-%d-%Y"}
+    info_formats = {'month-year': '%b-%y', 'month-day': '%b-%d'}
+
+    # every Excel date starts with a digit or a month, this RE2 prefix is matched by arrow over the whole index
+    date_prefix = r"^(?:\d|(?:MAR|APR|SEPT?|OCT|DEC)-)"
+    # one regex for every kind of Excel date, the named group that matched says which (MAR-01/MAR-02 before the other month dates)
+    date_pattern = re.compile(r"^(?:(?P<march>MAR-0?[12](?!\d)|0?[12]-MAR(?![A-Z]))"
+                              r"|(?P<dates>(?:MAR|APR|SEPT?|OCT|DEC)-|\d{1,2}-(?:MAR|APR|SEPT?|OCT|DEC)(?![A-Z]))"
+                              r"|(?P<numeric_dates>\d+[-/]?\W))", flags=re.I)
+    march_patterns = {w: re.compile(f"^(?:MAR-0?{w}|0?{w}-MAR)_(?:1st|2nd)$", flags=re.I) for w in (1, 2)}
+    ordinal_suffixes = {1: "st", 2: "nd", 3: "rd"}
+
+    def scan(self, genes):
+        '''
+        Finds every kind of naming issue in one vectorised pass over the gene symbols
+
+        Parameters
+        ----------
+        genes: pd.Index or list | gene symbols
+
+        Returns
+        -------
+        dict | boolean numpy masks aligned to genes for "march", "dates", "numeric_dates" and "old_symbols"
+        '''
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        genes = pd.Index(genes).astype(str)
+        masks = {k: np.zeros(len(genes), dtype=bool) for k in ["march", "dates", "numeric_dates"]}
+        starts = pc.match_substring_regex(pa.array(genes.to_numpy(), type=pa.string()), self.date_prefix, ignore_case=True)
+        hits = np.flatnonzero(starts.to_numpy(zero_copy_only=False))
+        if len(hits) != 0:  # only the few date-like symbols go through the python regex
+            kinds = genes[hits].str.extract(self.date_pattern).notna()
+            masks['march'][hits] = kinds['march'].to_numpy()
+            masks['dates'][hits] = (kinds['march'] | kinds['dates']).to_numpy()
+            masks['numeric_dates'][hits] = kinds['numeric_dates'].to_numpy()
+        masks['old_symbols'] = symbol_resolver.outdated(genes)
+        return masks
+
+    def date_genes(self, genes):
+        genes = pd.Index(genes)
+        return genes[self.scan(genes)['dates']].tolist()
+
+    def march_genes(self, genes):
+        '''
+        Date genes that may be either MARCHF1/MTARC1 or MARCHF2/MTARC2
+        '''
+        genes = pd.Index(genes)
+        return genes[self.scan(genes)['march']].tolist()
+
+    def numeric_date_genes(self, genes):
+        genes = pd.Index(genes)
+        return genes[self.scan(genes)['numeric_dates']].tolist()
+
+    def old_symbol_genes(self, genes):
+        genes = pd.Index(genes)
+        return genes[self.scan(genes)['old_symbols']].unique().tolist()
+
+    def issue(self, masks):
+        '''
+        The first naming issue found in the masks of scan
+        '''
+        for issue in ["dates", "old_symbols", "numeric_dates"]:
+            if masks[issue].any():
+                return issue
+        return None
+
+    def classify(self, df):
+        '''
+        Returns the naming issue of a dataframe: "dates", "old_symbols", "numeric_dates" or None.
+        Old symbols rarely co-exist with dates as every symbol becomes a date once opened in Excel, so only the first issue found is reported.
+        '''
+        return self.issue(self.scan(df.index))
+
+    def ordinals(self, n):
+        '''
+        English ordinals of an integer array (1 -> 1st, 12 -> 12th, 22 -> 22nd)
+        '''
+        n = np.asarray(n)
+        suffix = pd.Series(n % 10).map(self.ordinal_suffixes).fillna("th").to_numpy(dtype=object)
+        suffix[(n % 100 >= 11) & (n % 100 <= 13)] = "th"
+        return n.astype(str).astype(object) + suffix
+
+    def number_dates(self, df, dates):
+        '''
+        Rows of the date genes, renamed to zero-padded dates with an ordinal for each repeat (eg. Mar-1 -> Mar-01_1st, Mar-01_2nd)
+        '''
+        found = df[df.index.isin(dates)]
+        found = found.drop_duplicates()  # ensures that there aren't duplicate rows (not just duplicate row names)
+        labels = found.index.to_series().astype(str)
+        # still can't use dateparser as python time fmts only read zero-padded no.
+        padded = labels.str.extract(r"([A-Za-z]+)", expand=False) + "-" + labels.str.extract(r"(\d+)", expand=False).str.zfill(2)
+        repeat = padded.groupby(padded.to_numpy()).cumcount().add(1).to_numpy()
+        found.index = pd.Index(padded.to_numpy() + "_" + self.ordinals(repeat), name=df.index.name)
+        return found
+
+    def march_rows(self, found, which=1):
+        '''
+        Numbered date genes that are ambiguous between MARCHF{which} and MTARC{which}
+        '''
+        labels = found.index.astype(str)
+        return labels[labels.str.match(self.march_patterns[which])].tolist()
+
+    def resolve_dates(self, df, dates, mar01_fx=None, mar02_fx=None):
+        '''
+        Parameters
+        ----------
+        df: pd.DataFrame | data with gene symbols in the index
+        dates: list | date genes of df
+        mar01_fx, mar02_fx: str | key of mar01_options/mar02_options giving what the first MAR-01/MAR-02 row is, the default option if None
+
+        Returns
+        -------
+        pd.DataFrame | df with the date genes replaced by their gene symbols, sorted by gene
+        '''
+        corrected = dict(self.corrected)
+        for options, fx, num in [(self.mar01_options, mar01_fx, "01"), (self.mar02_options, mar02_fx, "02")]:
+            first, second = options[fx if fx is not None else list(options.keys())[0]]
+            for fmt in [f"MAR-{num}", f"Mar-{num}", f"{num}-MAR", f"{num}-Mar"]:
+                corrected[f"{fmt}_1st"], corrected[f"{fmt}_2nd"] = first, second
+
+        found = self.number_dates(df, dates)
+        found = found.rename(index=corrected)
+        df2 = pd.concat([df[~df.index.isin(dates)], found], axis=0)  # join the renamed genes back to the rest
+        df2.sort_index(axis=0, ascending=True, inplace=True)  # sort alphabetically
+        return df2
+
+    def parse_numeric_dates(self, df, numdate, date_fmt="yyyy-dd-mm", info_stored="month-day"):
+        '''
+        Renames numeric dates (eg. 2001-03-09) to month-name dates, reading either the year or the day as the gene number
+
+        Parameters
+        ----------
+        date_fmt: str | one of date_formats, how the dates were written
+        info_stored: str | one of info_formats, whether the gene number is the year or the day of the date
+        '''
+        strfmt = self.info_formats[info_stored]
+        is_date = df.index.isin(numdate)
+        numeric = df.index[is_date].astype(str)
+        # Excel writes dates as eg. 2001-03-09 00:00:00, 2001/03/09 or 2001.03.09, read the date part in the chosen format
+        date_part = numeric.str.split(r"[\sT]", n=1, regex=True).str[0].str.replace(r"[/.]", "-", regex=True)
+        parsed = pd.Series(pd.to_datetime(date_part, format=self.date_formats[date_fmt], errors="coerce").strftime(strfmt), dtype=object)
+        missed = np.flatnonzero(parsed.isna().to_numpy())
+        if len(missed) != 0:  # anything else is left to dateparser, one symbol at a time
+            import dateparser
+            for i in missed:
+                d = dateparser.parse(numeric[i], date_formats=[self.date_formats[date_fmt]])
+                parsed.iloc[i] = d.strftime(strfmt) if d is not None else np.nan
+        genes = df.index.to_numpy(dtype=object, copy=True)
+        genes[is_date] = parsed.to_numpy()
+        return df.set_axis(pd.Index(genes, name=df.index.name), axis=0)
+
+    def rename_old_symbols(self, df, aliases=True):
+        '''
+        Renames previous HGNC symbols, and alias symbols if aliases, to the approved symbols (eg. DEC1 -> DELEC1), see SymbolResolver.audit
+        '''
+        return symbol_resolver.rename(df, aliases=aliases)
+
+    def clean(self, df, mar01_fx=None, mar02_fx=None, date_fmt="yyyy-dd-mm", info_stored="month-day", aliases=True):
+        '''
+        Fixes the naming issue found by classify in one go, with the given choices instead of asking for them
+        '''
+        masks = self.scan(df.index)
+        issue = self.issue(masks)
+        if issue == "old_symbols":
+            return self.rename_old_symbols(df, aliases=aliases)
+        if issue == "numeric_dates":
+            df = self.parse_numeric_dates(df, df.index[masks['numeric_dates']], date_fmt=date_fmt, info_stored=info_stored)
+            masks = self.scan(df.index)
+        if issue is not None:
+            return self.resolve_dates(df, df.index[masks['dates']].tolist(), mar01_fx=mar01_fx, mar02_fx=mar02_fx)
+        return df
+
+symbol_qc = GeneSymbolQC()
@@ -0,0 +1,121 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from helper_functions.disk_cache import cache_dir, content_hash
+
+class GMTIndex():
+    '''
+    Compiled gene set library: a term table, the CSR gene membership arrays (indptr, indices) and the gene dictionary.
+    Arrays are memory-mapped from the cache folder of the library's content hash.
+    '''
+    def __init__(self, path):
+        '''
+        Parameters
+        ----------
+        path: str | cache folder holding terms.npy, genes.npy, indptr.npy and indices.npy
+        '''
+        self.path = path
+        self.token = os.path.basename(path)
+        self.terms = np.load(os.path.join(path, "terms.npy"), mmap_mode="r")
+        self.genes = np.load(os.path.join(path, "genes.npy"), mmap_mode="r")
+        self.indptr = np.load(os.path.join(path, "indptr.npy"), mmap_mode="r")
+        self.indices = np.load(os.path.join(path, "indices.npy"), mmap_mode="r")
+        self._membership = None
+
+    def __reduce__(self): # send the cache path to worker processes instead of the arrays
+        return (GMTIndex, (self.path,))
+
+    def __len__(self):
+        return len(self.terms)
+
+    @property
+    def gene_index(self):
+        return pd.Index(self.genes.astype(object))
+
+    @property
+    def membership(self):
+        '''
+        terms x genes boolean CSR matrix over the memory-mapped index arrays
+        '''
+        if self._membership is None:
+            from scipy import sparse
+            self._membership = sparse.csr_matrix((np.ones(len(self.indices), dtype=bool), self.indices, self.indptr),
+                                                 shape=(len(self.terms), len(self.genes)))
+        return self._membership
+
+    def to_dict(self):
+        genes = self.genes.astype(object)
+        return {t:list(genes[self.indices[self.indptr[i]:self.indptr[i + 1]]]) for i, t in enumerate(self.terms.astype(object))}
+
+class GMTCompiler():
+    '''
+    Compiles GMT files, uploaded GMTs and Enrichr libraries into GMTIndex folders under the STAGES cache, keyed by content hash
+    '''
+    def parse(self, text):
+        '''
+        Returns {term: genes} from GMT text, with the description column dropped and blank genes removed
+        '''
+        gene_sets = {}
+        for line in text.splitlines():
+            break_mod = line.rstrip("\r\n").split("\t")
+            if break_mod[0] == "":
+                continue
+            gene_sets[break_mod[0]] = [g.strip() for g in break_mod[2:] if g.strip() != ""]
+        return gene_sets
+
+    def to_gmt(self, gene_sets):
+        return "".join(f"{term}\t\t" + "\t".join(genes) + "\n" for term, genes in gene_sets.items()).encode("utf-8")
+
+    def compile(self, data):
+        '''
+        Parameters
+        ----------
+        data: bytes | contents of a GMT file
+
+        Returns
+        -------
+        GMTIndex | index loaded from the cache, compiled first if this content has not been seen before
+        '''
+        path = os.path.join(cache_dir("gmt"), content_hash(data))
+        if os.path.exists(path):
+            return GMTIndex(path)
+
+        gene_sets = self.parse(data.decode("utf-8"))
+        terms = sorted(gene_sets.keys())
+        genes = pd.Index(sorted(set(g for v in gene_sets.values() for g in v)))
+        cols = [np.unique(genes.get_indexer(gene_sets[t])) for t in terms]
+        indptr = np.concatenate([[0], np.cumsum([len(c) for c in cols])]).astype(np.int64)
+        indices = np.concatenate(cols).astype(np.int32) if len(cols) != 0 else np.array([], dtype=np.int32)
+
+        tmp = f"{path}.{os.getpid()}.tmp"
+        os.makedirs(tmp, exist_ok=True)
+        np.save(os.path.join(tmp, "terms.npy"), np.array(terms, dtype=str))
+        np.save(os.path.join(tmp, "genes.npy"), genes.to_numpy(dtype=str))
+        np.save(os.path.join(tmp, "indptr.npy"), indptr)
+        np.save(os.path.join(tmp, "indices.npy"), indices)
+        try:
+            os.rename(tmp, path)
+        except OSError: # compiled concurrently by another process
+            shutil.rmtree(tmp, ignore_errors=True)
+        return GMTIndex(path)
+
+    def load(self, select_dataset):
+        '''
+        Parameters
+        ----------
+        select_dataset: str, dict or GMTIndex | path to a .gmt file, Enrichr library name, {term: genes} or an already compiled index
+        '''
+        if isinstance(select_dataset, GMTIndex):
+            return select_dataset
+        if isinstance(select_dataset, dict):
+            return self.compile(self.to_gmt(select_dataset))
+        if select_dataset.endswith(".gmt"):
+            with open(select_dataset, "rb") as gmt:
+                return self.compile(gmt.read())
+        import gseapy as gp
+        return self.compile(self.to_gmt(gp.get_library(name=select_dataset, organism='Human')))
+
+gmt_compiler = GMTCompiler()
@@ -1,63 +1,137 @@
 import plotly.graph_objects as go
-import plotly.figure_factory as ff
 from plotly.subplots import make_subplots
 import textwrap
 
 import numpy as np
 import pandas as pd
-import gseapy as gp
-from gseapy.biomart import Biomart
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-import streamlit as st
-
-from datetime import datetime, timedelta
-import pytz
+from helper_functions.background import get_background, BACKGROUND_FILE
+from helper_functions.prerank_engine import prerank_engine
+from helper_functions.gmt_index import GMTIndex, gmt_compiler
+from helper_functions.memo import memo
 
 class Enrichr_STAGES():
     '''
     Class to run enrichr functions for STAGES
     '''
 
-    def background_enrichr(_self, filename):
-        start_date = datetime(2023, 3, 23, tzinfo=pytz.timezone("Asia/Singapore"))
-        today = datetime.now(tz=pytz.timezone("Asia/Singapore"))
-        interval = timedelta(days = 90)
-        if today >= start_date + interval:
-            bm = Biomart()
-            query = bm.query(dataset='hsapiens_gene_ensembl', #  e.g. 'hsapiens_gene_ensembl'
-                             attributes=['ensembl_gene_id', 'external_gene_name', 'entrezgene_id'],
-                             filename="accessory_files/hsapiens_gene_ensembl.txt")
-            query = query.dropna(subset=["entrezgene_id"], inplace=True)
-            start_date = today
-        else:
-            query = pd.read_csv(filename, sep="\t",index_col=0)
-            query = query.dropna(subset=["entrezgene_id"], inplace=True)
-        return query
-    
-    @st.cache_data
+    def background_enrichr(_self, filename=BACKGROUND_FILE):
+        '''
+        Returns the process-wide BackgroundUniverse of human genes with an Entrez ID, loaded once from its compiled cache
+        '''
+        return get_background(filename)
+
+    @memo.memoize(resource=True)
+    def library_matrix(_self, select_dataset, background=None):
+        '''
+        Parameters
+        ----------
+        select_dataset: str, dict or GMTIndex | path to a local .gmt file, Enrichr library name, {term: genes} or compiled uploaded gene set
+        background: BackgroundUniverse | gene universe, gene sets are restricted to its genes if provided
+
+        Returns
+        -------
+        terms: np.ndarray | sorted term names
+        universe: pd.Index | gene universe that the membership columns refer to (look genes up with background.locate if provided)
+        membership: scipy.sparse.csr_matrix | terms x genes gene set membership
+        '''
+        from scipy import sparse
+
+        index = gmt_compiler.load(select_dataset)
+        terms = index.terms.astype(object)
+        if background is None:
+            return terms, index.gene_index, index.membership
+
+        universe = background.genes
+        to_background = background.locate(index.gene_index)[index.indices] # library gene column -> background column, matched case-insensitively
+        rows = np.repeat(np.arange(len(terms)), np.diff(index.indptr))
+        in_bg = to_background >= 0 # drop genes outside the background
+        membership = sparse.csr_matrix((np.ones(in_bg.sum(), dtype=bool), (rows[in_bg], to_background[in_bg])), shape=(len(terms), len(universe)))
+        return terms, universe, membership
+
+    def enrich_local(_self, gene_dict, select_dataset, background=None):
+        '''
+        In-process equivalent of gp.enrichr for local gene sets: hypergeometric p-values, Benjamini-Hochberg adjustment,
+        odds ratio and combined score for every term, returned with the same columns as enr.results
+
+        Parameters
+        ----------
+        gene_dict: dict | keys containing deg keys or user_genes and values containing list of genes to use
+        select_dataset: str, dict or GMTIndex | path to a local .gmt file, {term: genes} or compiled uploaded gene set
+        background: BackgroundUniverse | gene universe, the genes of all gene sets are used if None
+        '''
+        from scipy import stats
+        from statsmodels.stats import multitest
+
+        terms, universe, membership = _self.library_matrix(select_dataset, background=background)
+        gs_name = os.path.basename(select_dataset).replace(".gmt", "") if isinstance(select_dataset, str) else "user_geneset"
+        bg = len(universe)
+        gs_size = np.diff(membership.indptr)
+        col_names = ["Gene_set", "Term", "Overlap", "P-value", "Adjusted P-value", "Odds Ratio", "Combined Score", "Genes"]
+
+        results = {}
+        for k,v in gene_dict.items():
+            query = np.unique(background.locate(v) if background is not None else universe.get_indexer(v))
+            query = query[query >= 0] # genes outside the universe are not counted, as in gseapy
+            n_query = len(query)
+            overlap = membership[:, query] # terms x query genes, each row lists the hits of that term
+            hits = np.diff(overlap.indptr)
+            has_hit = np.flatnonzero(hits > 0)
+            if len(has_hit) == 0:
+                results[k] = pd.DataFrame(columns=col_names)
+                continue
+
+            x, m = hits[has_hit], gs_size[has_hit]
+            pvals = stats.hypergeom.sf(x - 1, bg, m, n_query)
+            oddr = ((x + 0.5) * (bg - m - n_query + x + 0.5)) / ((m - x + 0.5) * (n_query - x + 0.5)) # Haldane-Anscombe correction as in gseapy
+            fdrs = multitest.multipletests(pvals, method='fdr_bh')[1]
+            hit_genes = [";".join(sorted(universe[query[overlap.indices[overlap.indptr[t]:overlap.indptr[t + 1]]]])) for t in has_hit]
+            results[k] = pd.DataFrame({"Gene_set": gs_name,
+                                       "Term": terms[has_hit],
+                                       "Overlap": [f"{a}/{b}" for a, b in zip(x, m)],
+                                       "P-value": pvals,
+                                       "Adjusted P-value": fdrs,
+                                       "Odds Ratio": oddr,
+                                       "Combined Score": -1 * np.log(pvals) * oddr,
+                                       "Genes": hit_genes})
+        return results
+
+    @memo.memoize
     def execute_enrichr(_self, gene_dict, select_dataset, enr_pthresh=0.05, enr_showall=True, enr_showX=10):
         '''
         Parameters
         ----------
         gene_dict: dict | keys containing deg keys or user_genes and values containing list of genes to use
-        select_dataset: str | one of the gene sets for enrichr
+        select_dataset: str, dict or GMTIndex | one of the gene sets for enrichr
         enr_pthresh: float | pvalue to filter pathways by
         enr_showX: int | number of pathways to display from filtered dataset
         '''
         enr_significant, enr_all = {}, {}
         non_zero = {k:gene_dict[k] for k in gene_dict.keys() if len(gene_dict[k]) !=0} # in case deg sets with 0 genes were selected
+        background = _self.background_enrichr()
+        is_local = isinstance(select_dataset, (dict, GMTIndex)) or str(select_dataset).endswith(".gmt")
+        if is_local: # all gene lists against all terms in one go, no call to the Enrichr API
+            local_results = _self.enrich_local(non_zero, select_dataset, background=background)
+        else:
+            import gseapy as gp
+
         for k,v in non_zero.items():
-            enr = gp.enrichr(
-                gene_list=v,
-                gene_sets=select_dataset,
-                outdir=None,
-                no_plot=True,
-                cutoff=0.5,
-                background=_self.background_enrichr(filename="accessory_files/hsapiens_gene_ensembl.txt")
-            )
+            if is_local:
+                data = local_results[k]
+            else:
+                enr = gp.enrichr(
+                    gene_list=v,
+                    gene_sets=select_dataset,
+                    outdir=None,
+                    no_plot=True,
+                    cutoff=0.5,
+                    background=background.symbols.tolist()
+                )
+                data = enr.results
 
             # Sort values by adjusted p-value
-            data = enr.results
             data.set_index("Term", inplace=True)
             data = data.sort_values(by=['Adjusted P-value'])
             # Drop the unimportant variables
@@ -75,7 +149,7 @@ class Enrichr_STAGES():
             enr_all[k] = data
         return enr_all, enr_significant
     
-    @st.cache_data
+    @memo.memoize
     def enr_barplot(_self, enr_significant, enr_useDEG=None, deg_fc=1.30, deg_pval=0.05, use_corrected_pval=True, select_dataset="BTM", enr_pthresh=0.05, enr_showall=True, enr_showX=10, enr_ht=500):
         title_fmt = f"All significant Enrichr {select_dataset} pathways" if enr_showall else f"Top {enr_showX} Enrichr {select_dataset} pathways"
         if enr_useDEG is not None: # which implies it will require DEGs
@@ -128,66 +202,101 @@ class Prerank_STAGES():
     '''
     Class to run GSEA prerank functions for STAGES
     '''
-    def format_cols(self, log_dict_ready, comparisons, selected_df):
+    def format_cols(self, comparison_store, comparisons, selected_df):
         '''
         Parameters
         ----------
-        log_dict_ready: dict | log2FC, -log10(p/adjP), p/adjP
+        comparison_store: ComparisonStore | log2FC, p, adjP and -log10(p/adjP) of every comparison
         comparisons: dict | keys containing file name, values containing list of comparisons
         '''
         col_storage = {}
         comps = comparisons[selected_df]
-        to_parse = log_dict_ready[selected_df]
         for comp in comps:
-            logfc_comp = to_parse.loc[:,f"log2FC_{comp}"]
+            logfc_comp = comparison_store.frame(selected_df, comp, ['log2FC'])
             logfc_comp = logfc_comp.reset_index()
             logfc_comp.columns = [0,1]
             logfc_comp = logfc_comp.sort_values(by=1, ascending=False)
             col_storage[f"{selected_df}_{comp}"] = logfc_comp
         return col_storage
 
-    @st.cache_data
-    def execute_prerank(_self, col_dict, select_dataset, prerank_pthresh=0.05, prerank_showX=10):
-        prerank_results_dict = {}
-        prerank_all_out = {}
-        prerank_sig_out = {}
-        for key, data in col_dict.items():
-            running = gp.prerank(rnk=data,
-                                gene_sets=select_dataset,
-                                permutation_num=200,  # reduce number to speed up testing
-                                outdir=None,
-                                seed=123,
-                                no_plot=True)
-            prerank_results_dict[key] = running
-
-        for key, result in prerank_results_dict.items():
-            results = result.res2d
-            prerank_all_out[key] = results
+    def prerank_job(self, key, library, data, select_dataset, permutation_num=1000, seed=123):
+        '''
+        Runs GSEA prerank for one comparison against one gene set library with the vectorised engine.
+        The library's membership matrix is built once per process and the rank permutations are shared by all comparisons with the same number of genes.
+
+        Returns
+        -------
+        key, library and the res2d-like dataframe of the run
+        '''
+        terms, universe, membership = enr.library_matrix(select_dataset)
+        results = prerank_engine.prerank(data, terms, universe, membership, permutation_num=permutation_num, seed=seed)
+        return key, library, results
+
+    def iter_prerank(self, col_dict, select_datasets, permutation_num=1000, workers=None, seed=123):
+        '''
+        Runs prerank for every comparison x library over a process pool and yields each result as soon as it finishes
 
-            ranked = results.loc[:,['Term', 'Lead_genes', 'NES', 'FDR q-val']]
+        Parameters
+        ----------
+        col_dict: dict | keys containing comparison names, values containing 2-column dataframes of gene and log2FC
+        select_datasets: dict | keys containing library names, values containing .gmt paths, Enrichr library names {term: genes} or GMTIndex
+        permutation_num: int | number of permutations per run
+        workers: int | number of worker processes, defaults to the number of CPUs
+        seed: int | random seed passed to every run
+
+        Yields
+        ------
+        (key, library, res2d) in order of completion
+        '''
+        jobs = [(key, library, data, gs) for key, data in col_dict.items() for library, gs in select_datasets.items()]
+        workers = min(workers or os.cpu_count() or 1, len(jobs))
+        if workers <= 1: # no pool overhead for a single run
+            for job in jobs:
+                yield self.prerank_job(*job, permutation_num=permutation_num, seed=seed)
+            return
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(self.prerank_job, *job, permutation_num=permutation_num, seed=seed) for job in jobs]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def summarise_prerank(self, results, prerank_pthresh=0.05, prerank_showX=10):
+        '''
+        Returns the top positively and negatively enriched terms of a res2d dataframe below the FDR threshold
+        '''
+        ranked = results.loc[:,['Term', 'Lead_genes', 'NES', 'FDR q-val']]
+
+        ranked = ranked.set_index("Term")
+        ranked.index = [i.replace('"', "") for i in ranked.index]
 
-            ranked = ranked.set_index("Term")
-            ranked.index = [i.replace('"', "") for i in ranked.index]
+        pos_nes = ranked[(ranked["NES"] > 0) & (ranked["FDR q-val"] < prerank_pthresh)]
+        neg_nes = ranked[(ranked["NES"] < 0) & (ranked["FDR q-val"] < prerank_pthresh)]
+        neg_nes["negative NES"] = neg_nes["NES"] * -1
 
-            pos_nes = ranked[(ranked["NES"] > 0) & (ranked["FDR q-val"] < prerank_pthresh)]
-            neg_nes = ranked[(ranked["NES"] < 0) & (ranked["FDR q-val"] < prerank_pthresh)]
-            neg_nes["negative NES"] = neg_nes["NES"] * -1
+        pos_nes_sort = pos_nes.sort_values(by=['NES'], ascending=True).tail(prerank_showX)
+        pos_nes_sort.reset_index(inplace=True) # Compatibility issues with python 3.7, where the names argument was not valid at pandas 1.3.5
+        pos_nes_sort = pos_nes_sort.rename(columns = {'index':'Term'}) # Subsequently due to this version error, have to manually rename the index column to term
+        pos_nes_sort['direction'] = "positive"
 
-            pos_nes_sort = pos_nes.sort_values(by=['NES'], ascending=True).tail(prerank_showX)
-            pos_nes_sort.reset_index(inplace=True) # Compatibility issues with python 3.7, where the names argument was not valid at pandas 1.3.5
-            pos_nes_sort = pos_nes_sort.rename(columns = {'index':'Term'}) # Subsequently due to this version error, have to manually rename the index column to term
-            pos_nes_sort['direction'] = "positive"
+        neg_nes_sort = neg_nes.sort_values(by=['negative NES'], ascending=True).tail(prerank_showX)
+        neg_nes_sort.reset_index(inplace=True) # Compatibility issues with python 3.7, where the names argument was not valid at pandas 1.3.5
+        neg_nes_sort = neg_nes_sort.rename(columns = {'index':'Term'}) # Subsequently due to this version error, have to manually rename the index column to term
+        neg_nes_sort['direction'] = "negative"
+        return pos_nes_sort, neg_nes_sort
 
-            neg_nes_sort = neg_nes.sort_values(by=['negative NES'], ascending=True).tail(prerank_showX)
-            neg_nes_sort.reset_index(inplace=True) # Compatibility issues with python 3.7, where the names argument was not valid at pandas 1.3.5
-            neg_nes_sort = neg_nes_sort.rename(columns = {'index':'Term'}) # Subsequently due to this version error, have to manually rename the index column to term
-            neg_nes_sort['direction'] = "negative"
+    @memo.memoize
+    def execute_prerank(_self, col_dict, select_dataset, prerank_pthresh=0.05, prerank_showX=10, permutation_num=1000):
+        prerank_all_out = {}
+        prerank_sig_out = {}
+        for key, data in col_dict.items():
+            _, _, results = _self.prerank_job(key, None, data, select_dataset, permutation_num=permutation_num)
+            prerank_all_out[key] = results
 
+            pos_nes_sort, neg_nes_sort = _self.summarise_prerank(results, prerank_pthresh=prerank_pthresh, prerank_showX=prerank_showX)
             prerank_sig_out[f'Positive_enrichment_{key}'] = pos_nes_sort
             prerank_sig_out[f'Negative_enrichment_{key}'] = neg_nes_sort
         return prerank_all_out, prerank_sig_out
 
-    @st.cache_data
+    @memo.memoize
     def prerank_barplot(_self, prerank_sig, selected_col, prerank_pthresh=0.05, select_dataset=None, prerank_showX=10, prerank_ht = 1000):
         fig = make_subplots(rows=2, cols=1, shared_xaxes=True, x_title = "|NES|", vertical_spacing=0.05, subplot_titles=list(prerank_sig.keys()))
         i = 1
@@ -0,0 +1,189 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from helper_functions.memo import memo
+from helper_functions.accessory import accessory_file
+
+class SymbolResolver():
+    '''
+    Resolves gene symbols to current HGNC approved symbols through the approved, previous and alias symbol tables of HGNC.
+
+    The tables are compacted into one local artifact (accessory_files/hgnc_symbols.parquet) holding a single row per known symbol,
+    so a whole upload is resolved with one join on its index and without network access. Symbols that could mean more than one gene
+    are settled when the artifact is built: approved symbols win over previous symbols, previous symbols over aliases,
+    and ties go to the lowest HGNC ID.
+    '''
+    artifact = accessory_file("hgnc_symbols.parquet")
+    complete_set = accessory_file("hgnc_complete_set.txt")
+    complete_set_url = "https://storage.googleapis.com/public-download-files/hgnc/tsv/tsv/hgnc_complete_set.txt"
+    symbol_checks = [accessory_file("hgnc-symbol-check2.csv")]
+    ensembl_genes = accessory_file("hsapiens_gene_ensembl.txt")
+    match_ranks = {'approved': 0, 'previous': 1, 'alias': 2}
+
+    def complete_set_table(self, path):
+        '''
+        Symbol -> approved symbol table of the HGNC complete set (hgnc_complete_set.txt from the HGNC downloads page)
+        '''
+        hgnc = pd.read_csv(path, sep="\t", usecols=['hgnc_id', 'symbol', 'status', 'alias_symbol', 'prev_symbol'], dtype=str)
+        hgnc = hgnc[hgnc['status'] == "Approved"]
+        tables = [pd.DataFrame({'symbol': hgnc['symbol'], 'approved': hgnc['symbol'], 'hgnc_id': hgnc['hgnc_id'], 'match': "approved"})]
+        for col, match in [('prev_symbol', "previous"), ('alias_symbol', "alias")]:
+            listed = hgnc.dropna(subset=[col])
+            listed = listed.assign(**{col: listed[col].str.split("|")}).explode(col)
+            tables.append(pd.DataFrame({'symbol': listed[col], 'approved': listed['symbol'], 'hgnc_id': listed['hgnc_id'], 'match': match}))
+        return pd.concat(tables, ignore_index=True)
+
+    def symbol_check_table(self, path):
+        '''
+        Symbol -> approved symbol table of a HGNC multi-symbol checker export (eg. accessory_files/hgnc-symbol-check2.csv)
+        '''
+        check = pd.read_csv(path, skiprows=1, dtype=str) # first line is Excel's "sep=" hint
+        table = pd.DataFrame({'symbol': check['Input'], 'approved': check['Approved symbol'], 'hgnc_id': check['HGNC ID'],
+                              'match': check['Match type'].str.split().str[0].str.lower()})
+        table = table[table['match'].isin(self.match_ranks.keys())]
+        approved = table.drop_duplicates('approved').assign(symbol=lambda t: t['approved'], match="approved")
+        return pd.concat([table, approved], ignore_index=True)
+
+    def compact(self, table):
+        '''
+        Reduces a long symbol -> approved symbol table to one row per symbol
+
+        Returns
+        -------
+        pd.DataFrame | columns symbol (upper-case), approved, hgnc_id, match and candidates (number of genes the symbol could mean), sorted by symbol
+        '''
+        table = table.dropna(subset=['symbol', 'approved']).copy()
+        table['symbol'] = table['symbol'].str.strip().str.upper()
+        table['rank'] = table['match'].map(self.match_ranks)
+        table['hgnc_num'] = pd.to_numeric(table['hgnc_id'].str.extract(r"(\d+)", expand=False), errors="coerce")
+        table = table.sort_values(['symbol', 'rank', 'hgnc_num', 'approved'], na_position="last", kind="stable")
+        table = table.drop_duplicates(['symbol', 'approved']) # the best match of every symbol/gene pair
+        table['candidates'] = table.groupby('symbol', sort=False)['approved'].transform("size").astype("int16")
+        table = table.drop_duplicates('symbol') # the best gene of every symbol
+        table['match'] = pd.Categorical(table['match'], categories=list(self.match_ranks.keys()))
+        return table[['symbol', 'approved', 'hgnc_id', 'match', 'candidates']].reset_index(drop=True)
+
+    def build(self, complete_set=None, symbol_checks=None, symbols=None, dest=None):
+        '''
+        Writes the resolver artifact
+
+        Parameters
+        ----------
+        complete_set: str | path of hgnc_complete_set.txt, the full approved/previous/alias tables downloaded from complete_set_url
+            (accessory_files/hgnc_complete_set.txt if None), or False to build from the other sources only
+        symbol_checks: list | paths of HGNC multi-symbol checker exports (the shipped export if None)
+        symbols: list-like | extra approved symbols without an HGNC ID (the Ensembl gene names of accessory_files if None)
+        dest: str | output parquet, the shipped artifact if None
+
+        Returns
+        -------
+        pd.DataFrame | the compacted table that was written, with its sources and the number of symbols of each match type in attrs
+        '''
+        complete_set = self.complete_set if complete_set is None else complete_set
+        if complete_set is not False and not os.path.exists(complete_set):
+            raise FileNotFoundError(f"{complete_set} not found, download it from {self.complete_set_url} or pass complete_set=False")
+        symbol_checks = self.symbol_checks if symbol_checks is None else symbol_checks
+        if symbols is None:
+            symbols = pd.read_csv(self.ensembl_genes, sep="\t", usecols=['external_gene_name'], dtype=str)['external_gene_name'].dropna().unique()
+        sources = ([str(complete_set)] if complete_set is not False else []) + [str(p) for p in symbol_checks]
+        tables = [self.complete_set_table(complete_set)] if complete_set is not False else []
+        tables += [self.symbol_check_table(p) for p in symbol_checks]
+        tables.append(pd.DataFrame({'symbol': list(symbols), 'approved': list(symbols), 'hgnc_id': np.nan, 'match': "approved"}))
+        index = self.compact(pd.concat(tables, ignore_index=True))
+        index.attrs = {'sources': sources + ([self.ensembl_genes] if len(symbols) else []),
+                       'counts': {k: int(v) for k, v in index['match'].value_counts().items()}}
+        index.to_parquet(dest if dest is not None else self.artifact, index=False, compression="zstd")
+        return index
+
+    @memo.memoize(resource=True)
+    def index(_self, path=None):
+        '''
+        The resolver artifact indexed by upper-case symbol, loaded once per process
+        '''
+        index = pd.read_parquet(path if path is not None else _self.artifact).set_index('symbol')
+        index['rank'] = index['match'].astype(str).map(_self.match_ranks).astype("int8")
+        index['approved_key'] = index['approved'].str.upper()
+        return index
+
+    def keys(self, genes):
+        '''
+        Lookup keys of gene symbols: stripped and upper-cased by arrow kernels instead of per-gene python
+        '''
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        genes = pa.array(pd.Index(genes).astype(str).to_numpy(), type=pa.string())
+        return pd.Index(pc.utf8_upper(pc.utf8_trim_whitespace(genes)).to_numpy(zero_copy_only=False))
+
+    def outdated(self, genes, aliases=True, path=None):
+        '''
+        Boolean mask of the genes that are previous (or alias) symbols of another gene
+        '''
+        index = self.index(path)
+        pos = index.index.get_indexer(self.keys(genes))
+        rank = index['rank'].to_numpy()[pos]
+        return (pos >= 0) & (rank >= self.match_ranks['previous']) & (aliases | (rank == self.match_ranks['previous']))
+
+    def audit(self, genes, aliases=True, path=None):
+        '''
+        Resolves every gene of an upload in one join against the artifact
+
+        A previous/alias symbol is not renamed when its approved symbol is already in the upload, or when an earlier gene
+        (better match first, then upload order) was renamed to the same symbol, so that the renamed index has no new duplicates.
+
+        Parameters
+        ----------
+        genes: pd.Index or list | gene symbols in upload order
+        aliases: bool | also rename alias symbols, otherwise only previous symbols
+
+        Returns
+        -------
+        pd.DataFrame | one row per gene with the columns input, symbol (what it is renamed to), approved, match (approved, previous,
+                       alias or unmatched), hgnc_id, candidates, renamed and note
+        '''
+        index = self.index(path)
+        genes = pd.Index(genes).astype(str)
+        keys = self.keys(genes)
+        pos = index.index.get_indexer(keys)
+        found = pos >= 0
+        def take(col, fill):
+            return np.where(found, index[col].to_numpy()[pos], fill)
+
+        rank = take('rank', len(self.match_ranks))
+        match = np.array(list(self.match_ranks.keys()) + ["unmatched"], dtype=object)[rank]
+        approved = take('approved', None)
+        candidates = take('candidates', 0)
+        renamed = found & (rank >= self.match_ranks['previous']) & (aliases | (rank == self.match_ranks['previous']))
+
+        target = pd.Index(np.where(renamed, index['approved_key'].to_numpy()[pos], None), dtype=object)
+        present = renamed & target.isin(keys[keys.isin(target[renamed])]) # hashes the few targets, not the whole upload
+        order = pd.DataFrame({'target': target[renamed & ~present], 'rank': rank[renamed & ~present]},
+                             index=np.flatnonzero(renamed & ~present)).sort_values('rank', kind="stable")
+        taken = np.zeros(len(genes), dtype=bool)
+        taken[order.index[order['target'].duplicated()]] = True
+
+        note = np.full(len(genes), "", dtype=object)
+        note[renamed & (candidates > 1)] = "ambiguous, best match kept"
+        note[present] = "approved symbol already in upload"
+        note[taken] = "another gene renamed to this symbol first"
+        renamed &= ~(present | taken)
+
+        return pd.DataFrame({'input': genes.to_numpy(),
+                             'symbol': np.where(renamed, approved, genes.to_numpy()),
+                             'approved': approved,
+                             'match': match,
+                             'hgnc_id': take('hgnc_id', None),
+                             'candidates': candidates,
+                             'renamed': renamed,
+                             'note': note})
+
+    def rename(self, df, aliases=True, audit=None, path=None):
+        '''
+        df with its previous/alias gene symbols replaced by the approved symbols, as decided by audit (computed if None)
+        '''
+        audit = self.audit(df.index, aliases=aliases, path=path) if audit is None else audit
+        return df.set_axis(pd.Index(audit['symbol'].to_numpy(), name=df.index.name), axis=0)
+
+symbol_resolver = SymbolResolver()
@@ -0,0 +1,170 @@
+import collections
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import threading
+
+import numpy as np
+import pandas as pd
+
+from helper_functions.disk_cache import cache_dir
+
+class LRUBackend():
+    '''
+    In-memory least-recently-used store, shared by every session and thread of the process
+    '''
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class DiskBackend():
+    '''
+    Content-addressed store of pickled results under the STAGES cache, shared by every process using the same cache directory.
+    Remove the folder to clear it.
+    '''
+    def __init__(self, path=None):
+        self.path = path if path is not None else cache_dir("memo")
+
+    def entry(self, key):
+        return os.path.join(self.path, key[:2], f"{key}.pkl")
+
+    def get(self, key):
+        try:
+            with open(self.entry(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value):
+        path = self.entry(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(value)
+        os.replace(tmp, path)
+
+    def clear(self):
+        for root, _, files in os.walk(self.path):
+            for f in files:
+                os.remove(os.path.join(root, f))
+
+class Memo():
+    '''
+    Memoisation of the STAGES compute functions without Streamlit.
+
+    Results are keyed on the function and a content hash of its arguments, so the same inputs hit the same entry across sessions
+    (and across processes with the disk backend). Arguments whose names start with an underscore are not hashed, as with st.cache_data,
+    and objects with a `token` attribute (ComparisonStore, BackgroundUniverse, GMTIndex) are hashed by their token.
+
+    The data backend is chosen with the STAGES_MEMO environment variable ("memory", the default, or "disk") or with set_backend.
+    '''
+    backends = {'memory': LRUBackend, 'disk': DiskBackend}
+
+    def __init__(self):
+        self._backend = None
+        self.resources = LRUBackend(maxsize=32)
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = self.backends[os.environ.get("STAGES_MEMO", "memory")]()
+        return self._backend
+
+    def set_backend(self, backend):
+        '''
+        Parameters
+        ----------
+        backend: str or backend object | "memory", "disk", or any object with get(key), set(key, value) and clear()
+        '''
+        self._backend = self.backends[backend]() if isinstance(backend, str) else backend
+
+    def clear(self):
+        self.backend.clear()
+        self.resources.clear()
+
+    def hash_value(self, value, h):
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            h.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+            h.update(repr(value.columns.tolist() if isinstance(value, pd.DataFrame) else value.name).encode())
+            h.update(repr(list(value.dtypes) if isinstance(value, pd.DataFrame) else value.dtype).encode())
+        elif isinstance(value, pd.Index):
+            h.update(pd.util.hash_pandas_object(value).to_numpy().tobytes())
+        elif isinstance(value, np.ndarray):
+            h.update(f"{value.dtype}{value.shape}".encode())
+            h.update(np.ascontiguousarray(value).tobytes() if value.dtype != object else pickle.dumps(value))
+        elif hasattr(value, "token"):
+            h.update(f"{type(value).__name__}:{value.token}".encode())
+        elif isinstance(value, dict):
+            h.update(b"dict")
+            for k, v in value.items():
+                self.hash_value(k, h)
+                self.hash_value(v, h)
+        elif isinstance(value, (list, tuple)):
+            h.update(type(value).__name__.encode())
+            for v in value:
+                self.hash_value(v, h)
+        elif isinstance(value, (set, frozenset)):
+            h.update(repr(sorted(map(repr, value))).encode())
+        elif value is None or isinstance(value, (str, bytes, int, float, bool, np.generic)):
+            h.update(repr(value).encode())
+        else:
+            h.update(pickle.dumps(value))
+        h.update(b"|")
+
+    def key(self, func, signature, args, kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        h = hashlib.blake2b(f"{func.__module__}.{func.__qualname__}".encode(), digest_size=20)
+        for name, value in bound.arguments.items():
+            if not name.startswith("_"):
+                h.update(name.encode())
+                self.hash_value(value, h)
+        return h.hexdigest()
+
+    def memoize(self, func=None, resource=False):
+        '''
+        Decorator caching the results of a pure function.
+
+        Parameters
+        ----------
+        resource: bool | keep the returned object itself in this process (like st.cache_resource), for unpicklable or memory-mapped results
+                  that must not be copied. Otherwise results are pickled into the data backend and every call gets its own copy (like st.cache_data)
+        '''
+        if func is None:
+            return functools.partial(self.memoize, resource=resource)
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = self.key(func, signature, args, kwargs)
+            store = self.resources if resource else self.backend
+            cached = store.get(key)
+            if cached is not None:
+                return cached if resource else pickle.loads(cached)
+            result = func(*args, **kwargs)
+            store.set(key, result if resource else pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+            return result
+        return wrapper
+
+memo = Memo()
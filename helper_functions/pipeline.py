@@ -0,0 +1,313 @@
+import json
+import logging
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import pandas as pd
+import pytz
+
+import matplotlib
+matplotlib.use("Agg") # no display on servers
+
+from helper_functions.preprocessing import tested, counts_pp
+from helper_functions.degs import preDE, DE
+from helper_functions.corr_matrix import cmatrix
+from helper_functions.clustergram import genePP, clustergram
+from helper_functions.gseapy_functions_stages import enr, prnk
+from helper_functions.report import stages_report
+from helper_functions.gene_symbols import symbol_qc
+from helper_functions.table_io import table_io
+from helper_functions.counts_ingest import counts_ingest
+from helper_functions.accessory import accessory_file, bundled_path
+
+logger = logging.getLogger("stages")
+
+class StagesPipeline():
+    '''
+    Headless STAGES workflow: the same helpers as the Streamlit pages, driven by a config instead of session state.
+
+    A study is either {"name", "ratios"} for ratios and p-values, or {"name", "counts", "metadata", "comp_var", "baseline", "against_baseline"}
+    for RNAseq counts ("data_type": "counts") or log2-normalised data ("data_type": "log2"). Any key of the config can be overridden per study.
+    '''
+    stage_order = ['preprocess', 'correlation', 'degs', 'clustergram', 'enrichr', 'prerank', 'report']
+    defaults = {'stages': stage_order,
+                'output_dir': "stages_output",
+                'multiple_test_correction': None,
+                'use_corrected_pval': False,
+                'data_type': "counts",
+                'threshold': 0,
+                'equalvar': True,
+                'correlation': {'method': "pearson"},
+                'degs': {'pval': 0.05, 'fc': 1.3, 'volcano_density': False},
+                'clustergram': {'vminmax': [-2.0, 2.0], 'width': 10, 'height': 10},
+                'enrichr': {'library': accessory_file("BTM.gmt"), 'showX': 10},
+                'prerank': {'library': accessory_file("BTM.gmt"), 'permutations': 1000, 'showX': 10},
+                'gene_qc': {'mar01_fx': None, 'mar02_fx': None, 'date_fmt': "yyyy-dd-mm", 'info_stored': "month-day", 'aliases': True},
+                'report': {'pdf': False}}
+
+    def study_config(self, config, study):
+        '''
+        Returns the settings of one study: defaults, overridden by the config, overridden by the study entry
+        '''
+        merged = {}
+        for layer in [self.defaults, {k:v for k,v in config.items() if k != 'studies'}, study]:
+            for k,v in layer.items():
+                merged[k] = {**merged[k], **v} if isinstance(v, dict) and isinstance(merged.get(k), dict) else v
+        merged.setdefault('name', os.path.basename(str(study.get('ratios', study.get('counts', "study")))).partition(".")[0])
+        for stage in ['enrichr', 'prerank']: # shipped libraries are found from any working directory
+            merged[stage] = {**merged[stage], 'library': bundled_path(merged[stage]['library'])}
+        return merged
+
+    def check_studies(self, config):
+        '''
+        Raises ValueError if two studies of the config have the same name, as they would write into the same output folder
+        '''
+        names = pd.Series([self.study_config(config, study)['name'] for study in config.get('studies', [])], dtype=object)
+        duplicated = names[names.duplicated()].unique()
+        if len(duplicated) != 0:
+            raise ValueError(f"Studies must have different names, set 'name' for the studies named {', '.join(duplicated)}")
+
+    def read_table(self, path, columns=None, stream=False):
+        '''
+        Returns {name: dataframe} from a csv, tab-separated txt/tsv, xlsx, Parquet, Feather or Arrow IPC file with genes or samples in the first column,
+        one entry per excel sheet. Arrow-based files are memory-mapped and only the given columns are read from them.
+        Text files of expression matrices (stream) are read in chunks by CountsIngest.
+        '''
+        head, sep, tail = os.path.basename(path).partition(".")
+        if stream and tail in ['csv', 'txt', 'tsv']:
+            return {head: counts_ingest.read(path, sep="," if tail == 'csv' else '\t')}
+        elif tail in table_io.formats:
+            return {head: table_io.read(path, tail, columns=columns)}
+        elif tail == 'xlsx':
+            return {f"{head}_{k}":table_io.read_excel_sheet(path, k) for k in table_io.excel_sheets(path)}
+        elif tail in ['txt', 'tsv']:
+            return {head: pd.read_csv(path, sep='\t', index_col=0)}
+        return {head: pd.read_csv(path, index_col=0)}
+
+    def clean_genes(self, df_dict, gene_qc):
+        '''
+        Upper-cases gene symbols and fixes date-converted and previous symbols as the file uploader does, with the choices of gene_qc
+        '''
+        for k, df in df_dict.items():
+            df.index = df.index.astype(str, copy=False).str.upper()
+            df_dict[k] = symbol_qc.clean(df, **gene_qc)
+        return df_dict
+
+    def preprocess(self, cfg):
+        '''
+        Returns the ratios/p-values of each dataset and their comparisons, as saved to 'ready' and 'comparisons' by the pre-processing page
+        '''
+        method = cfg['multiple_test_correction']
+        method = tested.padj_mtds.get(method, method) # accept either the page's label or the statsmodels name
+        if 'ratios' in cfg:
+            anovadict = self.clean_genes(self.read_table(cfg['ratios']), cfg['gene_qc'])
+            comps = tested.comparison_finder(anovadict)
+            ready = tested.adjust_pvals(anovadict, comps, method=method) if method is not None else anovadict
+            return ready, comps
+
+        exprdict = self.clean_genes(self.read_table(cfg['counts'], stream=True), cfg['gene_qc'])
+        expr_key = list(exprdict.keys())[0]
+        expr = exprdict[expr_key]
+        expr = expr if expr.index.is_unique and expr.index.is_monotonic_increasing else expr.groupby(expr.index).mean()
+        expr_obj = expr.T if expr.columns.is_monotonic_increasing else expr.T.sort_index(axis=0, ascending=True)
+        meta_obj = list(self.read_table(cfg['metadata'], columns=[cfg['comp_var']]).values())[0].sort_index(axis=0, ascending=True)
+        adata = counts_pp.build_adata(expr_obj, meta_obj, storage=cfg.get('storage', "dense"))
+        is_log = cfg['data_type'] == "log2"
+        if not is_log:
+            adata = counts_pp.filter_counts(adata, thr=cfg['threshold'])
+        return counts_pp.compare_groups(adata, comp_var=cfg['comp_var'],
+                                        baseline=list(cfg['baseline']),
+                                        against_baseline=list(cfg['against_baseline']),
+                                        equalvar=cfg['equalvar'],
+                                        is_log=is_log,
+                                        method=method,
+                                        expr_key=expr_key)
+
+    def save_plotly(self, fig, outdir, name):
+        path = os.path.join(outdir, f"{name}.html")
+        fig.write_html(path)
+        return path
+
+    def save_pyplot(self, fig, outdir, name):
+        path = os.path.join(outdir, f"{name}.png")
+        fig.savefig(path, bbox_inches="tight", dpi=300)
+        return path
+
+    def run_study(self, config, study):
+        '''
+        Runs the configured stages of one study and writes tables and figures to {output_dir}/{name}
+
+        Returns
+        -------
+        dict | study name, output folder, stages that ran, stages that failed with their error, and written files
+        '''
+        cfg = self.study_config(config, study)
+        outdir = os.path.join(cfg['output_dir'], cfg['name'])
+        os.makedirs(outdir, exist_ok=True)
+        stages = [s for s in self.stage_order if s in cfg['stages']]
+        summary = {'name': cfg['name'], 'output_dir': outdir, 'completed': [], 'failed': {}, 'files': []}
+        state = {'use_corrected_pval': cfg['use_corrected_pval']}
+
+        for stage in stages:
+            if stage != 'preprocess' and 'comparison_store' not in state:
+                summary['failed'][stage] = "skipped, pre-processing did not run"
+                continue
+            try:
+                summary['files'] += getattr(self, f"stage_{stage}")(cfg, state, outdir)
+                summary['completed'].append(stage)
+            except Exception as e:
+                logger.error("%s: %s stage failed\n%s", cfg['name'], stage, traceback.format_exc())
+                summary['failed'][stage] = repr(e)
+        return summary
+
+    def stage_preprocess(self, cfg, state, outdir):
+        ready, comps = self.preprocess(cfg)
+        state['ready'], state['comparisons'] = ready, comps
+        state['comparison_store'] = tested.comparison_store(ready, comparison_dict=comps, use_corrected_pval=cfg['use_corrected_pval'])
+        files = []
+        for k,v in ready.items():
+            files.append(os.path.join(outdir, f"processed_{k}.csv"))
+            v.to_csv(files[-1])
+        return files
+
+    def stage_correlation(self, cfg, state, outdir):
+        state['corr_matrix_plot'] = cmatrix.corr_matrix(state['comparison_store'], method=cfg['correlation']['method'])
+        return [self.save_plotly(state['corr_matrix_plot'], outdir, "correlation_matrix")]
+
+    def stage_degs(self, cfg, state, outdir):
+        pval, fc = cfg['degs']['pval'], cfg['degs']['fc']
+        stacked, proportions = DE.degs(state['comparison_store'], state['comparisons'], pval_cutoff=pval, fc_cutoff=fc,
+                                       use_corrected_pval=cfg['use_corrected_pval'])
+        cdf = preDE.deg_cdf(state['ready'], state['comparisons'], pval=pval, use_corrected_pval=cfg['use_corrected_pval'])
+        vol_plot, _ = preDE.volcano(state['comparison_store'], state['comparisons'], use_corrected_pval=cfg['use_corrected_pval'],
+                                    density=cfg['degs']['volcano_density'], pval_cutoff=cfg['degs']['pval'], fc_cutoff=cfg['degs']['fc'])
+        threshold_map = preDE.deg_threshold_map(state['comparison_store'], state['comparisons'], pval_cutoff=pval, fc_cutoff=fc,
+                                                use_corrected_pval=cfg['use_corrected_pval'])
+        state.update({'degs': proportions, 'barplot': stacked, 'cdf_plot': cdf, 'threshold_map': threshold_map, 'volcano_plots_static': vol_plot})
+
+        files = [self.save_plotly(stacked, outdir, "DEG_barplot"), self.save_plotly(cdf, outdir, "DEG_cdf"),
+                 self.save_plotly(threshold_map, outdir, "DEG_threshold_map"), self.save_pyplot(vol_plot, outdir, "volcano")]
+        deg_dir = os.path.join(outdir, "DEGs")
+        os.makedirs(deg_dir, exist_ok=True)
+        for k,v in proportions.items():
+            files.append(os.path.join(deg_dir, f"{k}.csv"))
+            v.to_csv(files[-1])
+        return files
+
+    def deg_genes(self, state):
+        if 'degs' not in state:
+            raise ValueError("the degs stage is required to select genes")
+        use_deg = [k for k in state['degs'] if state['degs'].count(k) != 0]
+        return genePP.genes_used(degs=state['degs'], useDEG=use_deg)
+
+    def stage_clustergram(self, cfg, state, outdir):
+        genes, gene_dict = self.deg_genes(state)
+        gene_vals = genePP.get_gene_vals(state['comparison_store'], genes)
+        opts = cfg['clustergram']
+        plot_args = dict(gene_dict=gene_dict, vminmax=tuple(opts['vminmax']), width=opts['width'], height=opts['height'])
+        files = []
+        if len(gene_vals) > clustergram.large_rows:
+            g, missing, ordered = clustergram.large_cluster_plot(gene_vals, **plot_args)
+            if g is not None:
+                files.append(self.save_plotly(clustergram.plotly_clustergram(ordered, vminmax=plot_args['vminmax']), outdir, "clustergram_interactive"))
+        else:
+            g, missing = clustergram.cluster_plot(gene_vals, **plot_args)
+        if g is None:
+            raise ValueError("at least 4 genes without missing values are needed for a clustergram")
+        state['clustergram_plot'] = g.figure
+        return [self.save_pyplot(g.figure, outdir, "clustergram")] + files
+
+    def stage_enrichr(self, cfg, state, outdir):
+        _, gene_dict = self.deg_genes(state)
+        opts = cfg['enrichr']
+        res_all, res_sig = enr.execute_enrichr(gene_dict=gene_dict, select_dataset=opts['library'], enr_showall=False, enr_showX=opts['showX'])
+        fig = enr.enr_barplot(res_sig, enr_useDEG=list(gene_dict.keys()), deg_fc=cfg['degs']['fc'], deg_pval=cfg['degs']['pval'],
+                              use_corrected_pval=cfg['use_corrected_pval'], select_dataset=os.path.basename(opts['library']),
+                              enr_showall=False, enr_showX=opts['showX'])
+        state.update({'enrichr_plots': fig, 'geneset_enr': opts['library'], 'enr_genedict': gene_dict})
+
+        files = [self.save_plotly(fig, outdir, "enrichr_barplot")]
+        enr_dir = os.path.join(outdir, "enrichr")
+        os.makedirs(enr_dir, exist_ok=True)
+        for k,v in res_all.items():
+            files.append(os.path.join(enr_dir, f"{k}.csv"))
+            v.to_csv(files[-1])
+        return files
+
+    def stage_prerank(self, cfg, state, outdir):
+        opts = cfg['prerank']
+        pre_dir = os.path.join(outdir, "prerank")
+        os.makedirs(pre_dir, exist_ok=True)
+        files = []
+        for k in state['comparison_store'].keys():
+            col_dict = prnk.format_cols(state['comparison_store'], state['comparisons'], selected_df=k)
+            for key, data in col_dict.items():
+                _, _, results = prnk.prerank_job(key, None, data, opts['library'], permutation_num=opts['permutations'])
+                files.append(os.path.join(pre_dir, f"{key}.csv"))
+                results.to_csv(files[-1], index=False)
+                pos_nes, neg_nes = prnk.summarise_prerank(results, prerank_showX=opts['showX'])
+                sig = {f'Positive_enrichment_{key}':pos_nes, f'Negative_enrichment_{key}':neg_nes}
+                fig = prnk.prerank_barplot(sig, selected_col=key, select_dataset=os.path.basename(opts['library']), prerank_showX=opts['showX'])
+                files.append(self.save_plotly(fig, pre_dir, f"{key}_barplot"))
+                state.setdefault('prerank_plots', fig) # the report shows the first comparison, as the page shows the selected one
+                state.setdefault('prerank_choose_col', key)
+        state['geneset_prerank'] = opts['library']
+        return files
+
+    def stage_report(self, cfg, state, outdir):
+        today = datetime.now(tz=pytz.timezone("Asia/Singapore"))
+        plots = {}
+        for key in ['corr_matrix_plot', 'cdf_plot', 'barplot', 'enrichr_plots', 'prerank_plots']:
+            plots[key] = stages_report.plot_to_bytes(state[key], graph_module='plotly', format='png') if key in state else None
+        for key in ['volcano_plots_static', 'clustergram_plot']:
+            plots[key] = stages_report.plot_to_bytes(state[key], graph_module='pyplot', format='png') if key in state else None
+
+        output_text = stages_report.render_report(date=today.strftime("%d %B %Y %I:%M:%S %p (GMT%Z)"),
+                                                   cmatrix=plots['corr_matrix_plot'],
+                                                   volplot=plots['volcano_plots_static'],
+                                                   cdf=plots['cdf_plot'],
+                                                   barplot=plots['barplot'],
+                                                   pval_fmt="adjusted p-value" if cfg['use_corrected_pval'] else "p-value",
+                                                   bar_pval=cfg['degs']['pval'],
+                                                   bar_fc=cfg['degs']['fc'],
+                                                   clustergram=plots['clustergram_plot'],
+                                                   geneset_enr=state.get('geneset_enr'),
+                                                   enr_genedict=state.get('enr_genedict', {}),
+                                                   enr_showX=f"Top {cfg['enrichr']['showX']}" if 'enrichr_plots' in state else "No",
+                                                   enrichr=plots['enrichr_plots'],
+                                                   geneset_prerank=state.get('geneset_prerank'),
+                                                   prerank_choose_col=state.get('prerank_choose_col'),
+                                                   prerank_showX=cfg['prerank']['showX'],
+                                                   prerank=plots['prerank_plots'],
+                                                   string_dict={"None":None})
+        files = [os.path.join(outdir, "STAGES_report.html")]
+        with open(files[0], 'w', encoding='utf-8') as html_file:
+            html_file.write(output_text)
+        if cfg['report']['pdf']:
+            import pdfkit
+            files.append(os.path.join(outdir, "STAGES_report.pdf"))
+            pdfkit.from_string(output_text, files[-1])
+        return files
+
+    def run(self, config, workers=1):
+        '''
+        Runs every study of the config, in parallel over worker processes if workers > 1, and yields each study's summary as it finishes
+        '''
+        self.check_studies(config)
+        studies = config.get('studies', [])
+        if workers <= 1 or len(studies) <= 1:
+            for study in studies:
+                yield self.run_study(config, study)
+            return
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(self.run_study, config, study) for study in studies]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def load_config(self, path):
+        with open(path) as f:
+            return json.load(f)
+
+pipeline = StagesPipeline()
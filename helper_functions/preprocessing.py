@@ -4,18 +4,23 @@ import time
 import math
 import regex as re
 
-import streamlit as st
-from streamlit_tags import st_tags, st_tags_sidebar
-
 import plotly.colors as pc
-import matplotlib.pyplot as plt
-import matplotlib
 
-import decoupler as dc
 # import pingouin as pg
-from scipy import stats
+import tempfile
+import os
+import hashlib
+import shutil
+import weakref
+
+from helper_functions.comparison_store import ComparisonStore
+from helper_functions.memo import LRUBackend
 
 class FC_class():
+    padj_mtds = {"None":None, "Bonferroni":"bonferroni", "Sidak":'sidak', 'Holm-Sidak':'holm-sidak', 'Holm':'holm', 'Simes-Hochberg':'simes-hochberg', 'Hommel':'hommel',
+                 'Benjamini-Hochberg FDR':'fdr_bh', 'Benjamini-Yekutieli FDR':'fdr_by',
+                 'Two-stage Benjamini-Hochberg FDR':'fdr_tsbh', 'Two-stage Benjamini-Yekutieli FDR':'fdr_tsbky'}
+
     def comparison_finder(self, cleandict):
         comparison_regex = r"(ratio|p[\.\-value]*)[_\-\s\.](.*[_\-\s\.]vs[_\-\s\.].*)"
         comparison_dict = {}
@@ -24,39 +29,255 @@ class FC_class():
             comparison_dict[k] = comparison
         return comparison_dict
 
-    def log_transform(self, cleandict, comparison_dict, use_corrected_pval=False):
-        p_regex = "^(adj_pval)[_\-\s\.]" if use_corrected_pval else "^(p[\.\-value]*)[_\-\s\.]"
-        neg_log_pval = "neg_log_adj_pval" if use_corrected_pval else "neg_log_pval"
-        log_dict = {}
-        for k,v in cleandict.items():
-            new_combined = pd.DataFrame()
-            comps_per_df = comparison_dict[k] # list of comparisons
-            for comp in comps_per_df:
-                ratio_pattern = f"ratio[_\-\s\.]{comp}"
-                ratio_cols = [col for col in v.columns if re.match(ratio_pattern, col, flags=re.I)]
-                ratio = v.loc[:,ratio_cols]
-
-                pval_pattern = f"{p_regex}{comp}"
-                pval_cols = [col for col in v.columns if re.match(pval_pattern, col, flags=re.I)]
-                pval = v.loc[:,pval_cols]
-                comp_df = pd.concat([np.log2(ratio), np.log10(pval)*(-1), pval], axis=1)
-                comp_df.columns = [f"log2FC_{comp}", f"{neg_log_pval}_{comp}", pval.columns[0]]
-                new_combined = pd.concat([new_combined, comp_df], axis=1)
-            log_dict[k] = new_combined
-        return log_dict
+    def correct_pvals(self, pvals, method):
+        '''
+        Parameters
+        ----------
+        pvals: pd.Series | p-values of one comparison
+        method: str | statsmodels multipletests method, eg. fdr_bh
+
+        Returns
+        -------
+        pd.Series | corrected p-values, ordered by ascending p-value
+        '''
+        pval_col = pvals.sort_values(ascending = True)
+        from statsmodels.stats import multitest
+        rej, corrected, alphacSidak, alphacBonf = multitest.multipletests(pval_col.to_numpy(),
+                                                                        method=method,
+                                                                        is_sorted = True)
+        return pd.Series(corrected, index = pval_col.index)
+
+    def adjust_pvals(self, anovadict, comparison_dict, method):
+        '''
+        Adds adj_pval_{comparison} columns to uploaded ratios and p-values
+
+        Parameters
+        ----------
+        anovadict: dict | keys containing file name, values containing ratios and p-values
+        comparison_dict: dict | keys containing file name, values containing list of comparisons
+        method: str | statsmodels multipletests method, eg. fdr_bh
+
+        Returns
+        -------
+        dict | keys containing file name, values containing ratios, p-values and adjusted p-values grouped by comparison.
+        Raises ValueError if the upload already has adjusted p-value columns.
+        '''
+        adjusted_dfs = {}
+        for k,v in comparison_dict.items():
+            anova_file = anovadict[k]
+            adj_df_per_k = pd.DataFrame()
+            for comp in v:
+                comp_df = anova_file.filter(regex = comp, axis=1)
+                pval_col = comp_df.filter(regex = "^pval", axis=1) # need to accommodate other regexes????
+                corrected = self.correct_pvals(pval_col.iloc[:,0], method)
+                corrected_vals = pd.DataFrame(data = {f"adj_pval_{comp}":corrected}, index = corrected.index)
+                adj_df_per_k = pd.concat([adj_df_per_k, comp_df, corrected_vals], axis=1, verify_integrity=True)
+            adjusted_dfs[k] = adj_df_per_k
+        return adjusted_dfs
+
+    def match_col(self, df, pattern):
+        cols = [col for col in df.columns if re.match(pattern, col, flags=re.I)]
+        return df.loc[:, cols[0]].to_numpy(dtype=np.float64) if len(cols) != 0 else np.full(len(df), np.nan)
+
+    def comparison_store(self, cleandict, comparison_dict, use_corrected_pval=False):
+        '''
+        Parameters
+        ----------
+        cleandict: dict | keys containing file name, values containing ratios, p-values and (optionally) adjusted p-values
+        comparison_dict: dict | keys containing file name, values containing list of comparisons
+        use_corrected_pval: bool | derive -log10 p-values from the adjusted p-values
+
+        Returns
+        -------
+        ComparisonStore | log2FC, p-value, adjusted p-value and -log10 p-value of every comparison over the union of genes
+        '''
+        uploads = {k:v.loc[~v.index.duplicated(keep='first')] for k,v in cleandict.items()}
+        genes = pd.Index([], dtype=object)
+        for v in uploads.values():
+            genes = genes.append(v.index[~v.index.isin(genes)])
+        comparisons = pd.MultiIndex.from_tuples([(k, comp) for k in uploads.keys() for comp in comparison_dict[k]])
+
+        values = np.full((len(ComparisonStore.fields), len(comparisons), len(genes)), np.nan, dtype=np.float32)
+        present = {}
+        j = 0
+        for k,v in uploads.items():
+            rows = genes.get_indexer(v.index)
+            present[k] = np.zeros(len(genes), dtype=bool)
+            present[k][rows] = True
+            for comp in comparison_dict[k]:
+                ratio = self.match_col(v, f"ratio[_\-\s\.]{comp}")
+                pval = self.match_col(v, f"^(p[\.\-value]*)[_\-\s\.]{comp}")
+                adj_pval = self.match_col(v, f"^(adj_pval)[_\-\s\.]{comp}")
+                use_p = adj_pval if use_corrected_pval else pval
+                with np.errstate(divide='ignore'):
+                    comp_fields = {'log2FC':np.log2(ratio), 'pval':pval, 'adj_pval':adj_pval, 'neg_log_p':np.log10(use_p)*(-1)}
+                for f, arr in comp_fields.items():
+                    values[ComparisonStore.fields.index(f), j, rows] = arr
+                j += 1
+        return ComparisonStore(genes, comparisons, values, present, use_corrected_pval=use_corrected_pval)
+
+
+class BackedFiles():
+    '''
+    Temporary folder holding the backed .h5ad files of one dataset (as built and after each filter_counts threshold),
+    deleted once no AnnData object reads from it anymore or when released
+    '''
+    def __init__(self):
+        self.folder = tempfile.mkdtemp(prefix="stages_")
+        self.readers = 0
+
+    def track(self, adata):
+        '''
+        Counts adata as a reader of the folder until it is garbage collected, and returns it
+        '''
+        self.readers += 1
+        weakref.finalize(adata, self.untrack)
+        return adata
+
+    def untrack(self):
+        self.readers -= 1
+        if self.readers <= 0:
+            self.remove()
+
+    def remove(self):
+        RNAseq.backed_files.pop(self.folder, None)
+        shutil.rmtree(self.folder, ignore_errors=True)
 
 
 class RNAseq():
+    group_stats = LRUBackend(maxsize=4) # (data token, comp_var, labels) -> {group: per-gene statistics} of the last datasets, shared by the sessions of the process
+    backed_files = {} # temporary folder -> BackedFiles of the backed datasets of the process
 
     def chunks(self, list_a, chunk_size):
         return [list_a[i:i + chunk_size] for i in range(0, len(list_a), chunk_size)]
 
+    def build_adata(self, expr_obj, meta_obj, storage="dense", filename=None, token=None):
+        '''
+        Parameters
+        ----------
+        expr_obj: pd.DataFrame | expression data with samples in rows and genes in columns
+        meta_obj: pd.DataFrame | metadata with the same samples in rows
+        storage: str | 'dense' (numpy in memory), 'sparse' (scipy CSR in memory) or 'backed' (CSR written to an .h5ad file and opened read-only)
+        filename: str | path of the .h5ad file for backed storage. If None, the file is written to a temporary folder that is deleted
+            with the last AnnData object reading from it (see BackedFiles) or by release
+        token: str | frame_token of expr_obj and meta_obj if already computed, kept as the data token of the AnnData object
+        '''
+        from anndata import AnnData, read_h5ad
+
+        X = expr_obj.to_numpy(dtype=np.float32) if storage == "dense" else self.to_csr(expr_obj)
+        adata = AnnData(X, obs=meta_obj, var=pd.DataFrame(index=expr_obj.columns)) # expr data should be genes in cols, subjects in rows, obs should be the same
+        if storage == "backed":
+            if filename is None:
+                files = BackedFiles()
+                self.backed_files[files.folder] = files
+                filename = os.path.join(files.folder, "counts.h5ad")
+            adata.write_h5ad(filename)
+            adata = self.track_backed(read_h5ad(filename, backed="r"))
+        adata.stages_token = token if token is not None else self.frame_token(expr_obj, meta_obj)
+        return adata
+
+    def frame_token(self, expr_obj, meta_obj, chunk_size=256):
+        '''
+        Content token of the expression and metadata frames that build_adata is given, hashed chunk_size samples at a time
+        '''
+        token = hashlib.blake2b(digest_size=16)
+        for labels in [expr_obj.index, expr_obj.columns]:
+            token.update(pd.util.hash_pandas_object(labels, index=False).to_numpy().tobytes())
+        token.update(pd.util.hash_pandas_object(meta_obj.astype(str), index=True).to_numpy().tobytes())
+        for i in range(0, len(expr_obj), chunk_size):
+            token.update(np.ascontiguousarray(expr_obj.iloc[i:i + chunk_size].to_numpy(dtype=np.float32)).tobytes())
+        return token.hexdigest()
+
+    def to_csr(self, expr_obj, block_cells=2**20):
+        '''
+        Float32 CSR matrix of a samples x genes DataFrame, filled a block of about block_cells values at a time so that no dense copy
+        of the whole matrix is made
+        '''
+        from scipy import sparse
+
+        n_obs, n_vars = expr_obj.shape
+        starts = range(0, n_obs, max(1, block_cells // max(n_vars, 1)))
+        step = starts.step
+        counts = np.zeros(n_obs + 1, dtype=np.int64)
+        for i in starts: # first pass: stored values per sample
+            counts[i + 1:i + 1 + step] = np.count_nonzero(expr_obj.iloc[i:i + step].to_numpy(dtype=np.float32), axis=1)
+        indptr = np.cumsum(counts)
+        index_dtype = np.int32 if max(indptr[-1], n_vars) < np.iinfo(np.int32).max else np.int64
+        indptr = indptr.astype(index_dtype)
+        data, indices = np.empty(indptr[-1], dtype=np.float32), np.empty(indptr[-1], dtype=index_dtype)
+        for i in starts:
+            block = expr_obj.iloc[i:i + step].to_numpy(dtype=np.float32)
+            rows, cols = np.nonzero(block) # row-major, so the column indices of every sample come out sorted
+            span = slice(indptr[i], indptr[i + len(block)])
+            data[span], indices[span] = block[rows, cols], cols
+        return sparse.csr_matrix((data, indices, indptr), shape=expr_obj.shape, copy=False)
+
+    def track_backed(self, adata):
+        '''
+        Registers a backed AnnData object opened from a BackedFiles folder as one of its readers
+        '''
+        files = self.backed_files.get(os.path.dirname(str(adata.filename)))
+        return files.track(adata) if files is not None else adata
+
+    def release(self, adata):
+        '''
+        Closes a backed AnnData object and deletes the temporary folder of its dataset, eg. when the dataset is replaced
+        '''
+        if adata is None or not adata.isbacked:
+            return
+        files = self.backed_files.get(os.path.dirname(str(adata.filename)))
+        adata.file.close()
+        if files is not None:
+            files.remove()
+
+    def row_blocks(self, adata, rows=None, chunk_size=256):
+        '''
+        Yields dense float64 blocks of up to chunk_size samples from dense, sparse or backed AnnData objects (and their views),
+        so that the full matrix is never densified at once
+        '''
+        from scipy import sparse
+
+        rows = np.arange(adata.n_obs) if rows is None else rows
+        for i in range(0, len(rows), chunk_size):
+            block = adata[rows[i:i + chunk_size]].X
+            block = block.toarray() if sparse.issparse(block) else np.asarray(block)
+            yield block.astype(np.float64, copy=False)
+
     def violin_maxy(self, adata):
-        log10adata = np.log1p(adata.to_df())
-        maxy = math.ceil(max(log10adata.max(axis=0)))
+        maxy = max(np.nanmax(block) for block in self.row_blocks(adata))
+        maxy = math.ceil(np.log1p(maxy))
         return maxy
-    
 
+    def threshold_genes(self, adata, thr):
+        '''
+        Boolean mask of genes whose log1p counts are at or above thr in every sample.
+        Same genes as dc.mask_features(log=True, thr=thr) followed by sc.pp.filter_genes(min_cells=n_obs), but adata is neither modified nor densified
+        '''
+        count_thr = np.exp(thr) - 1
+        keep = np.ones(adata.n_vars, dtype=bool)
+        for block in self.row_blocks(adata):
+            keep &= np.all((block >= count_thr) & (block > 0), axis=0)
+        return keep
+
+    def filter_counts(self, adata, thr):
+        '''
+        Keeps the genes that pass threshold_genes. Backed data is written to a sibling .h5ad file that is reused for the same threshold,
+        as backed AnnData views cannot be sliced again by sample. Siblings in a temporary folder are deleted with the folder
+        '''
+        keep = self.threshold_genes(adata, thr)
+        token = hashlib.blake2b(f"{self.data_token(adata)}|{np.packbits(keep).tobytes().hex()}".encode(), digest_size=16).hexdigest()
+        if not adata.isbacked:
+            filtered = adata[:, keep].copy()
+        else:
+            filename = f"{str(adata.filename).rsplit('.h5ad', 1)[0]}_thr{thr}.h5ad"
+            if os.path.exists(filename):
+                from anndata import read_h5ad
+                filtered = self.track_backed(read_h5ad(filename, backed="r"))
+            else:
+                filtered = self.track_backed(adata[:, keep].copy(filename=filename))
+        filtered.stages_token = token # the filtered data is fixed by its parent and the kept genes
+        return filtered
+    
     def multiviolin(self, _adata, split_long_violins):
         '''
         Parameters
@@ -65,6 +286,9 @@ class RNAseq():
         split_long_violins: list | chunked list
         vthresh: int | threshold to draw the line and filter genes that are above this value
         '''
+        import decoupler as dc
+        import matplotlib.pyplot as plt
+
         unit_height = 3
         violin1, axes = plt.subplots(figsize = (10, len(split_long_violins) * unit_height), nrows=len(split_long_violins), ncols=1, sharey = True, constrained_layout=True)
         if len(split_long_violins) == 1:
@@ -81,41 +305,181 @@ class RNAseq():
         violin1.suptitle("Log1p counts per sample")
         return violin1, axes
 
+    def data_token(self, adata):
+        '''
+        Content token of the samples, genes and expression matrix of adata. Set once by build_adata and filter_counts and kept on
+        the object (stages_token), otherwise read block by block and kept on the object the first time it is needed
+        '''
+        token = getattr(adata, "stages_token", None)
+        if token is None:
+            digest = hashlib.blake2b(digest_size=16)
+            for labels in [adata.obs_names, adata.var_names]:
+                digest.update(pd.util.hash_pandas_object(labels, index=False).to_numpy().tobytes())
+            for block in self.row_blocks(adata):
+                digest.update(np.ascontiguousarray(block).tobytes())
+            token = digest.hexdigest()
+            adata.stages_token = token
+        return token
+
+    def group_summary(self, adata, comp_var, groups, is_log=False) -> dict:
+        '''
+        Per-group count, mean, unlogged mean and variance of every gene. Each group's statistics are computed once per dataset
+        (see data_token) and grouping of its samples, and kept in group_stats for the last few datasets
+
+        Parameters
+        ----------
+        adata: AnnData object containing counts and metadata
+        comp_var: str | column of adata.obs used to group the samples
+        groups: list | groups within comp_var to summarise
+        is_log: bool | also summarise the unlogged (2**x) means of log2-transformed data
+
+        Returns
+        -------
+        dict | keys 'n', 'mean', 'var' and 'unlog_mean', values are genes x groups DataFrames
+        '''
+        labels = adata.obs[comp_var].astype(str)
+        key = (self.data_token(adata), comp_var, pd.util.hash_pandas_object(labels, index=False).to_numpy().tobytes()) # relabelled samples are new groups
+        dataset_stats = self.group_stats.get(key)
+        if dataset_stats is None:
+            dataset_stats = {}
+            self.group_stats.set(key, dataset_stats)
+        summary = {s: pd.DataFrame(index=adata.var_names) for s in ['n', 'mean', 'var', 'unlog_mean']}
+        for g in groups:
+            stats = dataset_stats.get(g)
+            if stats is None or (is_log and 'unlog_mean' not in stats):
+                rows = np.flatnonzero(adata.obs[comp_var] == g)
+                n, mean, var, unlog_mean = self.ttest_stats(self.row_blocks(adata, rows), is_log=is_log)
+                stats = {'n': n, 'mean': mean, 'var': var}
+                if is_log:
+                    stats['unlog_mean'] = unlog_mean
+                dataset_stats[g] = stats
+            for s, values in stats.items():
+                summary[s][g] = values
+        return summary
+
     def ratio(self, adata, comp_var, baseline, against_baseline, is_log=False) -> pd.DataFrame:
-        ratio_df = pd.DataFrame()
-        if not is_log:
-            for base in baseline:
-                avg_base = adata[adata.obs[comp_var] == base].to_df().mean(axis=0) # Filter with obs first, then to_df() because otherwise it's just an array without index/columns, lastly mean
-                for comp in against_baseline:
-                    avg_comp = adata[adata.obs[comp_var] == comp].to_df().mean(axis=0)
-                    ratio = pd.DataFrame(avg_comp / avg_base, columns = [f'ratio_{comp}_vs_{base}'])
-                    ratio_df = pd.concat([ratio_df, ratio], axis=1)
-        else:
-            for base in baseline:
-                basedf = adata[adata.obs[comp_var] == base].to_df()
-                unlogbase = 2**basedf
-                avg_base = unlogbase.mean(axis=0)
-                for comp in against_baseline:
-                    compdf = adata[adata.obs[comp_var] == comp].to_df()
-                    unlogcomp = 2**compdf
-                    avg_comp = unlogcomp.mean(axis=0)
-                    ratio = pd.DataFrame(avg_comp / avg_base, columns = [f'ratio_{comp}_vs_{base}'])
-                    ratio_df = pd.concat([ratio_df, ratio], axis=1)
+        summary = self.group_summary(adata, comp_var, list(baseline) + list(against_baseline), is_log=is_log)
+        avg = summary['unlog_mean'] if is_log else summary['mean']
+        ratio_cols = {f'ratio_{comp}_vs_{base}': avg[comp] / avg[base] for base in baseline for comp in against_baseline}
+        ratio_df = pd.DataFrame(ratio_cols, index=adata.var_names)
         return ratio_df
 
+    def ttest_stats(self, blocks, is_log=False):
+        '''
+        Per-gene sample size, mean and unbiased variance over blocks of a samples x genes matrix, omitting NaNs (same as nan_policy='omit').
+        Blocks are merged with Chan's parallel update, so the variance matches a two-pass computation over the whole group.
+
+        Returns
+        -------
+        n, mean, var, unlog_mean: arrays with one value per gene, unlog_mean is the mean of 2**x and None if not is_log
+        '''
+        n, mean, m2, unlog_sum = 0, 0.0, 0.0, 0.0
+        for block in blocks:
+            n_b = np.sum(~np.isnan(block), axis=0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean_b = np.where(n_b > 0, np.nansum(block, axis=0) / n_b, 0.0)
+                m2_b = np.nansum((block - mean_b)**2, axis=0)
+                total = n + n_b
+                frac = np.where(total > 0, n_b / total, 0.0)
+            delta = mean_b - mean
+            mean = mean + delta * frac
+            m2 = m2 + m2_b + delta**2 * n * frac
+            n = total
+            if is_log:
+                unlog_sum = unlog_sum + np.nansum(2**block, axis=0)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(n > 0, mean, np.nan)
+            var = m2 / (n - 1)
+            unlog_mean = unlog_sum / n if is_log else None
+        return n, mean, var, unlog_mean
+
+    def ttest_ind_matrix(self, base_stats, comp_stats, equalvar=False):
+        '''
+        Vectorised stats.ttest_ind(base, comp) from the (n, mean, var) of each group
+
+        Parameters
+        ----------
+        base_stats: tuple | (n, mean, var) arrays for the baseline groups, broadcastable against comp_stats
+        comp_stats: tuple | (n, mean, var) arrays for the groups compared against baseline
+        equalvar: bool | True for Student's t-test, False for Welch's t-test
+
+        Returns
+        -------
+        t, p: arrays of t statistics and two-sided p-values
+        '''
+        from scipy import stats
+
+        n1, m1, v1 = base_stats
+        n2, m2, v2 = comp_stats
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if equalvar:
+                df = n1 + n2 - 2.0
+                # a group of one value adds nothing to the pooled sum of squares (its undefined variance has weight n - 1 = 0), as in scipy
+                svar = ((n1 - 1) * np.where(n1 == 1, 0, v1) + (n2 - 1) * np.where(n2 == 1, 0, v2)) / df
+                denom = np.sqrt(svar * (1.0 / n1 + 1.0 / n2))
+            else:
+                vn1, vn2 = v1 / n1, v2 / n2
+                df = (vn1 + vn2)**2 / (vn1**2 / (n1 - 1) + vn2**2 / (n2 - 1))
+                df = np.where(np.isnan(df), 1, df) # scipy falls back to df = 1 when both variances are 0
+                denom = np.sqrt(vn1 + vn2)
+            t = (m1 - m2) / denom
+            p = 2 * stats.t.sf(np.abs(t), df)
+        # scipy returns NaN when either group has fewer than 2 non-NaN values (Welch's),
+        # or when a group is empty or the pooled variance has no degrees of freedom (Student's)
+        too_small = ((n1 < 1) | (n2 < 1) | (n1 + n2 < 3)) if equalvar else ((n1 < 2) | (n2 < 2))
+        t, p = np.where(too_small, np.nan, t), np.where(too_small, np.nan, p)
+        return t, p
+
     def pval_scipy(self, adata, comp_var, baseline, against_baseline, equalvar=False) -> pd.DataFrame:
-        pval_df = pd.DataFrame()
-        for base in baseline:
-            base_ct = adata[adata.obs[comp_var] == base].to_df() # Filter with obs first, then to_df() because otherwise it's just an array without index/columns
-            for comp in against_baseline:
-                comp_ct = adata[adata.obs[comp_var] == comp].to_df()
-                genes_pval = pd.DataFrame()
-                for i in base_ct.columns:
-                    T, p = stats.ttest_ind(base_ct.loc[:,i], comp_ct.loc[:,i], equal_var=equalvar, nan_policy='omit')
-                    genes_pval = pd.concat([genes_pval, pd.DataFrame(data={f'pval_{comp}_vs_{base}':p}, index=[i])], axis=0)
-                pval_df = pd.concat([pval_df, genes_pval], axis=1)
+        summary = self.group_summary(adata, comp_var, list(baseline) + list(against_baseline))
+        group_stats = {g: tuple(summary[s][g].to_numpy() for s in ['n', 'mean', 'var']) for g in summary['mean'].columns}
+
+        # Stack into (baseline, 1, genes) and (1, comparison, genes) so every pair is tested in one broadcast
+        base_stats = [np.stack([group_stats[b][i] for b in baseline])[:, None, :] for i in range(3)]
+        comp_stats = [np.stack([group_stats[c][i] for c in against_baseline])[None, :, :] for i in range(3)]
+        _, p = self.ttest_ind_matrix(base_stats, comp_stats, equalvar=equalvar)
+
+        pval_cols = {f'pval_{comp}_vs_{base}': p[b, c] for b, base in enumerate(baseline) for c, comp in enumerate(against_baseline)}
+        pval_df = pd.DataFrame(pval_cols, index=adata.var_names)
         return pval_df
 
+    def compare_groups(self, adata, comp_var, baseline, against_baseline, equalvar=False, is_log=False, method=None, expr_key="Data"):
+        '''
+        Ratios, t-test p-values and (optionally) corrected p-values of every group in against_baseline vs every group in baseline
+
+        Parameters
+        ----------
+        adata: AnnData | samples x genes expression data with comp_var in obs
+        comp_var: str | obs column containing the groups
+        baseline: list | groups to compare against (A in B vs A)
+        against_baseline: list | groups compared against the baseline (B in B vs A)
+        equalvar: bool | True for Student's t-test, False for Welch's t-test
+        is_log: bool | whether the expression data is log2-transformed
+        method: str | statsmodels multipletests method, None for no correction
+        expr_key: str | name of the dataset
+
+        Returns
+        -------
+        ready: dict | {expr_key: dataframe of ratio, pval and adj_pval columns grouped by comparison}
+        comps: dict | {expr_key: list of comparisons}
+        '''
+        ratios = self.ratio(adata, comp_var = comp_var, baseline= baseline, against_baseline= against_baseline, is_log = is_log)
+        ttest = self.pval_scipy(adata, comp_var = comp_var, baseline= baseline, against_baseline= against_baseline, equalvar= equalvar)
+
+        comps = tested.comparison_finder({expr_key:ttest})
+        if method is not None:
+            corrected_pval_df = pd.DataFrame()
+            for c in ttest.columns:
+                corrected = tested.correct_pvals(ttest.loc[:,c], method)
+                corrected_vals = pd.DataFrame(data = {f"adj_{c}":corrected}, index = corrected.index)
+                corrected_pval_df = pd.concat([corrected_pval_df, corrected_vals], axis=1)
+            adj_df_per_k = pd.concat([ratios, ttest, corrected_pval_df], axis=1)
+        else:
+            adj_df_per_k = pd.concat([ratios, ttest], axis=1)
+
+        sort_by_comparison = pd.concat([adj_df_per_k.filter(regex=comp, axis=1) for comp in comps[expr_key]], axis=1)
+        return {expr_key:sort_by_comparison}, comps
 
 tested = FC_class()
 counts_pp = RNAseq()
\ No newline at end of file
@@ -0,0 +1,185 @@
+import functools
+
+import numpy as np
+import pandas as pd
+
+class PrerankEngine():
+    '''
+    Vectorised GSEA prerank (gene set permutation), following the statistics of gseapy.prerank.
+
+    Enrichment scores only depend on the ranks of the hits and on the sorted |ranking metric|, so
+    - the running sum is only evaluated at the hits of a term instead of along the whole ranked list,
+    - as in gseapy, every permutation shuffles the rank positions of all genes, so each term is scored against its own random
+      gene sets; the shuffles are drawn once per number of ranked genes and reused by every comparison with that many genes,
+      and all permutations of the terms of one size are scored as a single matrix operation.
+    '''
+    columns = ['Name', 'Term', 'ES', 'NES', 'NOM p-val', 'FDR q-val', 'FWER p-val', 'Tag %', 'Gene %', 'Lead_genes']
+
+    @functools.lru_cache(maxsize=2)
+    def rank_permutations(self, n_genes, permutation_num=1000, seed=123):
+        '''
+        Random shuffles of the rank positions, shared by every comparison with n_genes ranked genes
+
+        Returns
+        -------
+        np.ndarray | permutation_num x n_genes array, row j maps each rank position to its position in permutation j
+        '''
+        rng = np.random.default_rng(seed)
+        dtype = np.uint16 if n_genes <= np.iinfo(np.uint16).max else np.int32 # halves the cached shuffles of most rankings
+        return rng.permuted(np.broadcast_to(np.arange(n_genes, dtype=dtype), (permutation_num, n_genes)), axis=1)
+
+    def null_es(self, hits, sizes, perms, metric, n_genes, chunk=2**22):
+        '''
+        Enrichment scores of every term's hits moved to random rank positions by each permutation
+
+        Returns
+        -------
+        np.ndarray | terms x permutations null enrichment scores
+        '''
+        esnull = np.empty((len(sizes), len(perms)))
+        for k in np.unique(sizes):
+            rows = np.flatnonzero(sizes == k)
+            step = max(1, chunk // (k * len(perms)))
+            for start in range(0, len(rows), step):
+                batch = rows[start:start + step]
+                cols = (hits.indptr[batch][:, None] + np.arange(k)).ravel()
+                pos = np.sort(perms[:, hits.indices[cols]].reshape(len(perms), len(batch), k), axis=-1).astype(np.intp)
+                es, _ = self.running_es(pos, metric[pos], n_genes)
+                esnull[batch] = es.T
+        return esnull
+
+    def running_es(self, pos, weights, n_genes):
+        '''
+        Enrichment scores of gene sets given as sorted hit positions, evaluated over the last axis
+
+        Parameters
+        ----------
+        pos: np.ndarray | (..., k) sorted rank positions of the hits
+        weights: np.ndarray | (..., k) |ranking metric| of the hits
+        n_genes: int | number of ranked genes
+
+        Returns
+        -------
+        es: np.ndarray | signed maximum deviation of the running sum
+        peak: np.ndarray | index of the hit at which the running sum peaks (positive es) or the first hit after the trough (negative es)
+        '''
+        k = pos.shape[-1]
+        cumw = np.cumsum(weights, axis=-1)
+        total = cumw[..., -1:]
+        misses = (pos - np.arange(k)) / (n_genes - k)
+        top = cumw / total - misses # running sum just after each hit
+        bottom = (cumw - weights) / total - misses # running sum just before each hit
+        imax, imin = top.argmax(axis=-1), bottom.argmin(axis=-1)
+        vmax = np.take_along_axis(top, imax[..., None], axis=-1)[..., 0]
+        vmin = np.take_along_axis(bottom, imin[..., None], axis=-1)[..., 0]
+        is_pos = np.abs(vmax) > np.abs(vmin)
+        return np.where(is_pos, vmax, vmin), np.where(is_pos, imax, imin)
+
+    def term_hits(self, genes, terms, universe, membership, min_size=15, max_size=500):
+        '''
+        Returns the terms kept after size filtering and a CSR matrix of their hits, with column indices being rank positions
+        '''
+        idx = universe.get_indexer(genes)
+        ranked = np.flatnonzero(idx >= 0)
+        hits = membership[:, idx[ranked]].tocsr() # columns follow the ranking, so sorted indices are sorted rank positions
+        hits.sort_indices()
+        sizes = np.diff(hits.indptr)
+        keep = np.flatnonzero((sizes >= min_size) & (sizes <= max_size) & (sizes < len(genes)))
+        hits = hits[keep]
+        hits.indices = ranked[hits.indices]
+        return terms[keep], hits
+
+    def prerank(self, rnk, terms, universe, membership, permutation_num=1000, min_size=15, max_size=500, weight=1.0, seed=123):
+        '''
+        Parameters
+        ----------
+        rnk: pd.DataFrame | first column containing genes and second column containing the ranking metric (eg. log2FC)
+        terms: np.ndarray | term names of the library
+        universe: pd.Index | genes that the membership columns refer to
+        membership: scipy.sparse.csr_matrix | terms x genes gene set membership
+        permutation_num: int | number of permutations of the rank positions
+        min_size, max_size: int | allowed number of genes of a gene set found in the ranking
+        weight: float | exponent of the ranking metric in the running sum, 1 as in gseapy
+
+        Returns
+        -------
+        pd.DataFrame | res2d-like table with Name, Term, ES, NES, NOM p-val, FDR q-val, FWER p-val, Tag %, Gene %, Lead_genes
+        '''
+        rnk = rnk.iloc[:, :2].dropna()
+        rnk = rnk.drop_duplicates(subset=rnk.columns[0], keep="first")
+        rnk = rnk.sort_values(by=rnk.columns[1], ascending=False, kind="mergesort")
+        genes = pd.Index(rnk.iloc[:, 0].astype(str))
+        metric = np.abs(rnk.iloc[:, 1].to_numpy(dtype=np.float64)) ** weight
+        n_genes = len(genes)
+
+        terms, hits = self.term_hits(genes, terms, universe, membership, min_size=min_size, max_size=max_size)
+        if len(terms) == 0:
+            return pd.DataFrame(columns=self.columns)
+        sizes = np.diff(hits.indptr)
+
+        # Observed scores, one term at a time is cheap as only the hits are visited
+        es = np.empty(len(terms))
+        lead_genes, tag_frac, gene_frac = [], [], []
+        for t in range(len(terms)):
+            pos = hits.indices[hits.indptr[t]:hits.indptr[t + 1]]
+            es[t], peak = self.running_es(pos, metric[pos], n_genes)
+            if es[t] >= 0:
+                lead = pos[:peak + 1]
+                gene_frac.append((pos[peak] + 1) / n_genes)
+            else:
+                lead = pos[peak:][::-1]
+                gene_frac.append((n_genes - pos[peak] + 1) / n_genes)
+            lead_genes.append(";".join(genes[lead]))
+            tag_frac.append(f"{len(lead)}/{len(pos)}")
+
+        # Null scores of every term, one batch of terms per distinct term size
+        perms = self.rank_permutations(n_genes, permutation_num=permutation_num, seed=seed)
+        esnull = self.null_es(hits, sizes, perms, metric, n_genes)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pos_null, neg_null = esnull >= 0, esnull < 0
+            pos_mean = (esnull * pos_null).sum(axis=1) / pos_null.sum(axis=1)
+            neg_mean = (esnull * neg_null).sum(axis=1) / neg_null.sum(axis=1)
+            pvals = np.where(es >= 0,
+                             (esnull >= es[:, None]).sum(axis=1) / pos_null.sum(axis=1),
+                             (esnull < es[:, None]).sum(axis=1) / neg_null.sum(axis=1))
+            nes = np.where(es >= 0, es / pos_mean, -es / neg_mean)
+            nes_null = np.where(pos_null, esnull / pos_mean[:, None], -esnull / neg_mean[:, None])
+            fdrs = self.fdr(nes, nes_null)
+            fwers = self.fwer(nes, nes_null)
+
+        res = pd.DataFrame({"Name": "prerank",
+                            "Term": terms,
+                            "ES": es,
+                            "NES": nes,
+                            "NOM p-val": pvals,
+                            "FDR q-val": fdrs,
+                            "FWER p-val": fwers,
+                            "Tag %": tag_frac,
+                            "Gene %": ["{0:.2%}".format(g) for g in gene_frac],
+                            "Lead_genes": lead_genes})
+        return res.sort_values(by="NES", key=np.abs, ascending=False, kind="mergesort").reset_index(drop=True)
+
+    def fdr(self, nes, nes_null):
+        '''
+        FDR q-values of gsea_fdr: the share of pooled null NES beyond each observed NES, over the share of observed NES beyond it, per sign
+        '''
+        nvals = np.sort(nes_null, axis=None)
+        nnes = np.sort(nes)
+        all_neg = np.searchsorted(nvals, 0, side="left")
+        all_pos = len(nvals) - all_neg
+        obs_neg = np.searchsorted(nnes, 0, side="left")
+        obs_pos = len(nnes) - obs_neg
+        pi_norm = np.where(nes >= 0, (len(nvals) - np.searchsorted(nvals, nes, side="left")) / all_pos, np.searchsorted(nvals, nes, side="right") / all_neg)
+        pi_obs = np.where(nes >= 0, (len(nnes) - np.searchsorted(nnes, nes, side="left")) / obs_pos, np.searchsorted(nnes, nes, side="right") / obs_neg)
+        return np.minimum(pi_norm / pi_obs, 1.0)
+
+    def fwer(self, nes, nes_null):
+        '''
+        Family-wise error rate: share of permutations whose most extreme null NES of the same sign, over all terms, reaches the observed NES
+        '''
+        max_pos = np.where(nes_null >= 0, nes_null, 0).max(axis=0)
+        min_neg = np.where(nes_null < 0, nes_null, 0).min(axis=0)
+        return np.where(nes >= 0, (max_pos[None, :] >= nes[:, None]).mean(axis=1), (min_neg[None, :] <= nes[:, None]).mean(axis=1))
+
+prerank_engine = PrerankEngine()
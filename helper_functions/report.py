@@ -0,0 +1,31 @@
+import base64
+from io import BytesIO
+
+import jinja2
+
+from helper_functions.accessory import ACCESSORY_DIR
+
+class Report():
+    '''
+    Builds the STAGES HTML report from figures and analysis settings
+    '''
+    def plot_to_bytes(self, fig, graph_module="pyplot", format="png"):
+        buf = BytesIO()
+        if graph_module == "pyplot":
+            fig.savefig(buf, format = format, bbox_inches="tight", dpi=300)
+        elif graph_module == 'plotly':
+            fig.write_image(file = buf, format = format, scale=3)
+        
+        data = base64.b64encode(buf.getbuffer()).decode("ascii")
+        return data
+
+    def render_report(self, template_dir=ACCESSORY_DIR, template_file="output_report_template.html", **context):
+        '''
+        Renders the STAGES HTML report, context containing the date, base64 encoded plots and analysis settings used in the template
+        '''
+        templateLoader = jinja2.FileSystemLoader(searchpath=template_dir)
+        templateEnv = jinja2.Environment(loader=templateLoader)
+        template = templateEnv.get_template(template_file)
+        return template.render(**context)
+
+stages_report = Report()
@@ -0,0 +1,130 @@
+import importlib.util
+import io
+import zipfile
+
+import pandas as pd
+
+class TableIO():
+    '''
+    Reads and writes expression and ratio tables in Arrow-based formats: Parquet, Feather and Arrow IPC files.
+    Tables from paths are memory-mapped, tables from uploaded bytes are read without copying the buffer, and only the requested columns are decoded.
+    '''
+    formats = {'parquet': "Parquet", 'feather': "Feather", 'arrow': "Arrow IPC"}
+
+    def source(self, src, memory_map=True):
+        import pyarrow as pa
+        if isinstance(src, (bytes, bytearray, memoryview)):
+            return pa.BufferReader(src)
+        return pa.memory_map(str(src), "r") if memory_map else pa.OSFile(str(src), "r")
+
+    def index_columns(self, schema):
+        '''
+        Columns holding the dataframe index in a table written by pandas, from the schema's pandas metadata
+        '''
+        meta = schema.pandas_metadata or {}
+        return [c for c in meta.get('index_columns', []) if isinstance(c, str)]
+
+    def read(self, src, fmt, columns=None, index_col=0):
+        '''
+        Parameters
+        ----------
+        src: str or bytes | path to the file (memory-mapped) or its contents
+        fmt: str | one of formats
+        columns: list or callable | columns to read, or a function returning True for the names of the columns to read. All columns if None
+        index_col: int | column used as the index when the table was not written from pandas (as for the csv reader), None for no index
+
+        Returns
+        -------
+        pd.DataFrame
+        '''
+        import pyarrow.parquet as pq
+        import pyarrow.ipc as ipc
+        if fmt == 'parquet':
+            reader = pq.ParquetFile(self.source(src))
+            schema = reader.schema_arrow
+        else:
+            reader = ipc.open_file(self.source(src))
+            schema = reader.schema
+
+        index_cols = self.index_columns(schema)
+        if index_col is not None and len(index_cols) == 0:
+            index_cols = [schema.names[index_col]]
+        if columns is not None:
+            wanted = [c for c in schema.names if c not in index_cols and (columns(c) if callable(columns) else c in columns)]
+            columns = index_cols + wanted
+
+        if fmt == 'parquet':
+            table = reader.read(columns=columns, use_pandas_metadata=True)
+        else:
+            table = reader.read_all()
+            table = table.select(columns) if columns is not None else table
+        df = table.to_pandas()
+        if len(self.index_columns(schema)) == 0 and index_col is not None:
+            df = df.set_index(index_cols[0])
+        return df
+
+    def write(self, df, fmt):
+        '''
+        Returns df as the bytes of a Parquet, Feather or Arrow IPC file, keeping its index
+        '''
+        import pyarrow as pa
+        import pyarrow.feather as feather
+        import pyarrow.parquet as pq
+        df = df.set_axis(df.columns.astype(str), axis=1) # Arrow only takes string column names
+        table = pa.Table.from_pandas(df, preserve_index=True)
+        buf = io.BytesIO()
+        if fmt == 'parquet':
+            pq.write_table(table, buf)
+        elif fmt == 'feather':
+            feather.write_feather(table, buf)
+        else:
+            feather.write_feather(table, buf, compression='uncompressed') # uncompressed IPC can be memory-mapped when read back
+        return buf.getvalue()
+
+    def write_tables(self, dfs, fmt, sheetnames=None):
+        '''
+        Returns a single table as a file, or several tables as a zip archive with one file per table (the equivalent of Excel sheets)
+
+        Returns
+        -------
+        data: bytes | file contents
+        ext: str | file extension of data
+        '''
+        dfs = list(dfs)
+        sheetnames = list(sheetnames) if sheetnames is not None else [f"Sheet {i + 1}" for i in range(len(dfs))]
+        if len(dfs) == 1:
+            return self.write(dfs[0], fmt), fmt
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w') as compress:
+            for d, name in zip(dfs, sheetnames):
+                compress.writestr(f"{name}.{fmt}", self.write(d, fmt))
+        return buf.getvalue(), "zip"
+
+    def excel_engine(self):
+        '''
+        calamine (Rust, streaming) if python-calamine is installed, otherwise openpyxl, which pandas already opens in read-only mode
+        '''
+        return "calamine" if importlib.util.find_spec("python_calamine") is not None else "openpyxl"
+
+    def excel_sheets(self, src):
+        '''
+        Sheet names of an xlsx workbook, read from the workbook metadata without parsing any sheet
+
+        Parameters
+        ----------
+        src: str or bytes | path to the workbook or its contents
+        '''
+        import openpyxl
+        wb = openpyxl.load_workbook(io.BytesIO(src) if isinstance(src, (bytes, bytearray)) else src, read_only=True)
+        try:
+            return wb.sheetnames
+        finally:
+            wb.close()
+
+    def read_excel_sheet(self, src, sheet, index_col=0):
+        '''
+        Parses a single sheet of an xlsx workbook
+        '''
+        return pd.read_excel(io.BytesIO(src) if isinstance(src, (bytes, bytearray)) else src, sheet_name=sheet, index_col=index_col, engine=self.excel_engine())
+
+table_io = TableIO()
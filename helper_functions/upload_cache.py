@@ -0,0 +1,103 @@
+import os
+import time
+
+import pandas as pd
+
+from helper_functions.disk_cache import cache_dir, content_hash
+
+class UploadCache():
+    '''
+    Parsed uploads stored as Parquet under the STAGES cache, keyed by the content hash of the uploaded bytes,
+    so that the same file uploaded again (by any user) is neither parsed nor checked for gene naming issues a second time.
+
+    Cached tables are deleted max_age seconds after they were last read (24 hours unless set with the STAGES_UPLOAD_TTL
+    environment variable), and the least recently read ones once the folder holds more than max_bytes.
+    '''
+    max_age = float(os.environ.get("STAGES_UPLOAD_TTL", 24 * 60 * 60))
+    max_bytes = 2 * 1024 ** 3
+    def key(self, data, *parts):
+        '''
+        Parameters
+        ----------
+        data: bytes | contents of the uploaded file
+        parts: str | anything else the cached table depends on, eg. the sheet name or the processing step
+        '''
+        return "-".join([content_hash(data)] + [str(p) for p in parts])
+
+    def path(self, key):
+        return os.path.join(cache_dir("uploads"), f"{key}.parquet")
+
+    def load(self, key):
+        '''
+        Returns the cached table of key, or None if it has not been stored
+        '''
+        path = self.path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                os.remove(path)
+                return None
+            os.utime(path) # the modification time records the last read
+            return pd.read_parquet(path)
+        except FileNotFoundError: # not stored, or evicted by another session
+            return None
+
+    def store(self, key, df):
+        '''
+        Writes df under key and returns it. Tables that Parquet cannot hold (eg. columns of mixed types) are returned without being cached.
+        '''
+        path = self.path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            df.to_parquet(tmp)
+            os.replace(tmp, path)
+        except Exception: # pyarrow raises its own errors for unsupported dtypes
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self.evict()
+        return df
+
+    def evict(self):
+        '''
+        Deletes the tables not read for max_age seconds, then the least recently read ones until the folder fits in max_bytes
+        '''
+        now = time.time()
+        entries = []
+        for entry in os.scandir(cache_dir("uploads")):
+            try:
+                stat = entry.stat()
+                if now - stat.st_mtime > self.max_age:
+                    os.remove(entry.path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            except FileNotFoundError: # removed by another session
+                pass
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def discard(self, data):
+        '''
+        Deletes every table cached from the uploaded bytes data (the parsed sheets and their gene clean-up)
+        '''
+        prefix = content_hash(data)
+        for entry in os.scandir(cache_dir("uploads")):
+            if entry.name.startswith(prefix):
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def cached(self, key, parse):
+        '''
+        Returns the cached table of key, or the output of parse() after storing it
+        '''
+        df = self.load(key)
+        return df if df is not None else self.store(key, parse())
+
+upload_cache = UploadCache()
@@ -1,18 +1,26 @@
+import time
+from io import BytesIO
+
 import streamlit as st
 import pandas as pd
 from helper_functions.date_gene import qc_df
+from helper_functions.gene_symbols import symbol_qc
+from helper_functions.upload_cache import upload_cache
+from helper_functions.counts_ingest import counts_ingest
+from helper_functions.table_io import table_io
+from helper_functions.memo import memo
 from helper_functions.session_state import ss
+from helper_functions.gmt_index import gmt_compiler
 
-from io import StringIO
-from collections import defaultdict
 
 class FileUploads():
-    def read_xfile(self, df_query, ss_excel):
+    def read_xfile(self, df_query, ss_excel, stream=False):
         '''
         Parameter
         ---------
         df_query: from the st.file_uploader output
         ss_excel: potential session state key for any possible excel files
+        stream: bool | read csv/txt files as expression matrices with CountsIngest (float32, duplicated genes averaged)
 
         Returns
         -------
@@ -23,53 +31,117 @@ class FileUploads():
         df_dict = {}
         for d in df_query:
             head, sep, tail = str(d.name).partition(".")
-            if tail == 'csv':
-                data = st.cache_data(pd.read_csv)(d, index_col=0)
+            content = d.getvalue()
+            if stream and tail in ['csv', 'txt']:
+                key = upload_cache.key(content, "stream", "dates") # "dates": not the earlier reads that averaged date rows
+                try:
+                    data = upload_cache.cached(key, lambda: counts_ingest.read(BytesIO(content), sep="," if tail == 'csv' else '\t'))
+                except ValueError as e:
+                    st.error(f"{d.name}: {e}")
+                    st.stop()
+                data.attrs['upload_key'] = key
+                df_dict[head] = data
+
+            elif tail == 'csv':
+                key = upload_cache.key(content)
+                data = upload_cache.cached(key, lambda: pd.read_csv(BytesIO(content), index_col=0))
+                data.attrs['upload_key'] = key
                 df_dict[head] = data
 
             elif tail == 'txt':
-                data = st.cache_data(pd.read_csv)(d, sep='\t', index_col=0)
+                key = upload_cache.key(content)
+                data = upload_cache.cached(key, lambda: pd.read_csv(BytesIO(content), sep='\t', index_col=0))
+                data.attrs['upload_key'] = key
+                df_dict[head] = data
+
+            elif tail in table_io.formats:
+                data = table_io.read(content, tail) # already a parsed format, so only the gene clean-up is cached
+                data.attrs['upload_key'] = upload_cache.key(content)
                 df_dict[head] = data
 
             elif tail == 'xlsx':
-                x = st.cache_data(pd.read_excel)(d, index_col=0, sheet_name=None, engine='openpyxl')
+                file_key = upload_cache.key(content)
+                sheets = self.excel_sheets(file_key, content) # sheets are only parsed once selected
                 if ss_excel == "df_excel":
-                    selected_sheet = st.multiselect(label="Select which sheet to read in", options=list(x.keys()), default = st.session_state[ss_excel])
+                    selected_sheet = st.multiselect(label="Select which sheet to read in", options=sheets, default = st.session_state[ss_excel])
                     if len(selected_sheet) != 0:
                         for i in selected_sheet:
-                            df_dict[f"{head}_{i}"] = x[i]
+                            df_dict[f"{head}_{i}"] = self.read_sheet(content, file_key, i)
                         ss.save_state({ss_excel: selected_sheet})
                     else:
                         ss.save_state({ss_excel: st.session_state[ss_excel]})
                 else:
-                    selected_meta = st.multiselect(label="Select which sheet to read in for metadata", options=list(x.keys()), default = st.session_state[ss_excel])
+                    selected_meta = st.multiselect(label="Select which sheet to read in for metadata", options=sheets, default = st.session_state[ss_excel])
                     if len(selected_meta) != 0:
                         for i in selected_meta:
-                            df_dict[f"{head}_{i}"] = x[i]
+                            df_dict[f"{head}_{i}"] = self.read_sheet(content, file_key, i)
                         ss.save_state({ss_excel: selected_meta})
                     else:
                         ss.save_state({ss_excel: st.session_state[ss_excel]})
         return df_dict
     
+    @memo.memoize
+    def excel_sheets(_self, file_key, _content):
+        return table_io.excel_sheets(_content)
+
+    def read_sheet(self, content, file_key, sheet):
+        '''
+        Returns one sheet of an uploaded workbook, parsed once per workbook content and sheet name
+        '''
+        key = f"{file_key}-{sheet}"
+        data = upload_cache.cached(key, lambda: table_io.read_excel_sheet(content, sheet))
+        data.attrs['upload_key'] = key
+        return data
+
+    def prepare_genes(self, df):
+        '''
+        Upper-cases the gene symbols of df and records its naming issue (see GeneSymbolQC.classify) in df.attrs['gene_issue']
+        '''
+        df.index = df.index.astype(str, copy=False) # expand to format actual dates from excel sheets as text
+        df.index = df.index.str.upper()
+        df.attrs['gene_issue'] = symbol_qc.classify(df)
+        return df
+
+    def clear_cache(self):
+        '''
+        Deletes the cached tables of this session's uploads, then resets the session state ("Clear cache" button)
+        '''
+        for k in ['df_in', 'meta_in']:
+            for d in st.session_state.get(k) or []:
+                upload_cache.discard(d.getvalue())
+        ss.clear_output()
+
     def capslock_genes(self, df_dict):
-        for df in df_dict.values():
-            df.index = df.index.astype(str, copy=False) # expand to format actual dates from excel sheets as text
-            df.index = df.index.str.upper()
+        '''
+        Gene symbol clean-up of the uploaded dataframes. Upper-cased and checked tables are cached by upload content,
+        so reruns and re-uploads only apply the fixes of tables with naming issues.
+        '''
+        prepared_dict = {}
+        for k, df in df_dict.items():
+            key = df.attrs.get('upload_key')
+            prepared = upload_cache.load(f"{key}-genes") if key is not None else None
+            if prepared is None:
+                prepared = self.prepare_genes(df)
+                if key is not None:
+                    upload_cache.store(f"{key}-genes", prepared)
+                if prepared.attrs['gene_issue'] is None:
+                    noerr = st.success(f"No errors detected for {k} dataframe")
+                    time.sleep(1)
+                    noerr.empty()
+            prepared_dict[k] = prepared
 
-        cleandict = qc_df(df_dict)
+        cleandict = qc_df(prepared_dict)
 
         return cleandict
     
     def gmt_to_dict(self, add_geneset_in):
-        geneset_dicts = defaultdict(dict)
+        '''
+        Returns {file name: GMTIndex} for the uploaded .gmt files, compiled once per content and memory-mapped from the cache afterwards
+        '''
+        geneset_dicts = {}
         for geneset in add_geneset_in:
-            upload_to_str = StringIO(st.session_state['add_geneset_in'][0].getvalue().decode("utf-8"))
             fname = geneset.name
-            for line in upload_to_str.readlines():
-                break_mod = line.split("\t")
-                modname = break_mod[0]
-                genes = break_mod[2:None]
-                geneset_dicts[fname.replace(".gmt","")][modname] = genes
-        return dict(geneset_dicts)
+            geneset_dicts[fname.replace(".gmt","")] = gmt_compiler.compile(geneset.getvalue())
+        return geneset_dicts
     
 fileuploads = FileUploads()
\ No newline at end of file
@@ -32,9 +32,10 @@ file_type = file_opts.radio(label="Select data type for upload", options = ftype
                              index = ftype_list.index(st.session_state['file_type']))
 ss.save_state(dict(file_type = file_type))
 
-df_query = file_opts.file_uploader('Upload your file', type = ['csv', 'txt', 'xlsx'], accept_multiple_files=True, help='Note that excel files take longer to upload')
+df_query = file_opts.file_uploader('Upload your file', type = ['csv', 'txt', 'xlsx', 'parquet', 'feather', 'arrow'], accept_multiple_files=True,
+                                   help='Note that excel files take longer to upload. Parquet, Feather and Arrow IPC files load fastest for large count matrices')
 
-clear = file_opts.button("Clear cache", on_click=ss.clear_output)
+clear = file_opts.button("Clear cache", on_click=fileuploads.clear_cache)
 if clear:
     st.rerun()
 # # Save the df_query so that the data remains stored as the conditions will be met via proxy (df_in session state)
@@ -55,7 +56,7 @@ else:
 # ## 4. no files uploaded and no demo
 if st.session_state['df_in'] is not None and st.session_state['demo'] is False:
     with file_opts:
-        cleandict = fileuploads.read_xfile(st.session_state['df_in'], ss_excel = 'df_excel')
+        cleandict = fileuploads.read_xfile(st.session_state['df_in'], ss_excel = 'df_excel', stream = file_type != "Ratios and P-values")
     cleandict = fileuploads.capslock_genes(cleandict)
 
     if file_type == "Ratios and P-values":
@@ -63,7 +64,7 @@ if st.session_state['df_in'] is not None and st.session_state['demo'] is False:
 
     else:
         with file_opts:
-            metadata = st.file_uploader(label="Upload gene expression's metadata here", type = ['csv', 'txt', 'xlsx'], accept_multiple_files=True)
+            metadata = st.file_uploader(label="Upload gene expression's metadata here", type = ['csv', 'txt', 'xlsx', 'parquet', 'feather', 'arrow'], accept_multiple_files=True)
             if len(metadata) != 0:
                 ss.save_state({'expr_dict':cleandict,'meta_in':metadata})
             else:
@@ -2,12 +2,6 @@ import pandas as pd
 import numpy as np
 import regex as re
 
-# Stats modules
-from statsmodels.stats import multitest
-from anndata import AnnData
-import decoupler as dc
-import scanpy as sc
-
 import streamlit as st
 from streamlit_tags import st_tags, st_tags_sidebar
 
@@ -23,6 +17,8 @@ st.session_state.update(st.session_state)
 ss.initialise_state({'test_fdr':'None',
                      'vthresh':0,
                      'adata':None,
+                     'adata_built':None,
+                     'adata_dataset':None,
                      'violin1':None,
                      'violin2':None,
                      'comparisons':None,
@@ -32,19 +28,18 @@ ss.initialise_state({'test_fdr':'None',
                      'comparisonopts_nobaseline':[],
                      'against_baseline':None,
                      'equalvar':True,
+                     'adata_storage':'Dense (in memory)',
                      'use_corrected_pval':False,
                      'submit_comparison':False,
                      'ready':None,
-                     'log_dict_ready':None})
+                     'comparison_store':None})
 
 try:
     exprdict, metadatadict, anovadict = st.session_state['expr_dict'], st.session_state['meta_dict'], st.session_state['anova_dict']
 
     adjusted_dfs = {}
     prep_exp = st.sidebar.expander("Pre-processing Options")
-    padj_mtds = {"None":None, "Bonferroni":"bonferroni", "Sidak":'sidak', 'Holm-Sidak':'holm-sidak', 'Holm':'holm', 'Simes-Hochberg':'simes-hochberg', 'Hommel':'hommel',
-                'Benjamini-Hochberg FDR':'fdr_bh', 'Benjamini-Yekutieli FDR':'fdr_by',
-                'Two-stage Benjamini-Hochberg FDR':'fdr_tsbh', 'Two-stage Benjamini-Yekutieli FDR':'fdr_tsbky'}
+    padj_mtds = tested.padj_mtds
 
     # Conditions here should mainly be
     ## 1. Process ANOVA data (not None)
@@ -63,25 +58,11 @@ try:
             ss.save_state({'use_corrected_pval':False})
         
         if test_fdr_match is not None:
-            for k,v in comps.items():
-                anova_file = anovadict[k]
-                adj_df_per_k = pd.DataFrame()
-                for comp in v:
-                    comp_df = anova_file.filter(regex = comp, axis=1)
-                    pval_col = comp_df.filter(regex = "^pval", axis=1) # need to accommodate other regexes????
-                    pval_col = pval_col.sort_values(by=pval_col.columns[0], ascending = True)
-                    pval_array = pval_col.iloc[:,0].to_numpy()
-                    rej, corrected, alphacSidak, alphacBonf = multitest.multipletests(pval_array,
-                                                                                    method=test_fdr_match,
-                                                                                    is_sorted = True)
-                    corrected_vals = pd.DataFrame(data = {f"adj_pval_{comp}":corrected}, index = pval_col.index)
-                    try:
-                        adj_df_per_k = pd.concat([adj_df_per_k, comp_df, corrected_vals], axis=1, verify_integrity=True)
-                    except ValueError:
-                        st.error("Duplicated columns found. Perhaps you already have adjusted p-values? If so, opt for None in multiple test correction and tick the checkbox to use corrected p-values for subsequent analysis.")
-                        st.stop()
-
-                adjusted_dfs[k] = adj_df_per_k
+            try:
+                adjusted_dfs = tested.adjust_pvals(anovadict, comps, method=test_fdr_match)
+            except ValueError:
+                st.error("Duplicated columns found. Perhaps you already have adjusted p-values? If so, opt for None in multiple test correction and tick the checkbox to use corrected p-values for subsequent analysis.")
+                st.stop()
             ss.save_state({'test_fdr':test_fdr, 'comparisons':comps, 'ready':adjusted_dfs})
         
         else:
@@ -89,13 +70,25 @@ try:
             ss.save_state({'test_fdr':"None", 'comparisons':comps, 'ready': adjusted_dfs})
 
     elif exprdict is not None and metadatadict is not None: # RNAseq or microarray data
-        exprdict = {k:v.groupby(v.index).mean() for k,v in exprdict.items()}
-        expr_obj = exprdict[list(exprdict.keys())[0]].T.sort_index(axis=0, ascending=True)
+        # streamed uploads already have one sorted row per gene, so only other tables are aggregated and copied here
+        exprdict = {k:v if v.index.is_unique and v.index.is_monotonic_increasing else v.groupby(v.index).mean() for k,v in exprdict.items()}
+        expr_obj = exprdict[list(exprdict.keys())[0]].T
+        expr_obj = expr_obj if expr_obj.index.is_monotonic_increasing else expr_obj.sort_index(axis=0, ascending=True)
         expr_key = list(exprdict.keys())[0]
         meta_obj = metadatadict[list(metadatadict.keys())[0]].sort_index(axis=0, ascending=True)
 
-        adata = AnnData(expr_obj, obs = meta_obj, dtype='float32') # expr data should be genes in cols, subjects in rows, obs should be the same
-        ss.save_state({"adata":adata})
+        storage_opts = {'Dense (in memory)':'dense', 'Sparse CSR (in memory)':'sparse', 'Backed .h5ad (on disk)':'backed'}
+        adata_storage = prep_exp.selectbox("Select how the expression matrix is stored", options = list(storage_opts.keys()),
+                                           index = list(storage_opts.keys()).index(st.session_state['adata_storage']),
+                                           help = "Sparse and on-disk storage keep memory usage down for large count matrices")
+        ss.save_state({'adata_storage':adata_storage})
+        dataset = (counts_pp.frame_token(expr_obj, meta_obj), storage_opts[adata_storage])
+        if st.session_state['adata_dataset'] != dataset: # built once per dataset, the .h5ad files of a replaced backed dataset are deleted
+            counts_pp.release(st.session_state['adata_built'])
+            adata = counts_pp.build_adata(expr_obj, meta_obj, storage=storage_opts[adata_storage], token=dataset[0])
+            ss.save_state({'adata_built':adata, 'adata_dataset':dataset})
+        ss.save_state({"adata":st.session_state['adata_built']})
+        adata = st.session_state['adata']
 
         if st.session_state['file_type'] == "RNAseq Counts": # specifically RNAseq data
             st.header("Count Normalisation")
@@ -141,40 +134,19 @@ try:
             submit_comparison = prep_exp.checkbox("Selection complete", value = st.session_state['submit_comparison'], on_change=ss.binaryswitch, args=('submit_comparison', ))
 
             if submit_comparison:
-                dc.mask_features(adata, log=True, thr=st.session_state['vthresh'])
-                sc.pp.filter_genes(adata, min_cells=adata.shape[0])
+                adata = counts_pp.filter_counts(adata, thr=st.session_state['vthresh'])
                 violin2, vaxes2 = counts_pp.multiviolin(adata, split_long_violins=split_long_violins)
                 ss.save_state({'violin2':violin2, 'adata':adata})
                 aft.pyplot(st.session_state['violin2'])
 
-                ratios = counts_pp.ratio(adata, comp_var = adata_vars[st.session_state['comp_var']],
-                                        baseline= st.session_state['baseline'],
-                                        against_baseline= st.session_state['against_baseline'],
-                                        is_log=False)
-                ttest = counts_pp.pval_scipy(adata, comp_var = adata_vars[st.session_state['comp_var']],
-                                            baseline= st.session_state['baseline'],
-                                            against_baseline= st.session_state['against_baseline'],
-                                            equalvar= st.session_state['equalvar'])
-                
-                comps = tested.comparison_finder({expr_key:ttest})
-                test_fdr_match = padj_mtds[st.session_state['test_fdr']]
-                adj_df_per_k = pd.DataFrame()
-                if test_fdr_match is not None:
-                    corrected_pval_df = pd.DataFrame()
-                    for c in ttest.columns:
-                        pval_col = ttest.loc[:,c].sort_values(ascending = True)
-                        pval_array = pval_col.to_numpy()
-                        rej, corrected, alphacSidak, alphacBonf = multitest.multipletests(pval_array,
-                                                                                        method=test_fdr_match,
-                                                                                        is_sorted = True)
-                        corrected_vals = pd.DataFrame(data = {f"adj_{c}":corrected}, index = pval_col.index)
-                        corrected_pval_df = pd.concat([corrected_pval_df, corrected_vals], axis=1)
-                    adj_df_per_k = pd.concat([adj_df_per_k, ratios, ttest, corrected_pval_df], axis=1)
-                else:
-                    adj_df_per_k = pd.concat([ratios, ttest], axis=1)
-
-                sort_by_comparison = pd.concat([adj_df_per_k.filter(regex=comp, axis=1) for comp in comps[expr_key]], axis=1)
-                ss.save_state({'ready': {expr_key:sort_by_comparison}, 'comparisons':comps})
+                ready, comps = counts_pp.compare_groups(adata, comp_var = adata_vars[st.session_state['comp_var']],
+                                                        baseline= st.session_state['baseline'],
+                                                        against_baseline= st.session_state['against_baseline'],
+                                                        equalvar= st.session_state['equalvar'],
+                                                        is_log = False,
+                                                        method = padj_mtds[st.session_state['test_fdr']],
+                                                        expr_key = expr_key)
+                ss.save_state({'ready': ready, 'comparisons':comps})
 
         else:
             adata = st.session_state['adata']
@@ -198,44 +170,24 @@ try:
             submit_comparison = prep_exp.checkbox("Selection complete", on_change=ss.binaryswitch, args=('submit_comparison', ))
             
             if submit_comparison:
-                ratios = counts_pp.ratio(adata, comp_var = adata_vars[st.session_state['comp_var']],
-                                        baseline= st.session_state['baseline'],
-                                        against_baseline= st.session_state['against_baseline'],
-                                        is_log = True)
-                ttest = counts_pp.pval_scipy(adata, comp_var = adata_vars[st.session_state['comp_var']],
-                                            baseline= st.session_state['baseline'],
-                                            against_baseline= st.session_state['against_baseline'],
-                                            equalvar= st.session_state['equalvar'])
-                
-                comps = tested.comparison_finder({expr_key:ttest})
-                test_fdr_match = padj_mtds[st.session_state['test_fdr']]
-                adj_df_per_k = pd.DataFrame()
-                if test_fdr_match is not None:
-                    corrected_pval_df = pd.DataFrame()
-                    for c in ttest.columns:
-                        pval_col = ttest.loc[:,c].sort_values(ascending = True)
-                        pval_array = pval_col.to_numpy()
-                        rej, corrected, alphacSidak, alphacBonf = multitest.multipletests(pval_array,
-                                                                                        method=test_fdr_match,
-                                                                                        is_sorted = True)
-                        corrected_vals = pd.DataFrame(data = {f"adj_{c}":corrected}, index = pval_col.index)
-                        corrected_pval_df = pd.concat([corrected_pval_df, corrected_vals], axis=1)
-                    adj_df_per_k = pd.concat([adj_df_per_k, ratios, ttest, corrected_pval_df], axis=1)
-                else:
-                    adj_df_per_k = pd.concat([ratios, ttest], axis=1)
-
-                sort_by_comparison = pd.concat([adj_df_per_k.filter(regex=comp, axis=1) for comp in comps[expr_key]], axis=1)
-                ss.save_state({'ready': {expr_key:sort_by_comparison}, 'comparisons':comps})
+                ready, comps = counts_pp.compare_groups(adata, comp_var = adata_vars[st.session_state['comp_var']],
+                                                        baseline= st.session_state['baseline'],
+                                                        against_baseline= st.session_state['against_baseline'],
+                                                        equalvar= st.session_state['equalvar'],
+                                                        is_log = True,
+                                                        method = padj_mtds[st.session_state['test_fdr']],
+                                                        expr_key = expr_key)
+                ss.save_state({'ready': ready, 'comparisons':comps})
 
     if st.session_state['ready'] is not None:
-        log_dict = tested.log_transform(st.session_state['ready'], comparison_dict=st.session_state['comparisons'], use_corrected_pval=st.session_state['use_corrected_pval'])
-        ss.save_state({'log_dict_ready':log_dict})
+        comparison_store = tested.comparison_store(st.session_state['ready'], comparison_dict=st.session_state['comparisons'], use_corrected_pval=st.session_state['use_corrected_pval'])
+        ss.save_state({'comparison_store':comparison_store})
         st.header("Pre-processed data (ratios and p-values)")
         for k,v in st.session_state['ready'].items():
             st.subheader(k)
             st.dataframe(v)
-        st.download_button(label="Download Processed Data", data=file_downloads.to_excel(st.session_state['ready'].values(),
-                                                                                         sheetnames=st.session_state['ready'].keys()), file_name="processed_data.xlsx")
+        file_downloads.download_tables(st.session_state['ready'].values(), label="Download Processed Data",
+                                       sheetnames=st.session_state['ready'].keys(), file_name="processed_data")
         
 
 except KeyError:
@@ -12,14 +12,14 @@ st.header("Correlation Matrix")
 corr_exp = st.sidebar.expander("Expand for correlation matrix", expanded=False)
 corr_opts = ['pearson', 'kendall', 'spearman', 'phik']
 
-if "log_dict_ready" in st.session_state:
-    if st.session_state['log_dict_ready'] is not None:
-        log_dict = st.session_state['log_dict_ready']
+if "comparison_store" in st.session_state:
+    if st.session_state['comparison_store'] is not None:
+        comparison_store = st.session_state['comparison_store']
         
         corr_mtd = corr_exp.selectbox("Choose the correlation coefficient to use", options=corr_opts, format_func = lambda x: x.title(), index = corr_opts.index(st.session_state['corr_mtd']))
         ss.save_state({'corr_mtd':corr_mtd})
 
-        mtx = cmatrix.corr_matrix(log_dict, method = st.session_state['corr_mtd'])
+        mtx = cmatrix.corr_matrix(comparison_store, method = st.session_state['corr_mtd'])
         ss.save_state({'corr_matrix_plot':mtx})
         st.info("If the plot is too small, please hover over the plot and click the expand button on the top right corner of the plot.")
         st.plotly_chart(st.session_state['corr_matrix_plot'], theme = None, use_container_width=True)
@@ -13,11 +13,16 @@ ss.initialise_state({'reset_volcano':False,
                     'xaxes_volcano':(0.0,0.0),
                      'yaxes_volcano':0.0,
                      'interactive_volcano':False,
+                     'volcano_density':False,
                      'volcano_plots_static':None,
                      'volcano_plots_interactive':None,
                      'cdf_pthresh':0.05,
                      'cdf_linemode':'lines',
+                     'cdf_fcstep':0.1,
                      'cdf_plot':None,
+                     'map_maxfc':5.0,
+                     'map_fcstep':0.1,
+                     'threshold_map':None,
                      'bar_pval':0.05,
                      'bar_fc':1.30,
                      'bar_width':800,
@@ -28,7 +33,7 @@ ss.initialise_state({'reset_volcano':False,
 st.header("Differential Expression Analysis")
 
 try:
-    bar_t, cdf_t,  volcano_t, data_t = st.tabs(["Differential Expression Bar Plots", "Cumulative Distribution Function", "Volcano Plot", "DEG identity"])
+    bar_t, cdf_t, map_t, volcano_t, data_t = st.tabs(["Differential Expression Bar Plots", "Cumulative Distribution Function", "DEG Threshold Map", "Volcano Plot", "DEG identity"])
     use_corrected_pval_fmt = "adjusted p-value" if st.session_state['use_corrected_pval'] else "p-value"
     ######### BAR PLOT #################
     deg_opts = st.sidebar.expander("Differential expression bar plot options", expanded=True)
@@ -42,7 +47,7 @@ try:
                    'bar_width':bar_width,
                    'bar_height':bar_height})
 
-    stacked1, proportions = DE.degs(st.session_state['log_dict_ready'],
+    stacked1, proportions = DE.degs(st.session_state['comparison_store'],
                                     st.session_state['comparisons'],
                                     pval_cutoff=st.session_state['bar_pval'],
                                     fc_cutoff=st.session_state['bar_fc'],
@@ -68,18 +73,42 @@ try:
     cdf_linemode = cdf_exp.selectbox("Choose line mode", options=line_options,
                                     format_func=lambda x: x.title().replace("+", " & "),
                                     index = line_options.index(st.session_state['cdf_linemode']))
-    ss.save_state({'cdf_pthresh': round(cdf_pthresh,2), 'cdf_linemode':cdf_linemode})
+    step_options = [0.1, 0.05, 0.01]
+    cdf_fcstep = cdf_exp.selectbox("Choose fold-change step size", options=step_options,
+                                    index = step_options.index(st.session_state['cdf_fcstep']))
+    ss.save_state({'cdf_pthresh': round(cdf_pthresh,2), 'cdf_linemode':cdf_linemode, 'cdf_fcstep':cdf_fcstep})
     cdf_plot = preDE.deg_cdf(st.session_state['ready'],
                             st.session_state['comparisons'],
                             pval=st.session_state['cdf_pthresh'],
                             markermode=st.session_state['cdf_linemode'],
-                            use_corrected_pval=st.session_state['use_corrected_pval'])
+                            use_corrected_pval=st.session_state['use_corrected_pval'],
+                            fc_step=st.session_state['cdf_fcstep'])
     ss.save_state({'cdf_plot':cdf_plot})
 
     with cdf_t:
         st.plotly_chart(st.session_state['cdf_plot'], theme=None, use_container_width=True)
         file_downloads.create_pdf(st.session_state['cdf_plot'], "cumulative_density_DEGs", graph_module='plotly')
 
+    ########## THRESHOLD MAP ###############
+    map_exp = st.sidebar.expander("DEG threshold map options", expanded=False)
+    map_maxfc = map_exp.number_input("Choose maximum fold-change cutoff", min_value=1.5, max_value=20.0, step=0.5, value=st.session_state['map_maxfc'])
+    map_fcstep = map_exp.selectbox("Choose fold-change step size", options=step_options,
+                                   index = step_options.index(st.session_state['map_fcstep']), key="map_fcstep_select")
+    ss.save_state({'map_maxfc':map_maxfc, 'map_fcstep':map_fcstep})
+    threshold_map = preDE.deg_threshold_map(st.session_state['comparison_store'],
+                                            st.session_state['comparisons'],
+                                            pval_cutoff=st.session_state['bar_pval'],
+                                            fc_cutoff=st.session_state['bar_fc'],
+                                            use_corrected_pval=st.session_state['use_corrected_pval'],
+                                            max_fc=st.session_state['map_maxfc'],
+                                            fc_step=st.session_state['map_fcstep'])
+    ss.save_state({'threshold_map':threshold_map})
+
+    with map_t:
+        st.markdown("Number of DEGs of the selected comparison for every pair of cutoffs. The cross marks the bar plot cutoffs.")
+        st.plotly_chart(st.session_state['threshold_map'], theme=None, use_container_width=False)
+        file_downloads.create_pdf(st.session_state['threshold_map'], "DEG_threshold_map", graph_module='plotly')
+
 ######### VOLCANO PLOT ##################
     vol_opts = st.sidebar.expander("Volcano plot options", expanded=True)
 
@@ -98,15 +127,21 @@ try:
     ss.save_state({'yaxes_volcano':yaxes})
 
     interactive_volcano = vol_opts.checkbox(label="Show interactive volcano plot", value=st.session_state['interactive_volcano'],
-                                            help="Facilitates gene name display on hover. This may cause lag", on_change=ss.binaryswitch, args=('interactive_volcano', ))
+                                            help="Facilitates gene name display on hover. Use density mode below for large datasets", on_change=ss.binaryswitch, args=('interactive_volcano', ))
+    volcano_density = vol_opts.checkbox(label="Density mode for non-significant genes", value=st.session_state['volcano_density'],
+                                        help="Only DEGs (bar plot thresholds) and labelled genes are drawn as points, other genes are shaded by density. Recommended for large datasets",
+                                        on_change=ss.binaryswitch, args=('volcano_density', ))
 
     vol_plot, iplot = preDE.volcano(
-        user_log=st.session_state['log_dict_ready'],
+        comparison_store=st.session_state['comparison_store'],
         comparison_dict=st.session_state['comparisons'],
         xaxes=st.session_state['xaxes_volcano'],
         yaxes=st.session_state['yaxes_volcano'],
         interactive_volcano= st.session_state['interactive_volcano'],
-        use_corrected_pval=st.session_state['use_corrected_pval']
+        use_corrected_pval=st.session_state['use_corrected_pval'],
+        density=st.session_state['volcano_density'],
+        pval_cutoff=st.session_state['bar_pval'],
+        fc_cutoff=st.session_state['bar_fc']
         )
     ss.save_state({'volcano_plots_static':vol_plot,
                    'volcano_plots_interactive':iplot})
@@ -128,7 +163,7 @@ try:
         st.info("Users may select the gene names within this dataframe and copy them for downstream analysis.")
         for k, v in st.session_state['degs'].items():
             st.write(f"**{k}**", v)
-        st.download_button(label="Download DEGs", data=file_downloads.to_excel(st.session_state['degs'].values()), file_name="DEGs.xlsx")
+        file_downloads.download_tables(st.session_state['degs'].values(), label="Download DEGs", file_name="DEGs")
 
 except AttributeError:
     st.error("Perhaps you forgot to run through the pre-processing page?")
\ No newline at end of file
@@ -9,8 +9,6 @@ import re
 import streamlit as st
 
 import plotly.colors as pc
-import matplotlib.pyplot as plt
-import seaborn as sns
 
 from helper_functions.session_state import ss
 from helper_functions.downloads import file_downloads
@@ -33,6 +31,8 @@ ss.initialise_state({'cluster_useDEG': None,
                      'clust_genedict':None,
                      'clust_genevals':None,
                      'clust_submit':True,
+                     'clust_interactive':False,
+                     'clust_window':None,
                      'clustergram_plot':None
                      })
 
@@ -97,25 +97,30 @@ try:
                     'clust_gene_fontsize': gene_fontsize
                     })
         get_genes, gene_dict = genePP.genes_used(degs=degs, useDEG=st.session_state['cluster_useDEG'], textgene=st.session_state['cluster_textgene'])
-        gene_vals = genePP.get_gene_vals(st.session_state['log_dict_ready'], get_genes)
+        gene_vals = genePP.get_gene_vals(st.session_state['comparison_store'], get_genes)
         ss.save_state({'clust_genelist':get_genes,
                     'clust_genedict':gene_dict,
                     'clust_genevals':gene_vals})
         
-        get_clustergram, missing_vals = clustergram.cluster_plot(st.session_state['clust_genevals'],
-                                                                 gene_dict=st.session_state['clust_genedict'],
-                                                                 vminmax=st.session_state['clust_vminmax'],
-                                                                 cbar_left=st.session_state['clust_cbarleft'],
-                                                                 cbar_bottom=st.session_state['clust_cbarbottom'],
-                                                                 cbar_width=st.session_state['clust_cbarwidth'],
-                                                                 cbar_height=st.session_state['clust_cbarheight'],
-                                                                 width=st.session_state['clust_width'],
-                                                                 height=st.session_state['clust_height'],
-                                                                 dendrogram_r=st.session_state['clust_dendror'],
-                                                                 dendrogram_c=st.session_state['clust_dendroc'],
-                                                                 cluster_cols=st.session_state['clust_cols'],
-                                                                 clust_gene_fontsize=st.session_state['clust_gene_fontsize']
-                                                    )
+        plot_args = dict(gene_dict=st.session_state['clust_genedict'],
+                         vminmax=st.session_state['clust_vminmax'],
+                         cbar_left=st.session_state['clust_cbarleft'],
+                         cbar_bottom=st.session_state['clust_cbarbottom'],
+                         cbar_width=st.session_state['clust_cbarwidth'],
+                         cbar_height=st.session_state['clust_cbarheight'],
+                         width=st.session_state['clust_width'],
+                         height=st.session_state['clust_height'],
+                         dendrogram_c=st.session_state['clust_dendroc'],
+                         cluster_cols=st.session_state['clust_cols'],
+                         clust_gene_fontsize=st.session_state['clust_gene_fontsize'])
+        large_mode = len(st.session_state['clust_genevals']) > clustergram.large_rows
+        if large_mode:
+            st.info(f"More than {clustergram.large_rows} genes selected: the clustergram is drawn as a single image in optimal leaf order, without the row dendrogram.")
+            get_clustergram, missing_vals, ordered_vals = clustergram.large_cluster_plot(st.session_state['clust_genevals'], **plot_args)
+        else:
+            get_clustergram, missing_vals = clustergram.cluster_plot(st.session_state['clust_genevals'],
+                                                                     dendrogram_r=st.session_state['clust_dendror'],
+                                                                     **plot_args)
 
         ss.save_state({'clustergram_plot':get_clustergram})
         if len(missing_vals) != 0:
@@ -126,6 +131,19 @@ try:
         if st.session_state['clustergram_plot'] is not None:
             st.pyplot(st.session_state['clustergram_plot'])
             file_downloads.create_pdf(st.session_state['clustergram_plot'], "Clustergram", "pyplot")
+
+            if large_mode:
+                interactive = st.checkbox("Show zoomable heatmap", value=st.session_state['clust_interactive'],
+                                          help="Windows of more than 2000 genes are shown with neighbouring genes averaged. Narrow the window to see every gene.",
+                                          on_change=ss.binaryswitch, args=('clust_interactive', ))
+                if interactive:
+                    n_genes = len(ordered_vals)
+                    window = st.session_state['clust_window']
+                    window = (0, n_genes) if window is None or window[1] > n_genes else window
+                    window = st.slider("Genes to show (in clustergram order)", min_value=0, max_value=n_genes, value=window, step=1)
+                    ss.save_state({'clust_window':window})
+                    st.plotly_chart(clustergram.plotly_clustergram(ordered_vals, start=window[0], stop=window[1], vminmax=st.session_state['clust_vminmax']),
+                                    theme=None, use_container_width=True)
         
         else:
             st.error("At least 2 genes must be entered or more than 1 comparison must be made!")
@@ -1,4 +1,3 @@
-import gseapy as gp
 import pandas as pd
 import numpy as np
 import re
@@ -150,6 +149,5 @@ if plot_enr:
             for k,v in res_all.items():
                 st.write(f"**{k}**")
                 st.dataframe(v)
-            st.download_button(label="Download Enrichr Results",
-                               data=file_downloads.to_excel(st.session_state['enr_res_all'].values(), sheetnames=st.session_state['enr_res_all'].keys()),
-                               file_name="Enrichr_results.xlsx")
\ No newline at end of file
+            file_downloads.download_tables(st.session_state['enr_res_all'].values(), label="Download Enrichr Results",
+                                           sheetnames=st.session_state['enr_res_all'].keys(), file_name="Enrichr_results")
\ No newline at end of file
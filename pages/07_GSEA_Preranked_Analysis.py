@@ -1,7 +1,7 @@
-import gseapy as gp
 import pandas as pd
 import numpy as np
 import re
+import os
 
 from helper_functions.session_state import ss
 from helper_functions.uploads import fileuploads
@@ -20,6 +20,12 @@ ss.initialise_state({'prerank_selected_df_idx':0,
                      'prerank_showX':10,
                      'prerank_ht':1000,
                      'plot_prerank':True,
+                     'prerank_permutations':1000,
+                     'prerank_batch':False,
+                     'prerank_batch_libs':None,
+                     'prerank_workers':os.cpu_count() or 1,
+                     'prerank_batch_all':None,
+                     'prerank_batch_sig':None,
                      'geneset_dict': {"Blood Transcriptomic Modules Plus (BTMplus)": "accessory_files/BTMPlus.gmt",
                                       "Blood Transcriptomic Modules (BTM)": "accessory_files/BTM.gmt",
                                       "Reactome 2021": "accessory_files/Reactome.gmt",
@@ -65,13 +71,13 @@ geneset_opts = list(st.session_state['geneset_dict'].keys())
 geneset_prnk = prnk_opts.radio(label='Select a geneset for prerank', options=geneset_opts, index = geneset_opts.index(st.session_state['geneset_prerank']))
 ss.save_state({'geneset_prerank':geneset_prnk})
 
-df_opts = list(st.session_state['log_dict_ready'].keys())
+df_opts = st.session_state['comparison_store'].keys()
 prerank_selected_df = prnk_opts.selectbox("Select dataframe to use in GSEA preranked analysis", options = df_opts, index = st.session_state['prerank_selected_df_idx'])
 prerank_selected_df_idx = df_opts.index(prerank_selected_df)
 ss.save_state({'prerank_selected_df_idx': prerank_selected_df_idx,
             'prerank_selected_df':prerank_selected_df})
 
-prerank_by = prnk.format_cols(st.session_state['log_dict_ready'], st.session_state['comparisons'], selected_df=st.session_state['prerank_selected_df'])
+prerank_by = prnk.format_cols(st.session_state['comparison_store'], st.session_state['comparisons'], selected_df=st.session_state['prerank_selected_df'])
 ss.save_state({'prerank_by': prerank_by})
 
 col_opts = list(st.session_state['prerank_by'].keys())
@@ -89,7 +95,60 @@ ss.save_state({
                 # 'prerank_pthresh': round(prerank_pthresh,2),
                 'prerank_showX':prerank_showX,
                 'prerank_ht':prerank_ht})
-plot_prerank = prnk_opts.checkbox("Run GSEA Prerank", value = st.session_state['plot_prerank'], on_change=ss.binaryswitch, args=("plot_prerank", ))
+prerank_permutations = prnk_opts.number_input("Number of permutations", min_value=100, max_value=10000, step=100, value=st.session_state['prerank_permutations'],
+                                               help="More permutations give more precise p-values and FDR q-values at the cost of run time")
+ss.save_state({'prerank_permutations':prerank_permutations})
+
+prerank_batch = prnk_opts.checkbox("Batch mode (all comparisons of the dataframe)", value=st.session_state['prerank_batch'], on_change=ss.binaryswitch, args=("prerank_batch", ),
+                                   help="Runs prerank for every comparison of the selected dataframe against one or more gene set libraries in parallel")
+if prerank_batch:
+    batch_libs = prnk_opts.multiselect("Gene set libraries for batch mode", options=geneset_opts,
+                                       default=[l for l in (st.session_state['prerank_batch_libs'] or [st.session_state['geneset_prerank']]) if l in geneset_opts])
+    prerank_workers = prnk_opts.number_input("Number of parallel workers", min_value=1, max_value=64, step=1, value=st.session_state['prerank_workers'])
+    ss.save_state({'prerank_batch_libs':batch_libs,
+                   'prerank_workers':prerank_workers})
+    run_batch = prnk_opts.button("Run batch GSEA Prerank")
+    plot_prerank = False
+else:
+    plot_prerank = prnk_opts.checkbox("Run GSEA Prerank", value = st.session_state['plot_prerank'], on_change=ss.binaryswitch, args=("plot_prerank", ))
+
+if prerank_batch:
+    if run_batch:
+        batch_all, batch_sig = {}, {}
+        n_runs = len(st.session_state['prerank_by']) * len(st.session_state['prerank_batch_libs'])
+        progress = prnk_plots_t.progress(0, text=f"Running {n_runs} GSEA preranked analyses")
+        get_genesets = {l:st.session_state['geneset_dict'][l] for l in st.session_state['prerank_batch_libs']}
+        runs = prnk.iter_prerank(st.session_state['prerank_by'], get_genesets,
+                                 permutation_num=st.session_state['prerank_permutations'],
+                                 workers=st.session_state['prerank_workers'])
+        for i, (key, library, results) in enumerate(runs): # results arrive as each comparison finishes
+            pos_nes, neg_nes = prnk.summarise_prerank(results, prerank_pthresh=0.05, prerank_showX=st.session_state['prerank_showX'])
+            run_name = f"{key} ({library})"
+            batch_all[run_name] = results
+            batch_sig[run_name] = {f'Positive_enrichment_{key}':pos_nes, f'Negative_enrichment_{key}':neg_nes}
+            progress.progress((i + 1) / n_runs, text=f"Finished {run_name} ({i + 1}/{n_runs})")
+            prnk_plots_t.plotly_chart(prnk.prerank_barplot(batch_sig[run_name], selected_col=key, select_dataset=library,
+                                                           prerank_showX=st.session_state['prerank_showX'],
+                                                           prerank_ht=st.session_state['prerank_ht']),
+                                      theme=None, use_container_width=False)
+        ss.save_state({'prerank_batch_all':batch_all,
+                       'prerank_batch_sig':batch_sig})
+    elif st.session_state['prerank_batch_sig'] is not None:
+        for run_name, sig in st.session_state['prerank_batch_sig'].items():
+            key, library = run_name.rsplit(" (", 1)
+            prnk_plots_t.plotly_chart(prnk.prerank_barplot(sig, selected_col=key, select_dataset=library[:-1],
+                                                           prerank_showX=st.session_state['prerank_showX'],
+                                                           prerank_ht=st.session_state['prerank_ht']),
+                                      theme=None, use_container_width=False)
+
+    if st.session_state['prerank_batch_all'] is not None:
+        with prnk_data_t:
+            for run_name, sig in st.session_state['prerank_batch_sig'].items():
+                for k,v in sig.items():
+                    st.write(f"**{k} ({run_name.rsplit(' (', 1)[1]}**")
+                    st.dataframe(v)
+            file_downloads.download_tables(st.session_state['prerank_batch_all'].values(), label="Download GSEA Preranked Results",
+                                           sheetnames=st.session_state['prerank_batch_all'].keys(), file_name="GSEAPreranked_batch_results", key="prerank_batch_dl")
 
 if plot_prerank:
     get_col = {st.session_state['prerank_choose_col']:st.session_state['prerank_by'][st.session_state['prerank_choose_col']]}
@@ -97,7 +156,8 @@ if plot_prerank:
     all_res, sig_res = prnk.execute_prerank(col_dict=get_col,
                                             select_dataset=get_geneset,
                                             prerank_pthresh=0.05,
-                                            prerank_showX=st.session_state['prerank_showX'])
+                                            prerank_showX=st.session_state['prerank_showX'],
+                                            permutation_num=st.session_state['prerank_permutations'])
     ss.save_state({'prerank_res_all':all_res,
                 'prerank_res_sig':sig_res})
     sig_plots = prnk.prerank_barplot(st.session_state['prerank_res_sig'],
@@ -115,6 +175,5 @@ if plot_prerank:
         for k,v in sig_res.items():
             st.write(f"**{k}**")
             st.dataframe(v)
-        st.download_button(label="Download GSEA Preranked Results",
-                        data=file_downloads.to_excel(st.session_state['prerank_res_all'].values(),sheetnames=st.session_state['prerank_res_all'].keys()),
-                        file_name="GSEAPreranked_results.xlsx")
\ No newline at end of file
+        file_downloads.download_tables(st.session_state['prerank_res_all'].values(), label="Download GSEA Preranked Results",
+                                       sheetnames=st.session_state['prerank_res_all'].keys(), file_name="GSEAPreranked_results")
\ No newline at end of file
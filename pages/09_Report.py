@@ -1,7 +1,6 @@
 import streamlit as st
 import streamlit.components.v1 as components
 
-import jinja2
 import pdfkit
 import base64
 from io import BytesIO
@@ -12,7 +11,7 @@ from PIL import Image
 from datetime import datetime
 import pytz
 
-from helper_functions.downloads import file_downloads
+from helper_functions.report import stages_report
 
 
 st.header("Report Generation")
@@ -29,7 +28,7 @@ all_plots_bytes = {}
 for key in ['corr_matrix_plot','cdf_plot', 'barplot', 'enrichr_plots', 'prerank_plots']:
     if key in st.session_state:
         if st.session_state[key] is not None:
-            to_bytes = file_downloads.plot_to_bytes(st.session_state[key], graph_module='plotly', format='png')
+            to_bytes = stages_report.plot_to_bytes(st.session_state[key], graph_module='plotly', format='png')
             all_plots_bytes[key] = to_bytes
         else:
             all_plots_bytes[key] = None
@@ -39,20 +38,20 @@ for key in ['corr_matrix_plot','cdf_plot', 'barplot', 'enrichr_plots', 'prerank_
 for key in ['volcano_plots_static', 'clustergram_plot']:
     if key in st.session_state:
         if st.session_state[key] is not None:
-            to_bytes = file_downloads.plot_to_bytes(st.session_state[key], graph_module='pyplot', format='png')
+            to_bytes = stages_report.plot_to_bytes(st.session_state[key], graph_module='pyplot', format='png')
             all_plots_bytes[key] = to_bytes
         else:
             all_plots_bytes[key] = None
     else:
         all_plots_bytes[key] = None
 
-# cmatrix = file_downloads.plot_to_bytes(st.session_state['corr_matrix_plot'], graph_module="plotly", format="png")
-# volplot = file_downloads.plot_to_bytes(st.session_state['volcano_plots'][0], graph_module="pyplot", format="png") # As a static plot, use the matplotlib one only
-# cdf = file_downloads.plot_to_bytes(st.session_state['cdf_plot'], graph_module="plotly", format="png")
-# barplot = file_downloads.plot_to_bytes(st.session_state['barplot'], graph_module="plotly", format="png")
-# clustergram = file_downloads.plot_to_bytes(st.session_state['clustergram_plot'], graph_module="pyplot", format="png")
-# enrichr = file_downloads.plot_to_bytes(st.session_state['enrichr_plots'], graph_module="plotly", format="png")
-# prerank = file_downloads.plot_to_bytes(st.session_state['prerank_plots'], graph_module="plotly", format="png")
+# cmatrix = stages_report.plot_to_bytes(st.session_state['corr_matrix_plot'], graph_module="plotly", format="png")
+# volplot = stages_report.plot_to_bytes(st.session_state['volcano_plots'][0], graph_module="pyplot", format="png") # As a static plot, use the matplotlib one only
+# cdf = stages_report.plot_to_bytes(st.session_state['cdf_plot'], graph_module="plotly", format="png")
+# barplot = stages_report.plot_to_bytes(st.session_state['barplot'], graph_module="plotly", format="png")
+# clustergram = stages_report.plot_to_bytes(st.session_state['clustergram_plot'], graph_module="pyplot", format="png")
+# enrichr = stages_report.plot_to_bytes(st.session_state['enrichr_plots'], graph_module="plotly", format="png")
+# prerank = stages_report.plot_to_bytes(st.session_state['prerank_plots'], graph_module="plotly", format="png")
 
 if 'string_plots' in st.session_state:
     string = {}
@@ -90,30 +89,24 @@ for key in ['bar_pval', 'bar_fc', 'geneset_enr', 'enr_genedict', 'geneset_preran
         else:
             session_data[key] = None
 
-templateLoader = jinja2.FileSystemLoader(searchpath="accessory_files/")
-templateEnv = jinja2.Environment(loader=templateLoader)
-TEMPLATE_FILE = "output_report_template.html"
-template = templateEnv.get_template(TEMPLATE_FILE)
-
-
-outputText = template.render(date = dt_string,
-                             cmatrix = all_plots_bytes['corr_matrix_plot'],
-                             volplot = all_plots_bytes['volcano_plots_static'],
-                             cdf= all_plots_bytes['cdf_plot'],
-                             barplot=all_plots_bytes['barplot'],
-                             pval_fmt=pval_fmt,
-                             bar_pval=session_data['bar_pval'],
-                             bar_fc=session_data['bar_fc'],
-                             clustergram=all_plots_bytes['clustergram_plot'],
-                             geneset_enr=session_data['geneset_enr'],
-                             enr_genedict=session_data['enr_genedict'],
-                             enr_showX=session_data['enr_showX'],
-                             enrichr=all_plots_bytes['enrichr_plots'],
-                             geneset_prerank=session_data['geneset_prerank'],
-                             prerank_choose_col=session_data['prerank_choose_col'],
-                             prerank_showX=session_data['prerank_showX'],
-                             prerank=all_plots_bytes['prerank_plots'],
-                             string_dict=string)
+outputText = stages_report.render_report(date = dt_string,
+                                          cmatrix = all_plots_bytes['corr_matrix_plot'],
+                                          volplot = all_plots_bytes['volcano_plots_static'],
+                                          cdf= all_plots_bytes['cdf_plot'],
+                                          barplot=all_plots_bytes['barplot'],
+                                          pval_fmt=pval_fmt,
+                                          bar_pval=session_data['bar_pval'],
+                                          bar_fc=session_data['bar_fc'],
+                                          clustergram=all_plots_bytes['clustergram_plot'],
+                                          geneset_enr=session_data['geneset_enr'],
+                                          enr_genedict=session_data['enr_genedict'],
+                                          enr_showX=session_data['enr_showX'],
+                                          enrichr=all_plots_bytes['enrichr_plots'],
+                                          geneset_prerank=session_data['geneset_prerank'],
+                                          prerank_choose_col=session_data['prerank_choose_col'],
+                                          prerank_showX=session_data['prerank_showX'],
+                                          prerank=all_plots_bytes['prerank_plots'],
+                                          string_dict=string)
 html_file = open("STAGES_report.html", 'w')
 html_file.write(outputText)
 html_file.close()
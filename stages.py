@@ -1,5 +1,4 @@
 import streamlit as st
-import gseapy as gp
 
 st.set_page_config(page_title='Home', page_icon='🏠')
 st.title("STAGEs Dashboard \U0001F4CA")
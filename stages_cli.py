@@ -0,0 +1,72 @@
+'''
+Headless STAGES: runs the pre-processing, DEG, clustergram, enrichment and report stages on many studies without Streamlit.
+
+Examples
+--------
+python stages_cli.py --ratios study1.csv study2.xlsx --output-dir results --workers 4
+python stages_cli.py --counts counts.csv --metadata meta.csv --comp-var treatment --baseline control --against drugA drugB
+python stages_cli.py config.json
+'''
+import argparse
+import json
+import logging
+import os
+import sys
+
+from helper_functions.pipeline import pipeline
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run STAGES stages end-to-end on one or more studies.")
+    parser.add_argument("config", nargs="?", help="JSON config with a 'studies' list and stage settings, see README")
+    parser.add_argument("--ratios", nargs="+", default=[], help="ratio and p-value files, one study per file")
+    parser.add_argument("--counts", help="counts or log2-normalised expression file (genes x samples)")
+    parser.add_argument("--metadata", help="metadata file of the counts study (samples x variables)")
+    parser.add_argument("--data-type", choices=["counts", "log2"], help="type of the --counts file")
+    parser.add_argument("--comp-var", help="metadata column to compare groups by")
+    parser.add_argument("--baseline", nargs="+", help="baseline group(s) of --comp-var")
+    parser.add_argument("--against", nargs="+", help="group(s) of --comp-var to compare against the baseline")
+    parser.add_argument("--output-dir", help="folder to write results to, one sub-folder per study")
+    parser.add_argument("--stages", nargs="+", choices=pipeline.stage_order, help="stages to run (default: all)")
+    parser.add_argument("--workers", type=int, default=1, help="number of studies processed in parallel")
+    return parser.parse_args(argv)
+
+def build_config(args):
+    config = pipeline.load_config(args.config) if args.config else {}
+    studies = list(config.get('studies', []))
+    studies += [{'ratios': f} for f in args.ratios]
+    if args.counts is not None:
+        if None in [args.metadata, args.comp_var, args.baseline, args.against]:
+            sys.exit("--counts needs --metadata, --comp-var, --baseline and --against")
+        studies.append({'counts': args.counts, 'metadata': args.metadata, 'comp_var': args.comp_var,
+                        'baseline': args.baseline, 'against_baseline': args.against})
+    config['studies'] = studies
+
+    for key, value in [('output_dir', args.output_dir), ('stages', args.stages), ('data_type', args.data_type)]:
+        if value is not None:
+            config[key] = value
+    return config
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    args = parse_args(argv)
+    config = build_config(args)
+    if len(config['studies']) == 0:
+        sys.exit("No studies given: pass a config file, --ratios or --counts")
+    try:
+        pipeline.check_studies(config)
+    except ValueError as e:
+        sys.exit(str(e))
+
+    summaries = []
+    for summary in pipeline.run(config, workers=args.workers):
+        logging.info("%s: completed %s, failed %s", summary['name'], summary['completed'], list(summary['failed'].keys()))
+        summaries.append(summary)
+
+    output_dir = config.get('output_dir', pipeline.defaults['output_dir'])
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "summary.json"), "w") as f:
+        json.dump(summaries, f, indent=2)
+    return 1 if any(len(s['failed']) != 0 for s in summaries) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())